@@ -7,6 +7,33 @@ BOT_NAME="qvc-welcome"
 SERVICE_NAME="qvc-welcome.service"
 BOT_DIR="/opt/qvaclick/bots/qvc-welcome-bot"
 
+# Puerto del endpoint local (/metrics, /healthz, /readyz): entorno o .env del bot
+metrics_port() {
+    local port="${METRICS_PORT:-}"
+    if [ -z "$port" ] && [ -f "$BOT_DIR/.env" ]; then
+        port=$(grep -E '^METRICS_PORT=' "$BOT_DIR/.env" | tail -n 1 | cut -d= -f2 | awk '{print $1}')
+    fi
+    echo "$port"
+}
+
+# Imprime /readyz y devuelve 0 si el bot está listo
+check_ready() {
+    local port
+    port=$(metrics_port)
+    if [ -z "$port" ]; then
+        echo "METRICS_PORT no definido: sin endpoint de salud"
+        return 2
+    fi
+    local out code
+    out=$(curl -s --max-time 3 -w '\n%{http_code}' "http://127.0.0.1:$port/readyz") || {
+        echo "Sin respuesta en 127.0.0.1:$port (¿bot caído o event loop bloqueado?)"
+        return 1
+    }
+    code="${out##*$'\n'}"
+    echo "${out%$'\n'*}"
+    [ "$code" = "200" ]
+}
+
 case "$1" in
     start)
         echo "🚀 Iniciando $BOT_NAME..."
@@ -37,8 +64,13 @@ case "$1" in
         echo "✅ Bot reiniciado"
         ;;
     reload)
-        echo "⚙️ Recargando configuración de $BOT_NAME..."
-        # Recargar daemon y reiniciar
+        echo "⚙️ Recargando configuración de $BOT_NAME (SIGHUP, sin reiniciar)..."
+        # ExecReload del unit o, si no lo tiene, SIGHUP directo; el bot relee .env en caliente
+        sudo systemctl reload $SERVICE_NAME 2>/dev/null || sudo systemctl kill -s HUP --kill-who=main $SERVICE_NAME
+        echo "✅ Señal enviada (revisa '$0 logs': 'Configuración recargada')"
+        ;;
+    reload-unit)
+        echo "⚙️ Recargando el unit de systemd y reiniciando $BOT_NAME..."
         sudo systemctl daemon-reload
         $0 restart
         ;;
@@ -48,6 +80,48 @@ case "$1" in
         echo ""
         echo "🔍 Procesos del bot:"
         ps aux | grep -E "(main.py|python.*qvc)" | grep -v grep || echo "No hay procesos manuales corriendo"
+        echo ""
+        echo "🩺 Salud (/readyz):"
+        if check_ready; then echo "✅ Listo"; else echo "⚠️ No listo"; fi
+        ;;
+    health)
+        # Código de salida 0 = listo, 1 = no listo o sin respuesta, 2 = sin endpoint
+        check_ready
+        exit $?
+        ;;
+    pool-status)
+        echo "🧩 Workers del modo shard (SHARD_WORKERS):"
+        ps -eo pid,ppid,etime,rss,args | grep -E "main.py( |$)" | grep -v grep || echo "No hay procesos del bot"
+        echo ""
+        echo "🔌 Sockets de los workers:"
+        ls -l "${SHARD_RUN_DIR:-$BOT_DIR/run}"/shard-*.sock 2>/dev/null || echo "Ninguno (modo de un solo proceso)"
+        ;;
+    export)
+        # Snapshot binario de todo el estado (ajustes, auto-clean, borrados pendientes, cachés).
+        # En modo multi-bot (BOTS_FILE), BOT=<nombre> elige el bot: BOT=comunidad_a $0 export
+        out="${2:-$PWD/qvc-welcome-$(date +%Y%m%d-%H%M%S).snap}"
+        echo "📦 Exportando el estado de $BOT_NAME a $out..."
+        (cd "$BOT_DIR" && "${PYTHON:-$BOT_DIR/.venv/bin/python}" main.py --export-snapshot - ${BOT:+--bot "$BOT"}) > "$out.tmp" && mv "$out.tmp" "$out" || {
+            rm -f "$out.tmp"
+            echo "❌ Exportación fallida"
+            exit 1
+        }
+        echo "✅ Snapshot guardado en $out"
+        ;;
+    import)
+        if [ -z "$2" ] || [ ! -f "$2" ]; then
+            echo "Uso: $0 import <archivo.snap>"
+            exit 1
+        fi
+        snap=$(realpath "$2")
+        echo "📥 Importando $snap en $BOT_NAME (se detiene el bot durante la importación)..."
+        $0 stop
+        if (cd "$BOT_DIR" && "${PYTHON:-$BOT_DIR/.venv/bin/python}" main.py --import-snapshot "$snap" ${BOT:+--bot "$BOT"}); then
+            echo "✅ Estado importado"
+        else
+            echo "❌ Importación fallida: el estado anterior no se ha modificado"
+        fi
+        $0 start
         ;;
     logs)
         echo "📋 Logs de $BOT_NAME:"
@@ -56,14 +130,20 @@ case "$1" in
     *)
         echo "🤖 Gestor del QvaClick Welcome Bot"
         echo ""
-        echo "Uso: $0 {start|stop|restart|reload|status|logs}"
+        echo "Uso: $0 {start|stop|restart|reload|reload-unit|status|health|pool-status|export|import|logs}"
         echo ""
         echo "Comandos:"
         echo "  start    - Iniciar el bot"
         echo "  stop     - Detener el bot"
         echo "  restart  - Reiniciar el bot (recomendado después de cambios)"
-        echo "  reload   - Recargar configuración y reiniciar"
+        echo "  reload   - Recargar .env (y BOTS_FILE) sin reiniciar (chats permitidos, superadmins, topic, auto-borrado)"
+        echo "  reload-unit - Recargar el unit de systemd y reiniciar"
         echo "  status   - Ver estado del bot"
+        echo "  health   - Comprobar /readyz (código de salida 0 si está listo)"
+        echo "  pool-status - Ver workers y sockets del modo shard"
+        echo "  export [archivo] - Exportar todo el estado a un snapshot (migración entre hosts)"
+        echo "  import <archivo> - Importar un snapshot (detiene y vuelve a arrancar el bot)"
+        echo "                     (modo multi-bot: BOT=<nombre> $0 export|import ...)"
         echo "  logs     - Ver logs en tiempo real"
         echo ""
         echo "Ejemplos:"
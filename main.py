@@ -8,19 +8,68 @@
 # WELCOME_TOPIC_ID=12                              # (opcional) si se omite/vacío, no usa topic
 # SUPER_ADMIN_IDS=111111111,222222222              # (opcional) IDs de usuario con permisos forzados
 # WELCOME_DELETE_SECONDS=0                         # (opcional) segundos para borrar la bienvenida (0=desactivado)
+# WELCOME_FANOUT=5                                 # (opcional) máx. bienvenidas enviadas en paralelo
+# LOG_LEVEL=INFO                                  # (opcional) nivel global de logs
+# LOG_LEVELS=qvc.welcome=DEBUG,httpx=WARNING       # (opcional) niveles por módulo
+# BOT_DATA_DIR=/var/lib/qvc-welcome                # (opcional) directorio de archivos por chat (por defecto, junto a main.py)
+# BOT_API_BASE_URL=http://127.0.0.1:8081/bot       # (opcional) Bot API alternativa (tools/fake_bot_api.py)
+# RECORD_UPDATES_DIR=recordings                    # (opcional) graba updates anonimizados (.jsonl.gz) para tools/replay.py
+# SHARD_WORKERS=4                                  # (opcional) reparte los chats entre N procesos (ver README)
+# API_RATE_LIMIT=30                                # (opcional) máx. llamadas/s a la Bot API (global; 30 por defecto en modo shard)
+# API_CHAT_RATE_PER_MIN=20                         # (opcional) máx. envíos por minuto y chat
+# HTTP_POOL_SIZE=256                               # (opcional) conexiones del pool de llamadas salientes
+# HTTP_KEEPALIVE=32                                # (opcional) conexiones keep-alive conservadas (HTTP_KEEPALIVE_EXPIRY=30 s)
+# HTTP2=0                                          # (opcional) 1 = HTTP/2 (requiere httpx[http2])
+# HTTP_CONNECT_TIMEOUT=5                           # (opcional) también HTTP_READ_TIMEOUT, HTTP_WRITE_TIMEOUT, HTTP_POOL_TIMEOUT=1
+# AUTO_CLEAN_CONCURRENCY=2                         # (opcional) máx. auto-cleans simultáneos
+# DELETE_TARGET_RATE=30                            # (opcional) borrados/s objetivo del ejecutor adaptativo (DELETE_MAX_CONCURRENCY=16)
+# BOT_STATE_DB=/var/lib/qvc-welcome/state.sqlite3 # (opcional) base SQLite del estado por chat (por defecto, state.sqlite3 en BOT_DATA_DIR)
+# PERSISTENCE_FLUSH_SECONDS=30                     # (opcional) cada cuánto se guardan los chats modificados
+# STICKY_REPOST_AFTER_MESSAGES=30                  # (opcional) bienvenida sticky: republicar tras N mensajes (STICKY_MAX_AGE_SECONDS=21600)
+# API_RETRY_DEADLINE=30                            # (opcional) plazo de reintentos por llamada (CIRCUIT_FAILURES=5, CIRCUIT_COOLDOWN=30)
+# SLOW_CALLBACK_MS=100                            # (opcional) registra callbacks del loop más lentos (0=desactivado)
+# READY_MAX_LAG_MS=500                             # (opcional) /readyz falla si el p99 del lag lo supera (READY_MAX_POLL_AGE=90)
+# FAST_RUNTIME=1                                  # (opcional) usa uvloop/orjson si están instalados (0=asyncio+json estándar)
+# BULK_RATE=20                                     # (opcional) mensajes/s de /broadcast (BULK_CONCURRENCY=4)
+# SNAPSHOT_WARM_START=1                            # (opcional) guarda el índice al apagar y arranca desde él (ver README)
+# BOTS_FILE=bots.json                              # (opcional) varios bots en un proceso: lista JSON de tokens y ajustes (ver README)
+# METRICS_PORT=9108                               # (opcional) endpoint local /metrics (Prometheus)
+# ADMIN_CACHE_SECONDS=60                           # (opcional) TTL de la caché de is_admin (0=desactivada)
 
 import os
+import argparse
 import asyncio
+import fcntl
+import hashlib
+import heapq
+import io
 import json
+import logging
+import logging.handlers
+import math
+import queue
+import random
+import re
+import signal
+import socket
+import sqlite3
+import struct
+import subprocess
+import sys
+import threading
 import time
+import weakref
+import zlib
 from collections import defaultdict, deque
 from typing import Dict, Tuple
 from collections import defaultdict, deque
+from datetime import datetime, timezone
 from html import escape
 from pathlib import Path
-from typing import Set, Optional, List, Deque, Dict, Tuple
+from typing import TYPE_CHECKING, Set, Optional, List, Deque, Dict, Tuple
 
-from dotenv import load_dotenv
+import httpx
+from dotenv import dotenv_values, load_dotenv
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
@@ -28,25 +77,47 @@ from telegram import (
     BotCommand,
 )
 from telegram.constants import ParseMode, ChatType
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
 from telegram.ext import (
     Application,
+    BasePersistence,
+    ExtBot,
+    Job,
+    JobQueue,
+    PersistenceInput,
     MessageHandler,
     CommandHandler,
     ContextTypes,
+    TypeHandler,
     filters,
 )
+from telegram.request import HTTPXRequest
+
+if TYPE_CHECKING:
+    # Sólo para anotaciones: en ejecución se importa al activar /prof_mem
+    import tracemalloc
+
+# Fin de los imports (fase "imports" del arranque, ver StartupTimeline)
+_IMPORTED_AT = time.time()
 
 # Package version
 __version__ = "1.0.0"
 
 # === Cargar variables desde .env ===
-load_dotenv(Path(__file__).with_name(".env"))
+ENV_PATH = Path(__file__).with_name(".env")
+# Variables fijadas por el entorno real (systemd, shell): tienen prioridad sobre .env también al recargar
+_ENV_FROM_PROCESS = frozenset(os.environ)
+load_dotenv(ENV_PATH)
 
 BOT_TOKEN = os.environ.get("BOT_TOKEN", "").strip()
 RAW_ALLOWED = os.environ.get("ALLOWED_CHAT_IDS", "").strip()
 RAW_TOPIC = os.environ.get("WELCOME_TOPIC_ID", "").strip()
 RAW_SUPERADM = os.environ.get("SUPER_ADMIN_IDS", "").strip()
 RAW_DELETE = os.environ.get("WELCOME_DELETE_SECONDS", "").strip()
+# Directorio de datos por chat (textos, TTLs, pendientes); por defecto junto a main.py
+DATA_DIR = Path(os.environ.get("BOT_DATA_DIR", "").strip() or Path(__file__).parent)
+# URL base alternativa de la Bot API (p. ej. tools/fake_bot_api.py): http://127.0.0.1:8081/bot
+BOT_API_BASE_URL = os.environ.get("BOT_API_BASE_URL", "").strip()
 
 
 def parse_ids(raw: str) -> Set[int]:
@@ -64,34 +135,875 @@ def parse_ids(raw: str) -> Set[int]:
     return ids
 
 
+def parse_topic_id(raw: str) -> Optional[int]:
+    """Topic de bienvenida; vacío o no entero = sin topic."""
+    try:
+        return int(raw) if raw else None
+    except ValueError:
+        return None
+
+
+def parse_delete_seconds(raw: str) -> int:
+    """Segundos de auto-borrado; vacío o inválido = 0 (desactivado)."""
+    try:
+        return max(0, int(raw)) if raw else 0
+    except ValueError:
+        return 0
+
+
 ALLOWED_CHAT_IDS = parse_ids(RAW_ALLOWED)
 SUPER_ADMIN_IDS = parse_ids(RAW_SUPERADM)
+WELCOME_TOPIC_ID: Optional[int] = parse_topic_id(RAW_TOPIC)
+# Tiempo para borrar la bienvenida automáticamente (0 o vacío = desactivado)
+WELCOME_DELETE_SECONDS: int = parse_delete_seconds(RAW_DELETE)
 
-WELCOME_TOPIC_ID: Optional[int] = None
-try:
-    if RAW_TOPIC:
-        WELCOME_TOPIC_ID = int(RAW_TOPIC)
-except ValueError:
-    WELCOME_TOPIC_ID = None  # si no es entero, se ignora
+# === Logging estructurado y no bloqueante ===
+# Los handlers sólo encolan registros; un hilo (QueueListener) hace la escritura
+# a stderr/journald. Los campos clave=valor van en extra=_kv(...).
+RAW_LOG_LEVEL = os.environ.get("LOG_LEVEL", "").strip() or "INFO"
+RAW_LOG_LEVELS = os.environ.get("LOG_LEVELS", "").strip()
+
+log = logging.getLogger("qvc")
+log_welcome = logging.getLogger("qvc.welcome")
+log_admin = logging.getLogger("qvc.admin")
+log_persist = logging.getLogger("qvc.persist")
+log_clean = logging.getLogger("qvc.clean")
+log_health = logging.getLogger("qvc.health")
+
+
+def _kv(**fields) -> dict:
+    """Campos estructurados para `extra=`; se formatean como clave=valor al final de la línea."""
+    return {"fields": fields}
+
+
+def _env_number(name: str, default, minimum, kind):
+    raw = os.environ.get(name, "").strip()
+    if not raw:
+        return default
+    try:
+        value = kind(raw)
+    except ValueError:
+        log.warning("%s=%r no es válido; se usa %s", name, raw, default)
+        return default
+    return value if minimum is None else max(minimum, value)
+
+
+def _env_int(name: str, default: int, minimum: Optional[int] = None) -> int:
+    """Entero de la variable `name` (vacía = `default`), con `minimum` como cota inferior. Cada
+    variable se lee por separado: un valor inválido se avisa en el log y deja su valor por defecto."""
+    return _env_number(name, default, minimum, int)
+
+
+def _env_float(name: str, default: float, minimum: Optional[float] = None) -> float:
+    """Como _env_int, para valores decimales."""
+    return _env_number(name, default, minimum, float)
+
+
+class KeyValueFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None)
+        record.kv = (" " + " ".join(f"{k}={v}" for k, v in fields.items())) if fields else ""
+        return super().format(record)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # Sin formatear en el hilo del event loop: el listener formatea al escribir.
+    # Los argumentos que pasamos a los logs son inmutables (ints/str), así que es seguro.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def parse_log_levels(raw: str) -> Dict[str, int]:
+    """Parsea 'modulo=NIVEL,otro=NIVEL'. Ignora entradas inválidas."""
+    levels: Dict[str, int] = {}
+    for token in raw.replace(";", ",").split(","):
+        name, sep, level = token.strip().partition("=")
+        if not sep or not name.strip():
+            continue
+        value = logging.getLevelName(level.strip().upper())
+        if isinstance(value, int):
+            levels[name.strip()] = value
+    return levels
+
+
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Instala el QueueHandler en el logger raíz y arranca el listener (idempotente)."""
+    global _log_listener
+    if _log_listener is not None:
+        return _log_listener
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(KeyValueFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s%(kv)s"))
+    q: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [_DeferredQueueHandler(q)]
+    base_level = logging.getLevelName(RAW_LOG_LEVEL.upper())
+    root.setLevel(base_level if isinstance(base_level, int) else logging.INFO)
+    # httpx registra cada petición en INFO; salvo que se pida, sólo avisos
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    for name, level in parse_log_levels(RAW_LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+    _log_listener = logging.handlers.QueueListener(q, stream, respect_handler_level=True)
+    _log_listener.start()
+    return _log_listener
+
+
+def shutdown_logging() -> None:
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
+# === Runtime opcional: uvloop y orjson ===
+# Si están instalados se usan por defecto (FAST_RUNTIME=0 fuerza asyncio + json de la
+# biblioteca estándar, p. ej. para comparar con tools/bench.py). Sin ellos no cambia nada.
+FAST_RUNTIME = os.environ.get("FAST_RUNTIME", "").strip().lower() not in ("0", "false", "no", "off")
+
+_orjson = None
+if FAST_RUNTIME:
+    try:
+        import orjson as _orjson
+    except ImportError:
+        _orjson = None
+JSON_CODEC = "orjson" if _orjson is not None else "json"
+
+
+def json_dumps(obj, default=None) -> str:
+    """JSON compacto en UTF-8 (sin escapes ASCII); las claves enteras se pasan a texto como en json."""
+    if _orjson is not None:
+        return _orjson.dumps(obj, default=default, option=_orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=default)
+
+
+def json_loads(data):
+    """Acepta str o bytes; lanza ValueError si no es JSON válido (orjson.JSONDecodeError lo es)."""
+    if _orjson is not None:
+        return _orjson.loads(data)
+    return json.loads(data)
+
+
+def install_event_loop_policy() -> str:
+    """Instala uvloop como política de asyncio si está disponible; devuelve el loop en uso."""
+    if FAST_RUNTIME:
+        try:
+            import uvloop
+        except ImportError:
+            return "asyncio"
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        return f"uvloop {uvloop.__version__}"
+    return "asyncio"
+
+
+def runtime_description(loop_name: str) -> str:
+    codec = JSON_CODEC if _orjson is None else f"orjson {_orjson.__version__}"
+    return f"loop={loop_name} json={codec} python={sys.version.split()[0]}"
+
+
+# === Métricas (formato de texto Prometheus) ===
+# Registro en proceso: contadores, gauges e histogramas con etiquetas.
+# Las llamadas a la Bot API se instrumentan centralmente en InstrumentedRequest.
+RAW_METRICS_PORT = os.environ.get("METRICS_PORT", "").strip()
+METRICS_HOST = os.environ.get("METRICS_HOST", "").strip() or "127.0.0.1"
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "", const: str = "") -> str:
+    parts = [const] if const else []
+    parts.extend(f'{n}="{v}"' for n, v in zip(names, values))
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labelnames: Tuple[str, ...] = ()):
+        self.name, self.doc, self.labelnames = name, doc, labelnames
+        self._values: Dict[LabelValues, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        self._values[tuple(str(labels.get(n, "")) for n in self.labelnames)] += amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0.0)
+
+    def render(self, const: str = "") -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for key, val in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key, const=const)} {val:g}")
+        return lines
+
+
+class Gauge:
+    """Gauge leído bajo demanda: `fn` devuelve un número o {tupla_etiquetas: valor}."""
+
+    def __init__(self, name: str, doc: str, fn, labelnames: Tuple[str, ...] = ()):
+        self.name, self.doc, self.fn, self.labelnames = name, doc, fn, labelnames
+
+    def render(self, const: str = "") -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge"]
+        try:
+            val = self.fn()
+        except Exception:
+            return lines
+        if isinstance(val, dict):
+            for key, v in sorted(val.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key, const=const)} {v:g}")
+        else:
+            lines.append(f"{self.name}{_format_labels((), (), const=const)} {val:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, buckets: Tuple[float, ...], labelnames: Tuple[str, ...] = ()):
+        self.name, self.doc, self.buckets, self.labelnames = name, doc, buckets, labelnames
+        # etiquetas -> [conteos por bucket..., suma, total]
+        self._series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self, const: str = "") -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0.0
+            for i, bound in enumerate(self.buckets):
+                cumulative += series[i]
+                le = _format_labels(self.labelnames, key, 'le="%g"' % bound, const)
+                lines.append(f"{self.name}_bucket{le} {cumulative:g}")
+            le = _format_labels(self.labelnames, key, 'le="+Inf"', const)
+            lines.append(f"{self.name}_bucket{le} {series[-1]:g}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key, const=const)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key, const=const)} {series[-1]:g}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, doc: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, doc, labelnames))
+
+    def gauge(self, name: str, doc: str, fn, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, doc, fn, labelnames))
+
+    def histogram(self, name: str, doc: str, buckets: Tuple[float, ...], labelnames: Tuple[str, ...] = ()) -> Histogram:
+        return self.register(Histogram(name, doc, buckets, labelnames))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def render_labeled(self, sources: Dict[str, "MetricsRegistry"], label: str, own: Tuple[str, ...] = ()) -> str:
+        """Como render(), pero las métricas que no están en `own` se leen de cada registro de
+        `sources` con la etiqueta fija label="<clave>" (modo multi-bot: un registro por bot)."""
+        lines: List[str] = []
+        for name, metric in self._metrics.items():
+            if name in own:
+                lines.extend(metric.render())
+                continue
+            lines.extend(metric.render()[:2])
+            for key, registry in sources.items():
+                other = registry._metrics.get(name)
+                if other is not None:
+                    lines.extend(other.render(f'{label}="{key}"')[2:])
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+M_JOINS = METRICS.counter("qvc_joins_total", "Nuevos miembros (no bots) detectados")
+M_WELCOMES = METRICS.counter("qvc_welcomes_total", "Bienvenidas enviadas", ("result",))
+M_WELCOME_LATENCY = METRICS.histogram(
+    "qvc_welcome_latency_seconds", "Latencia desde el handler de unión hasta la bienvenida visible", LATENCY_BUCKETS
+)
+M_API_REQUESTS = METRICS.counter("qvc_api_requests_total", "Llamadas a la Bot API", ("method", "code"))
+M_API_LATENCY = METRICS.histogram("qvc_api_latency_seconds", "Latencia de la Bot API por método", LATENCY_BUCKETS, ("method",))
+M_API_429 = METRICS.counter("qvc_api_rate_limited_total", "Respuestas 429 (RetryAfter) de la Bot API", ("method",))
+M_DELETES = METRICS.counter("qvc_deletes_total", "Borrados de mensajes vía Bot API", ("result",))
+M_RATE_LIMIT_WAIT = METRICS.histogram(
+    "qvc_rate_limit_wait_seconds", "Esperas impuestas por el límite de tasa saliente", LATENCY_BUCKETS, ("method",)
+)
+M_ADMIN_CACHE = METRICS.counter("qvc_admin_cache_total", "Consultas a la caché de is_admin", ("result",))
+M_HTTP_POOL_WAIT = METRICS.histogram(
+    "qvc_http_pool_wait_seconds", "Espera por una conexión libre del pool HTTP", LATENCY_BUCKETS, ("pool",)
+)
+M_HTTP_POOL_TIMEOUTS = METRICS.counter("qvc_http_pool_timeouts_total", "Peticiones sin conexión libre a tiempo", ("pool",))
+
+
+# === Límite de tasa saliente (GCRA) ===
+# Global (mensajes/s a la Bot API) y por chat para envíos (mensajes/min). En modo shard
+# el estado global vive en un archivo mmap con flock, compartido por todos los procesos.
+API_RATE_LIMIT: float = _env_float("API_RATE_LIMIT", 0.0, 0.0)
+API_CHAT_RATE_PER_MIN: float = _env_float("API_CHAT_RATE_PER_MIN", 0.0, 0.0)
+
+# Métodos que no consumen cupo (control de PTB y long polling)
+_RATE_EXEMPT_METHODS = {"getUpdates", "getMe", "deleteWebhook", "setWebhook", "getWebhookInfo", "close", "logOut"}
+
+
+def _gcra(tat: float, now: float, interval: float, burst: int) -> Tuple[float, float]:
+    """Devuelve (nuevo TAT, espera en segundos) reservando una unidad."""
+    tat = max(tat, now)
+    wait = max(0.0, tat - now - (burst - 1) * interval)
+    return tat + interval, wait
+
+
+class ApiRateLimiter:
+    def __init__(self, rate_per_s: float, chat_per_min: float = 0.0, shared_path: Optional[Path] = None):
+        self.interval = 1.0 / rate_per_s if rate_per_s > 0 else 0.0
+        self.burst = max(1, int(rate_per_s))
+        self.chat_interval = 60.0 / chat_per_min if chat_per_min > 0 else 0.0
+        self.chat_burst = max(1, int(chat_per_min // 4))
+        self._tat = 0.0
+        self._chat_tat: Dict[int, float] = {}
+        self._fd: Optional[int] = None
+        self._mm = None
+        if shared_path is not None and self.interval:
+            shared_path.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(str(shared_path), os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(self._fd).st_size < 8:
+                os.ftruncate(self._fd, 8)
+            import mmap  # sólo en modo shard
+
+            self._mm = mmap.mmap(self._fd, 8)
+
+    def _reserve_global(self, now: float) -> float:
+        if self._mm is None:
+            self._tat, wait = _gcra(self._tat, now, self.interval, self.burst)
+            return wait
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            (tat,) = struct.unpack_from("d", self._mm, 0)
+            tat, wait = _gcra(tat, now, self.interval, self.burst)
+            struct.pack_into("d", self._mm, 0, tat)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return wait
+
+    async def acquire(self, api_method: str, chat_id) -> None:
+        if api_method in _RATE_EXEMPT_METHODS:
+            return
+        now = time.monotonic()  # CLOCK_MONOTONIC es común a todos los procesos del host
+        wait = 0.0
+        if self.chat_interval and api_method.startswith("send") and isinstance(chat_id, int):
+            tat, wait = _gcra(self._chat_tat.get(chat_id, 0.0), now, self.chat_interval, self.chat_burst)
+            self._chat_tat[chat_id] = tat
+        if self.interval:
+            wait = max(wait, self._reserve_global(now))
+        if wait > 0:
+            M_RATE_LIMIT_WAIT.observe(wait, method=api_method)
+            await asyncio.sleep(wait)
+
+
+# === Transporte HTTP (httpx) ===
+# Pool para las llamadas salientes; getUpdates usa siempre su propio objeto de petición
+# (una conexión) para que las ráfagas de envíos/borrados no frenen la recepción.
+HTTP_POOL_SIZE: int = _env_int("HTTP_POOL_SIZE", 256, 1)
+HTTP_KEEPALIVE: int = _env_int("HTTP_KEEPALIVE", 32, 0)
+HTTP_KEEPALIVE_EXPIRY: float = _env_float("HTTP_KEEPALIVE_EXPIRY", 30.0)
+HTTP_CONNECT_TIMEOUT: float = _env_float("HTTP_CONNECT_TIMEOUT", 5.0)
+HTTP_READ_TIMEOUT: float = _env_float("HTTP_READ_TIMEOUT", 5.0)
+HTTP_WRITE_TIMEOUT: float = _env_float("HTTP_WRITE_TIMEOUT", 5.0)
+HTTP_POOL_TIMEOUT: float = _env_float("HTTP_POOL_TIMEOUT", 1.0)
+# HTTP/2 requiere el extra httpx[http2] (paquete h2); sin él se usa HTTP/1.1
+HTTP2 = os.environ.get("HTTP2", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest que mide cada llamada a la Bot API (latencia, código, 429, borrados),
+    mide la espera por una conexión del pool y, si se le asigna `limiter`, aplica el
+    límite de tasa saliente. Con `pool` (modo multi-bot) usa el cliente httpx y la
+    admisión de esa otra petición, que es la dueña del pool y la única que lo cierra."""
+
+    limiter: Optional[ApiRateLimiter] = None
+
+    def __init__(
+        self,
+        pool_name: str = "api",
+        connection_pool_size: int = 256,
+        pool: Optional["InstrumentedRequest"] = None,
+        **kwargs,
+    ):
+        # Antes de super().__init__, que llama a _build_client
+        self.pool = pool
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+        self.pool_name = pool_name
+        self.pool_size = connection_pool_size
+        self.in_flight = 0
+        # Admisión propia del tamaño del pool: httpx no expone cuánto espera cada petición
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def _build_client(self) -> httpx.AsyncClient:
+        if self.pool is not None:
+            return self.pool._client
+        return super()._build_client()
+
+    def _admission(self) -> asyncio.Semaphore:
+        if self.pool is not None:
+            return self.pool._admission()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        return self._slots
+
+    async def initialize(self) -> None:
+        if self.pool is not None:
+            self._client = self.pool._client
+            return
+        await super().initialize()
+
+    async def shutdown(self) -> None:
+        # El pool compartido lo cierra su dueña al final del proceso
+        if self.pool is None:
+            await super().shutdown()
+
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> dict:
+        # Respuestas de la Bot API (getUpdates incluido) con orjson si está activo
+        if _orjson is None:
+            return HTTPXRequest.parse_json_payload(payload)
+        try:
+            return _orjson.loads(payload)
+        except ValueError:
+            # Bytes no UTF-8 o JSON roto: mismo tratamiento (y error) que PTB
+            return HTTPXRequest.parse_json_payload(payload)
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        if self.limiter is not None:
+            chat_id = request_data.parameters.get("chat_id") if request_data is not None else None
+            await self.limiter.acquire(api_method, chat_id)
+        slots = self._admission()
+        pool_timeout = kwargs.get("pool_timeout")
+        if not isinstance(pool_timeout, (int, float)):
+            pool_timeout = HTTP_POOL_TIMEOUT
+        queued = time.monotonic()
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=pool_timeout or None)
+        except asyncio.TimeoutError:
+            M_HTTP_POOL_TIMEOUTS.inc(pool=self.pool_name)
+            M_API_REQUESTS.inc(method=api_method, code="pool_timeout")
+            raise TimedOut(f"Pool timeout: sin conexión libre en el pool '{self.pool_name}'") from None
+        start = time.monotonic()
+        M_HTTP_POOL_WAIT.observe(start - queued, pool=self.pool_name)
+        self.in_flight += 1
+        code = "error"
+        try:
+            status, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            code = str(status)
+            return status, payload
+        finally:
+            self.in_flight -= 1
+            slots.release()
+            M_API_LATENCY.observe(time.monotonic() - start, method=api_method)
+            if api_method != "getUpdates":
+                API_LATENCIES_MS.append((time.monotonic() - start) * 1000.0)
+            M_API_REQUESTS.inc(method=api_method, code=code)
+            if code == "429":
+                M_API_429.inc(method=api_method)
+            if api_method in ("deleteMessage", "deleteMessages"):
+                M_DELETES.inc(result="ok" if code == "200" else "failed")
+            elif api_method == "getUpdates" and code == "200":
+                HEALTH.last_poll_at = time.monotonic()
+
+
+def make_request(
+    pool_name: str, pool_size: int = 0, pool: Optional[InstrumentedRequest] = None
+) -> InstrumentedRequest:
+    """Petición instrumentada configurada desde .env (HTTP_*); con `pool`, comparte su conexión."""
+    size = pool_size or HTTP_POOL_SIZE
+    http2 = HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            log.warning("HTTP2=1 pero falta el paquete h2 (pip install 'httpx[http2]'); se usa HTTP/1.1")
+            http2 = False
+    request = InstrumentedRequest(
+        pool_name,
+        connection_pool_size=size,
+        pool=pool,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        write_timeout=HTTP_WRITE_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        http_version="2" if http2 else "1.1",
+        httpx_kwargs={
+            "limits": httpx.Limits(
+                max_connections=size,
+                max_keepalive_connections=min(size, HTTP_KEEPALIVE),
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            )
+        },
+    )
+    HTTP_REQUESTS[pool_name] = request
+    return request
+
+
+# Latencias recientes de la Bot API (sin el long polling de getUpdates), para /stats
+API_LATENCIES_MS: Deque[float] = deque(maxlen=1000)
+# Peticiones creadas por make_request, por nombre de pool (para el gauge de ocupación)
+HTTP_REQUESTS: Dict[str, InstrumentedRequest] = {}
+METRICS.gauge(
+    "qvc_http_in_flight",
+    "Peticiones HTTP en curso por pool",
+    lambda: {(name,): req.in_flight for name, req in HTTP_REQUESTS.items()},
+    ("pool",),
+)
+
+
+# --- Servidor HTTP local opcional (sólo lectura) ---
+# Rutas: path -> función que devuelve (código HTTP, content-type, cuerpo)
+HTTP_ROUTES: Dict[str, object] = {
+    "/metrics": lambda: (200, "text/plain; version=0.0.4; charset=utf-8", METRICS.render()),
+}
+_http_server: Optional[asyncio.AbstractServer] = None
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Descartar cabeceras
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if not line or line in (b"\r\n", b"\n"):
+                break
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?", 1)[0] if len(parts) >= 2 else ""
+        route = HTTP_ROUTES.get(path)
+        if parts and parts[0] != "GET":
+            status, ctype, body = 405, "text/plain", "method not allowed\n"
+        elif route is None:
+            status, ctype, body = 404, "text/plain", "not found\n"
+        else:
+            status, ctype, body = route()
+        data = body.encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'ERR'}\r\n"
+            f"Content-Type: {ctype}\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+            + data
+        )
+        await writer.drain()
+    except Exception as e:
+        log.debug("Error sirviendo HTTP local: %s", e)
+    finally:
+        writer.close()
+
+
+async def start_http_server() -> None:
+    """Arranca el endpoint local si METRICS_PORT está definido (0/vacío = desactivado)."""
+    global _http_server
+    try:
+        port = int(RAW_METRICS_PORT) if RAW_METRICS_PORT else 0
+    except ValueError:
+        port = 0
+    if port <= 0 or _http_server is not None:
+        return
+    try:
+        _http_server = await asyncio.start_server(_handle_http, METRICS_HOST, port)
+        log.info("Endpoint de métricas en http://%s:%d/metrics", METRICS_HOST, port)
+    except OSError as e:
+        log.warning("No se pudo abrir el endpoint de métricas: %s", e)
+
+
+async def stop_http_server() -> None:
+    global _http_server
+    if _http_server is not None:
+        _http_server.close()
+        await _http_server.wait_closed()
+        _http_server = None
+
+
+# === Persistencia de chat_data (BasePersistence sobre SQLite) ===
+# El estado por chat (caché de mensajes para /clean_chat y flujos /set_* en espera) vive en
+# context.chat_data y se guarda en una base SQLite local. PTB agrupa las escrituras: cada
+# PERSISTENCE_FLUSH_SECONDS pasa a update_chat_data sólo los chats modificados, que se
+# escriben en una única transacción en un hilo. La carga es perezosa: get_chat_data no lee
+# nada y cada chat se lee la primera vez que llega un update suyo (refresh_chat_data) o que
+# se consulta con chat_state().
+# Claves de chat_data: "message_cache" -> deque de (message_id, user_id, is_command, is_service)
+#                        fuera de topics (grupos normales y topic General de los foros)
+#                      "topic_cache" -> {message_thread_id: deque como la anterior} por topic de foro
+#                      "waiting" -> {user_id: "waiting_for_welcome" | "waiting_for_registration"}
+BOT_STATE_DB = os.environ.get("BOT_STATE_DB", "").strip()
+# Tabla de chat_data; en modo multi-bot cada bot usa la suya (chat_data_<nombre>) en la base común
+STATE_TABLE = "chat_data"
+PERSISTENCE_FLUSH_SECONDS: float = _env_float("PERSISTENCE_FLUSH_SECONDS", 30.0, 1.0)
+MESSAGE_CACHE_SIZE = 1000
+# Topics con caché propia por chat; al superarlo se descarta la del topic más inactivo
+TOPIC_CACHE_MAX_TOPICS = 100
+
+
+def state_db_path() -> Path:
+    return Path(BOT_STATE_DB) if BOT_STATE_DB else DATA_DIR / "state.sqlite3"
+
+
+def _encode_chat_data(data: dict) -> bytes:
+    return zlib.compress(json_dumps(data, default=list).encode("utf-8"))
+
+
+def _decode_chat_data(blob: bytes) -> dict:
+    data = json_loads(zlib.decompress(blob))
+    if "message_cache" in data:
+        data["message_cache"] = deque((tuple(r) for r in data["message_cache"]), maxlen=MESSAGE_CACHE_SIZE)
+    if "topic_cache" in data:
+        data["topic_cache"] = {
+            int(k): deque((tuple(r) for r in v), maxlen=MESSAGE_CACHE_SIZE) for k, v in data["topic_cache"].items()
+        }
+    if "waiting" in data:
+        data["waiting"] = {int(k): v for k, v in data["waiting"].items()}
+    return data
+
+
+class StateDB:
+    """Conexión SQLite (WAL, autocommit) y el lock que serializa su uso entre hilos."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class ChatStatePersistence(BasePersistence):
+    """Persistencia de chat_data en SQLite con escrituras por lotes y carga perezosa por chat.
+    Con `db` usa esa conexión compartida (modo multi-bot) y no la cierra."""
+
+    def __init__(self, path: Path, update_interval: float = 30.0, db: Optional[StateDB] = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self.table = STATE_TABLE
+        self._owns_db = db is None
+        self._store = db if db is not None else StateDB(path)
+        self._db, self._lock = self._store.conn, self._store.lock
+        with self._lock:
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL)")
+        self._loaded: Set[int] = set()
+        # chat_id -> copia pendiente de escribir (None = borrar)
+        self._pending: Dict[int, Optional[dict]] = {}
+        self._writer: Optional[asyncio.Task] = None
+
+    # --- carga perezosa ---
+    def load_chat(self, chat_id: int, chat_data: dict) -> None:
+        if chat_id in self._loaded:
+            return
+        self._loaded.add(chat_id)
+        with self._lock:
+            row = self._db.execute(f"SELECT data FROM {self.table} WHERE chat_id = ?", (chat_id,)).fetchone()
+        if row is None:
+            return
+        try:
+            stored = _decode_chat_data(row[0])
+        except Exception as e:
+            log_persist.warning("chat_data ilegible, se descarta: %s", e, extra=_kv(chat_id=chat_id))
+            return
+        # Lo que ya esté en memoria (añadido antes de la carga) va después de lo guardado
+        cache = chat_data.get("message_cache")
+        if cache and "message_cache" in stored:
+            stored["message_cache"].extend(cache)
+            del chat_data["message_cache"]
+        topics = chat_data.get("topic_cache")
+        if topics and "topic_cache" in stored:
+            for thread_id, cache in topics.items():
+                stored["topic_cache"].setdefault(thread_id, deque(maxlen=MESSAGE_CACHE_SIZE)).extend(cache)
+            del chat_data["topic_cache"]
+        for key, value in stored.items():
+            chat_data.setdefault(key, value)
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    def known_group_ids(self) -> List[int]:
+        """Grupos con chat_data guardado o pendiente de guardar (IDs negativos)."""
+        with self._lock:
+            rows = self._db.execute(f"SELECT chat_id FROM {self.table} WHERE chat_id < 0").fetchall()
+        pending = {cid for cid, d in self._pending.items() if cid < 0 and d is not None}
+        return sorted({cid for (cid,) in rows} | pending)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        self.load_chat(chat_id, chat_data)
+
+    # --- escritura por lotes ---
+    def _write_batch(self, batch: Dict[int, Optional[dict]]) -> None:
+        rows = [(cid, _encode_chat_data(d)) for cid, d in batch.items() if d is not None]
+        drops = [(cid,) for cid, d in batch.items() if d is None]
+        self.write_rows(rows, drops)
+        log_persist.debug("chat_data guardado", extra=_kv(chats=len(rows), dropped=len(drops)))
+
+    def write_rows(self, rows: List[Tuple[int, bytes]], drops: List[Tuple[int]] = ()) -> None:
+        """Escribe blobs ya codificados (y borra `drops`) en una sola transacción."""
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(f"INSERT OR REPLACE INTO {self.table} (chat_id, data) VALUES (?, ?)", rows)
+                self._db.executemany(f"DELETE FROM {self.table} WHERE chat_id = ?", drops)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    async def _write_pending(self) -> None:
+        # Cede una vuelta para juntar todos los update_chat_data de esta pasada de PTB
+        await asyncio.sleep(0)
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                log_persist.exception("Error guardando chat_data: %s", e)
+
+    def _schedule_write(self) -> None:
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._write_pending())
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        # PTB ya entrega una copia profunda: se puede serializar fuera del event loop
+        self._pending[chat_id] = data
+        self._schedule_write()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._pending[chat_id] = None
+        self._loaded.discard(chat_id)
+        self._schedule_write()
+
+    async def flush(self) -> None:
+        if self._writer is not None:
+            await self._writer
+        if self._pending:
+            batch, self._pending = self._pending, {}
+            self._write_batch(batch)
+        self.close()
+
+    def close(self) -> None:
+        if self._owns_db:
+            self._store.close()
+
+    # --- datos no persistidos (store_data los desactiva) ---
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
 
-# Tiempo para borrar la bienvenida automáticamente (0 o vacío = desactivado)
-WELCOME_DELETE_SECONDS: int = 0
-try:
-    if RAW_DELETE:
-        WELCOME_DELETE_SECONDS = max(0, int(RAW_DELETE))
-except ValueError:
-    WELCOME_DELETE_SECONDS = 0
-
-# === Estado para manejo de comandos en pasos ===
-# Estructura: {(chat_id, user_id): "waiting_for_welcome" | "waiting_for_registration"}
-waiting_for_message: dict = {}
-
-# === Cache de mensajes para limpieza manual ===
-# Clave: (chat_id, message_thread_id|None) -> deque de message_id
-MessageKey = Tuple[int, Optional[int]]
-message_cache: Dict[MessageKey, Deque[int]] = defaultdict(lambda: deque(maxlen=2000))
-# Pinned por chat (IDs detectados por eventos)
-pinned_by_chat: Dict[int, Set[int]] = defaultdict(set)
+
+def chat_state(app: Application, chat_id: int) -> dict:
+    """chat_data de un chat fuera de un handler (jobs, limpiezas), cargándolo si hace falta."""
+    data = app.chat_data[chat_id]
+    if isinstance(app.persistence, ChatStatePersistence):
+        app.persistence.load_chat(chat_id, data)
+    return data
+
+
+def chat_message_cache(
+    app: Application, chat_id: int, thread_id: Optional[int] = None
+) -> Deque[Tuple[int, Optional[int], bool, bool]]:
+    """Caché de limpieza fuera de topics o, con `thread_id`, la del topic de foro."""
+    data = chat_state(app, chat_id)
+    if thread_id is not None:
+        topics = data.get("topic_cache")
+        if topics is None:
+            topics = data["topic_cache"] = {}
+        cache = topics.get(thread_id)
+        if cache is None:
+            while len(topics) >= TOPIC_CACHE_MAX_TOPICS:
+                # El de mensaje más antiguo como último (o vacío): sólo al abrir un topic nuevo
+                del topics[min(topics, key=lambda t: topics[t][-1][0] if topics[t] else 0)]
+            cache = topics[thread_id] = deque(maxlen=MESSAGE_CACHE_SIZE)
+        return cache
+    cache = data.get("message_cache")
+    if cache is None:
+        cache = data["message_cache"] = deque(maxlen=MESSAGE_CACHE_SIZE)
+    return cache
+
+
+def cached_messages(app: Application, chat_id: int, thread_id: Optional[int] = None) -> List[Tuple[int, Optional[int], bool, bool]]:
+    """Mensajes cacheados en orden de llegada: sólo los del topic si se indica `thread_id`;
+    si no, los de todo el chat (la caché general y la de cada topic, mezcladas por message_id)."""
+    if thread_id is not None:
+        return list(chat_message_cache(app, chat_id, thread_id))
+    data = chat_state(app, chat_id)
+    general = data.get("message_cache") or ()
+    topics = [c for c in (data.get("topic_cache") or {}).values() if c]
+    if not topics:
+        return list(general)
+    return list(heapq.merge(general, *topics, key=lambda rec: rec[0]))
+
+
+def cached_message_count(data: dict) -> int:
+    return len(data.get("message_cache") or ()) + sum(len(c) for c in (data.get("topic_cache") or {}).values())
+
+
+def message_topic(msg) -> Optional[int]:
+    """Topic de foro del mensaje; None fuera de foros y en el topic General."""
+    return getattr(msg, "message_thread_id", None) if getattr(msg, "is_topic_message", False) else None
+
+
+def _waiting(context: ContextTypes.DEFAULT_TYPE) -> Dict[int, str]:
+    return context.chat_data.setdefault("waiting", {})
+
+
+# === Fan-out de bienvenidas ===
+# Máximo de envíos de bienvenida simultáneos (global, todas las uniones)
+WELCOME_FANOUT_LIMIT: int = _env_int("WELCOME_FANOUT", 5, 1)
+WELCOME_FANOUT_SEMAPHORE = asyncio.Semaphore(WELCOME_FANOUT_LIMIT)
+# Últimas latencias unión→bienvenida: (ms desde el handler, ms desde la fecha de unión|None)
+WELCOME_LATENCIES_MS: Deque[Tuple[float, Optional[float]]] = deque(maxlen=1000)
 
 # === Mensaje de bienvenida por defecto (acortado, según solicitud) ===
 DEFAULT_WELCOME = """
@@ -112,61 +1024,185 @@ Por favor regístrate para participar según tu rol:
 """.strip()
 
 
-# === Cache de mensajes por chat para limpieza manual ===
-# Guardamos tuplas (message_id, user_id, is_command, is_service)
-MESSAGE_CACHE: Dict[int, deque[Tuple[int, int | None, bool, bool]]] = defaultdict(lambda: deque(maxlen=1000))
+# La caché de mensajes por chat para limpieza manual vive en chat_data (ver chat_message_cache)
 SCHEDULED_AUTOCLEAN_CHATS: Set[int] = set()
 
 # Tamaño por defecto de limpieza cuando es automática o si no se especifica
 AUTO_CLEAN_DEFAULT_N = 200
 
-# === Auto-clean por chat (horas) ===
-def auto_clean_path_for_chat(chat_id: int) -> Path:
-    return Path(__file__).with_name(f"auto_clean_{chat_id}.txt")
+
+# === Auto-clean por chat o por topic (horas) ===
+# auto_clean_<chat_id>.txt limpia todo el chat; auto_clean_<chat_id>_<thread_id>.txt, sólo ese topic de foro
+def auto_clean_path_for_chat(chat_id: int, thread_id: Optional[int] = None) -> Path:
+    if thread_id is not None:
+        return DATA_DIR / f"auto_clean_{chat_id}_{thread_id}.txt"
+    return DATA_DIR / f"auto_clean_{chat_id}.txt"
 
 
-def load_auto_clean_hours(chat_id: int) -> int:
-    p = auto_clean_path_for_chat(chat_id)
+def load_auto_clean_hours(chat_id: int, thread_id: Optional[int] = None) -> int:
+    p = auto_clean_path_for_chat(chat_id, thread_id)
     if p.exists():
         try:
-            val = int(p.read_text(encoding="utf-8").strip())
+            val = int(p.read_text(encoding="utf-8").split()[0])
             return max(0, val)
         except Exception:
             return 0
     return 0
 
 
-def save_auto_clean_hours(chat_id: int, hours: int) -> None:
-    p = auto_clean_path_for_chat(chat_id)
-    p.write_text(str(max(0, int(hours))) + "\n", encoding="utf-8")
-
-
-def _cancel_auto_clean_jobs(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
+def load_auto_clean_last_run(chat_id: int, thread_id: Optional[int] = None) -> int:
+    """Timestamp de la última limpieza automática (segunda línea del archivo; 0 si no hay)."""
     try:
-        if getattr(context, "job_queue", None):
-            for j in context.job_queue.get_jobs_by_name(f"auto_clean_{chat_id}"):
-                j.schedule_removal()
+        parts = auto_clean_path_for_chat(chat_id, thread_id).read_text(encoding="utf-8").split()
+        return int(parts[1]) if len(parts) > 1 else 0
     except Exception:
-        pass
+        return 0
 
 
-def _schedule_auto_clean_if_configured(context: ContextTypes.DEFAULT_TYPE, chat_id: int) -> None:
-    hours = load_auto_clean_hours(chat_id)
-    _cancel_auto_clean_jobs(context, chat_id)
-    if hours and hours > 0 and getattr(context, "job_queue", None):
-        try:
-            seconds = hours * 3600
-            print(f"[DEBUG] Programando auto-clean cada {hours}h para chat {chat_id}")
-            context.job_queue.run_repeating(
-                auto_clean_job,
-                interval=seconds,
-                first=seconds,
-                data={"chat_id": chat_id},
-                name=f"auto_clean_{chat_id}",
-            )
+def save_auto_clean_hours(chat_id: int, hours: int, last_run: int = 0, thread_id: Optional[int] = None) -> None:
+    p = auto_clean_path_for_chat(chat_id, thread_id)
+    if thread_id is not None and not hours:
+        # Un topic sin auto-clean no deja archivo (los topics pueden ser muchos)
+        p.unlink(missing_ok=True)
+        return
+    text = str(max(0, int(hours))) + "\n"
+    if last_run:
+        text += f"{int(last_run)}\n"
+    p.write_text(text, encoding="utf-8")
+
+
+# --- Barrido único de auto-clean ---
+# En lugar de un job repetitivo por chat (que tras un reinicio dispara a la vez todos los
+# chats con las mismas horas), un solo job revisa cada AUTO_CLEAN_TICK segundos una cola de
+# prioridad con la próxima ejecución de cada chat o topic. Cada uno tiene una fase fija dentro
+# de su intervalo, derivada de su chat_id (y thread_id), y las limpiezas simultáneas se limitan
+# a AUTO_CLEAN_CONCURRENCY. Como la fase sólo depende de los IDs, se conserva tras reiniciar.
+AUTO_CLEAN_TICK = 15
+AUTO_CLEAN_CONCURRENCY: int = _env_int("AUTO_CLEAN_CONCURRENCY", 2, 1)
+# Ventana en la que se reparten las limpiezas que se perdieron mientras el bot estaba caído
+AUTO_CLEAN_CATCHUP_SECONDS: int = _env_int("AUTO_CLEAN_CATCHUP_SECONDS", 600, 0)
+
+# (chat_id, thread_id|None): todo el chat o un topic de foro
+CleanTarget = Tuple[int, Optional[int]]
+# Heap de (próxima ejecución, chat_id, thread_id o 0); las entradas cuyo instante no coincide
+# con AUTO_CLEAN_DUE están obsoletas
+AUTO_CLEAN_QUEUE: List[Tuple[float, int, int]] = []
+AUTO_CLEAN_DUE: Dict[CleanTarget, float] = {}
+AUTO_CLEAN_RUNNING: Set[CleanTarget] = set()
+# Topics de cada chat con auto-clean en el barrido (para /stats sin recorrer AUTO_CLEAN_DUE)
+AUTO_CLEAN_TOPIC_COUNT: Dict[int, int] = defaultdict(int)
+_auto_clean_slots: Optional[asyncio.Semaphore] = None
+
+
+def _auto_clean_phase(chat_id: int, thread_id: Optional[int] = None) -> float:
+    """Fracción determinista en [0, 1) propia de cada chat o topic."""
+    key = f"auto_clean:{chat_id}" if thread_id is None else f"auto_clean:{chat_id}:{thread_id}"
+    return zlib.crc32(key.encode("ascii")) / 2**32
+
+
+def next_auto_clean_at(
+    chat_id: int, hours: int, now: float, last_run: float = 0, thread_id: Optional[int] = None
+) -> float:
+    """Próxima ejecución: el siguiente instante t > now con t ≡ fase (mod intervalo), o una
+    recuperación escalonada dentro de AUTO_CLEAN_CATCHUP_SECONDS si se saltó alguna."""
+    interval = hours * 3600
+    phase = _auto_clean_phase(chat_id, thread_id)
+    offset = phase * interval
+    slot = offset + (math.floor((now - offset) / interval) + 1) * interval
+    if last_run and slot - last_run > interval * 1.5:
+        return min(slot, now + phase * min(interval, AUTO_CLEAN_CATCHUP_SECONDS))
+    return slot
+
+
+def _push_auto_clean(due: float, target: CleanTarget) -> None:
+    if target[1] is not None and target not in AUTO_CLEAN_DUE:
+        AUTO_CLEAN_TOPIC_COUNT[target[0]] += 1
+    AUTO_CLEAN_DUE[target] = due
+    heapq.heappush(AUTO_CLEAN_QUEUE, (due, target[0], target[1] or 0))
+
+
+def _cancel_auto_clean_jobs(context: ContextTypes.DEFAULT_TYPE, chat_id: int, thread_id: Optional[int] = None) -> None:
+    # Las entradas del heap quedan obsoletas y se descartan al salir
+    if AUTO_CLEAN_DUE.pop((chat_id, thread_id), None) is not None and thread_id is not None:
+        AUTO_CLEAN_TOPIC_COUNT[chat_id] -= 1
+        if not AUTO_CLEAN_TOPIC_COUNT[chat_id]:
+            del AUTO_CLEAN_TOPIC_COUNT[chat_id]
+    if thread_id is None:
+        SCHEDULED_AUTOCLEAN_CHATS.discard(chat_id)
+
+
+def _schedule_auto_clean_if_configured(
+    context: ContextTypes.DEFAULT_TYPE, chat_id: int, thread_id: Optional[int] = None
+) -> None:
+    hours = load_auto_clean_hours(chat_id, thread_id)
+    _cancel_auto_clean_jobs(context, chat_id, thread_id)
+    if hours and hours > 0:
+        now = time.time()
+        last_run = load_auto_clean_last_run(chat_id, thread_id)
+        if not last_run:
+            # Recién configurado: contar desde ahora para que no cuente como atrasado
+            save_auto_clean_hours(chat_id, hours, int(now), thread_id=thread_id)
+            last_run = int(now)
+        due = next_auto_clean_at(chat_id, hours, now, last_run, thread_id)
+        _push_auto_clean(due, (chat_id, thread_id))
+        if thread_id is None:
             SCHEDULED_AUTOCLEAN_CHATS.add(chat_id)
-        except Exception as e:
-            print(f"[DEBUG] No se pudo programar auto-clean: {e}")
+        log_clean.debug(
+            "Auto-clean cada %sh, próxima en %ds", hours, int(due - now), extra=_kv(chat_id=chat_id, thread_id=thread_id)
+        )
+
+
+def restore_auto_clean_schedule(app: Application) -> int:
+    """Registra en el barrido todos los chats y topics con auto_clean_*.txt (sólo los propios en modo shard)."""
+    restored = 0
+    for p in DATA_DIR.glob("auto_clean_*.txt"):
+        try:
+            ids = [int(x) for x in p.stem[len("auto_clean_"):].split("_")]
+        except ValueError:
+            continue
+        chat_id, thread_id = ids[0], (ids[1] if len(ids) > 1 else None)
+        if not owns_chat(chat_id) or not chat_allowed(chat_id) or (chat_id, thread_id) in AUTO_CLEAN_DUE:
+            continue
+        _schedule_auto_clean_if_configured(app, chat_id, thread_id)
+        restored += (chat_id, thread_id) in AUTO_CLEAN_DUE
+    return restored
+
+
+def _clean_overlaps(target: CleanTarget, busy) -> bool:
+    """¿Se solapa `target` con alguna limpieza de `busy`? El mismo destino, o todo el chat y
+    cualquiera de sus topics."""
+    chat_id, thread_id = target
+    if thread_id is None:
+        return any(cid == chat_id for cid, _ in busy)
+    return target in busy or (chat_id, None) in busy
+
+
+async def auto_clean_sweep(context: ContextTypes.DEFAULT_TYPE):
+    """Job único: lanza las limpiezas vencidas, como máximo AUTO_CLEAN_CONCURRENCY a la vez."""
+    global _auto_clean_slots
+    if _auto_clean_slots is None:
+        _auto_clean_slots = asyncio.Semaphore(AUTO_CLEAN_CONCURRENCY)
+    now = time.time()
+    while AUTO_CLEAN_QUEUE and AUTO_CLEAN_QUEUE[0][0] <= now:
+        due, chat_id, thread_id = heapq.heappop(AUTO_CLEAN_QUEUE)
+        target = (chat_id, thread_id or None)
+        if AUTO_CLEAN_DUE.get(target) != due:
+            continue
+        hours = load_auto_clean_hours(*target)
+        if not hours:
+            _cancel_auto_clean_jobs(context, *target)
+            continue
+        # La siguiente ejecución se fija ya, así un retraso por concurrencia no desplaza la fase
+        _push_auto_clean(next_auto_clean_at(chat_id, hours, max(now, due), thread_id=target[1]), target)
+        if _clean_overlaps(target, AUTO_CLEAN_RUNNING) or _clean_overlaps(target, CLEAN_JOBS):
+            # Ya hay una limpieza de ese destino (o de todo el chat / sus topics): esta pasada se salta
+            log_clean.debug("Auto-clean saltado: limpieza en curso", extra=_kv(chat_id=chat_id, thread_id=target[1]))
+            continue
+        AUTO_CLEAN_RUNNING.add(target)
+        context.application.create_task(
+            _run_auto_clean(context, chat_id, hours, target[1]),
+            name=f"auto_clean_{chat_id}" + (f"_{target[1]}" if target[1] is not None else ""),
+        )
 
 
 def mention_html(user_id: int, name: str) -> str:
@@ -178,7 +1214,7 @@ def chat_allowed(chat_id: int) -> bool:
 
 
 def welcome_path_for_chat(chat_id: int) -> Path:
-    return Path(__file__).with_name(f"welcome_{chat_id}.md")
+    return DATA_DIR / f"welcome_{chat_id}.md"
 
 
 def load_welcome_text(chat_id: int) -> str:
@@ -203,7 +1239,7 @@ def reset_welcome_text(chat_id: int) -> None:
 
 
 def registration_path_for_chat(chat_id: int) -> Path:
-    return Path(__file__).with_name(f"registration_{chat_id}.md")
+    return DATA_DIR / f"registration_{chat_id}.md"
 
 
 def load_registration_text(chat_id: int) -> str:
@@ -227,30 +1263,51 @@ def reset_registration_text(chat_id: int) -> None:
         p.unlink()
 
 
-def _cache_message(msg) -> None:
-    try:
-        chat_id = msg.chat_id
-        thread_id = getattr(msg, "message_thread_id", None)
-        key = (chat_id, thread_id)
-        message_cache[key].append(msg.message_id)
-        pinned = getattr(msg, "pinned_message", None)
-        if pinned is not None and getattr(pinned, "message_id", None):
-            pinned_by_chat[chat_id].add(pinned.message_id)
-    except Exception:
-        pass
-
 def _record_bot_message(context: ContextTypes.DEFAULT_TYPE, sent_msg) -> None:
     try:
         chat_id = sent_msg.chat_id
         uid = context.bot.id if getattr(context, "bot", None) else None
-        MESSAGE_CACHE[chat_id].append((sent_msg.message_id, uid, False, False))
+        chat_message_cache(context.application, chat_id, message_topic(sent_msg)).append(
+            (sent_msg.message_id, uid, False, False)
+        )
+        # Puede llamarse desde jobs, sin update que marque el chat como modificado
+        context.application.mark_data_for_update_persistence(chat_ids=chat_id)
     except Exception:
         pass
 
 
+# === Configuración por chat: bienvenida fija (sticky) ===
+# En modo sticky se mantiene un único mensaje de bienvenida por chat y topic que se edita
+# con los últimos en unirse, en lugar de enviar (y luego borrar) un mensaje por miembro.
+STICKY_MAX_MENTIONS = 10
+# Se vuelve a publicar si han pasado más de N mensajes por debajo o si es demasiado antiguo
+STICKY_REPOST_AFTER_MESSAGES: int = _env_int("STICKY_REPOST_AFTER_MESSAGES", 30, 1)
+STICKY_MAX_AGE_SECONDS: int = _env_int("STICKY_MAX_AGE_SECONDS", 6 * 3600, 60)
+
+
+def sticky_path_for_chat(chat_id: int) -> Path:
+    return DATA_DIR / f"welcome_sticky_{chat_id}.txt"
+
+
+def load_sticky_for_chat(chat_id: int) -> bool:
+    p = sticky_path_for_chat(chat_id)
+    try:
+        return p.exists() and p.read_text(encoding="utf-8").strip() == "1"
+    except Exception:
+        return False
+
+
+def save_sticky_for_chat(chat_id: int, enabled: bool) -> None:
+    p = sticky_path_for_chat(chat_id)
+    if enabled:
+        p.write_text("1\n", encoding="utf-8")
+    elif p.exists():
+        p.unlink()
+
+
 # === Configuración por chat: segundos de auto-borrado ===
 def delete_seconds_path_for_chat(chat_id: int) -> Path:
-    return Path(__file__).with_name(f"welcome_delete_{chat_id}.txt")
+    return DATA_DIR / f"welcome_delete_{chat_id}.txt"
 
 
 def load_delete_seconds_for_chat(chat_id: int) -> int:
@@ -275,54 +1332,181 @@ def reset_delete_seconds_for_chat(chat_id: int) -> None:
         p.unlink()
 
 
+# === Reloj ===
+class Clock:
+    """Fuente de tiempo de los borrados programados, los reintentos y el ejecutor de borrados.
+    tools/simulate.py la sustituye por un reloj virtual para recorrer horas en segundos."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+
+CLOCK = Clock()
+
+
 # === Persistencia de borrados programados (sobrevive reinicios) ===
+# Cada archivo es un log de sólo-añadir: una línea por borrado programado y una marca
+# {"message_id": N, "done": true} al completarse. Cuando las líneas muertas superan a las
+# vivas (y a PENDING_COMPACT_MIN) el archivo se reescribe desde el índice en memoria, así
+# que cada alta/baja cuesta O(1) amortizado y el archivo no crece sin límite.
+PENDING_COMPACT_MIN = 256
+
+
 def pending_deletes_path_for_chat(chat_id: int) -> Path:
-    return Path(__file__).with_name(f"pending_deletes_{chat_id}.jsonl")
+    return DATA_DIR / f"pending_deletes_{chat_id}.jsonl"
+
+
+# Índice en memoria de borrados pendientes: chat_id -> {message_id: (delete_at, thread_id)}
+PENDING_DELETES: Dict[int, Dict[int, Tuple[int, Optional[int]]]] = defaultdict(dict)
+# Líneas muertas (marcas y registros ya borrados) por archivo de chat
+_pending_garbage: Dict[int, int] = defaultdict(int)
+# Contadores incrementales para /stats y /metrics: total de pendientes y un heap por delete_at
+# con borrado perezoso (las entradas obsoletas se descartan al llegar a la cima)
+_pending_count = 0
+_pending_heap: List[Tuple[int, int, int]] = []
+# Chats cuyo archivo está reflejado en el índice (restaurado o creado en esta ejecución). Sólo
+# éstos se compactan: reescribir el archivo de un chat aún sin cargar perdería sus registros.
+_pending_loaded: Set[int] = set()
+
+
+def _index_pending(chat_id: int, message_id: int, delete_at: int, thread_id: Optional[int]) -> None:
+    global _pending_count
+    chat = PENDING_DELETES[chat_id]
+    if message_id not in chat:
+        _pending_count += 1
+    chat[message_id] = (delete_at, thread_id)
+    heapq.heappush(_pending_heap, (delete_at, chat_id, message_id))
+
+
+def _unindex_pending(chat_id: int, message_id: int) -> None:
+    global _pending_count
+    pending = PENDING_DELETES.get(chat_id)
+    if pending is not None and pending.pop(message_id, None) is not None:
+        _pending_count -= 1
+        if not pending:
+            PENDING_DELETES.pop(chat_id, None)
+    _trim_pending_heap()
+
+
+def _trim_pending_heap() -> None:
+    """Descarta entradas obsoletas de la cima; si aun así el heap dobla a los pendientes, se rehace."""
+    while _pending_heap:
+        delete_at, chat_id, message_id = _pending_heap[0]
+        entry = PENDING_DELETES.get(chat_id, {}).get(message_id)
+        if entry is not None and entry[0] == delete_at:
+            break
+        heapq.heappop(_pending_heap)
+    if len(_pending_heap) > 2 * _pending_count + 64:
+        _pending_heap[:] = [(e[0], cid, mid) for cid, chat in PENDING_DELETES.items() for mid, e in chat.items()]
+        heapq.heapify(_pending_heap)
+
+
+def oldest_pending_delete() -> Optional[Tuple[int, int, int]]:
+    """(delete_at, chat_id, message_id) del borrado pendiente más antiguo, en O(1) amortizado."""
+    _trim_pending_heap()
+    return _pending_heap[0] if _pending_heap else None
+
+
+def reset_pending_index() -> None:
+    global _pending_count, _restored_timer_at
+    PENDING_DELETES.clear()
+    _pending_garbage.clear()
+    _pending_heap.clear()
+    _pending_loaded.clear()
+    _restored_deletes.clear()
+    _restored_timer_at = None
+    _pending_count = 0
 
 
 def _append_pending_delete(chat_id: int, record: dict) -> None:
+    try:
+        _index_pending(chat_id, int(record["message_id"]), int(record["delete_at"]), record.get("thread_id"))
+    except Exception:
+        pass
     p = pending_deletes_path_for_chat(chat_id)
+    if not p.exists():
+        _pending_loaded.add(chat_id)
     with p.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.write(json_dumps(record) + "\n")
 
 
 def _load_pending_deletes(chat_id: int) -> List[dict]:
+    """Registros vivos del archivo del chat (aplica las marcas "done"; el último registro de
+    cada message_id gana). Deja en _pending_garbage el número de líneas muertas."""
     p = pending_deletes_path_for_chat(chat_id)
-    records: List[dict] = []
+    live: Dict[int, dict] = {}
+    lines = 0
     if not p.exists():
-        return records
+        return []
     try:
         for line in p.read_text(encoding="utf-8").splitlines():
             line = line.strip()
             if not line:
                 continue
+            lines += 1
             try:
-                rec = json.loads(line)
-                if isinstance(rec, dict):
-                    records.append(rec)
+                rec = json_loads(line)
+                mid = int(rec["message_id"])
             except Exception:
                 continue
+            if rec.get("done"):
+                live.pop(mid, None)
+            else:
+                live[mid] = rec
     except Exception:
         pass
-    return records
+    _pending_garbage[chat_id] = lines - len(live)
+    return list(live.values())
+
+
+def _compact_pending_deletes(chat_id: int) -> None:
+    """Reescribe el archivo del chat con sólo los borrados pendientes del índice (nunca el de
+    un chat cuyo archivo no se ha cargado todavía)."""
+    if chat_id not in _pending_loaded:
+        return
+    p = pending_deletes_path_for_chat(chat_id)
+    pending = PENDING_DELETES.get(chat_id) or {}
+    _pending_garbage.pop(chat_id, None)
+    try:
+        if not pending:
+            p.unlink(missing_ok=True)
+            return
+        _write_pending_file(chat_id, pending)
+    except Exception as e:
+        log_persist.warning("No se pudo compactar pendientes: %s", e, extra=_kv(chat_id=chat_id))
+
+
+def _write_pending_file(chat_id: int, pending: Dict[int, Tuple[int, Optional[int]]]) -> None:
+    """Sustituye de forma atómica el archivo del chat por un registro por borrado pendiente."""
+    p = pending_deletes_path_for_chat(chat_id)
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text(
+        "".join(
+            json_dumps({"chat_id": chat_id, "message_id": mid, "thread_id": thread_id, "delete_at": delete_at}) + "\n"
+            for mid, (delete_at, thread_id) in pending.items()
+        ),
+        encoding="utf-8",
+    )
+    os.replace(tmp, p)
 
 
 def _remove_pending_delete(chat_id: int, message_id: int) -> None:
+    _unindex_pending(chat_id, message_id)
     p = pending_deletes_path_for_chat(chat_id)
     if not p.exists():
         return
+    # El registro original y su marca quedan como líneas muertas
+    _pending_garbage[chat_id] += 2
+    live = len(PENDING_DELETES.get(chat_id) or ())
+    if chat_id in _pending_loaded and (live == 0 or _pending_garbage[chat_id] > max(PENDING_COMPACT_MIN, live)):
+        _compact_pending_deletes(chat_id)
+        return
     try:
-        lines = p.read_text(encoding="utf-8").splitlines()
-        new_lines: List[str] = []
-        for line in lines:
-            try:
-                rec = json.loads(line)
-                if isinstance(rec, dict) and rec.get("message_id") == message_id:
-                    continue
-            except Exception:
-                pass
-            new_lines.append(line)
-        p.write_text("\n".join(new_lines) + ("\n" if new_lines else ""), encoding="utf-8")
+        with p.open("a", encoding="utf-8") as f:
+            f.write(json_dumps({"message_id": message_id, "done": True}) + "\n")
     except Exception:
         pass
 
@@ -331,18 +1515,25 @@ def _schedule_delete_with_persistence(
     context: ContextTypes.DEFAULT_TYPE,
     chat_id: int,
     message_id: int,
-    delay_seconds: int,
+    delay_seconds: float,
     thread_id: Optional[int] = None,
+    persist_record: bool = True,
 ) -> None:
-    delete_at = int(time.time()) + int(delay_seconds)
+    """Programa el borrado y lo anota en disco. Con persist_record=False (restauración) sólo
+    se indexa: el registro ya está en el archivo."""
+    now = CLOCK.time()
+    delete_at = int(now + delay_seconds)
     rec = {
         "chat_id": chat_id,
         "message_id": message_id,
         "thread_id": thread_id,
         "delete_at": delete_at,
-        "created_at": int(time.time()),
+        "created_at": int(now),
     }
-    _append_pending_delete(chat_id, rec)
+    if persist_record:
+        _append_pending_delete(chat_id, rec)
+    else:
+        _index_pending(chat_id, message_id, delete_at, thread_id)
 
     def _queue_job():
         if getattr(context, "job_queue", None):
@@ -372,10 +1563,98 @@ def _schedule_delete_with_persistence(
                 asyncio.create_task(_del_later(context.bot, chat_id, message_id, delay_seconds))
 
     try:
-        print(f"[DEBUG] [persist] Programando borrado en {delay_seconds}s para msg {message_id} en chat {chat_id}")
+        if log_persist.isEnabledFor(logging.DEBUG):
+            log_persist.debug(
+                "Programando borrado en %ss", delay_seconds, extra=_kv(chat_id=chat_id, message_id=message_id)
+            )
         _queue_job()
     except Exception as e:
-        print(f"[DEBUG] [persist] No se pudo programar borrado: {e}")
+        log_persist.warning(
+            "No se pudo programar borrado: %s", e, extra=_kv(chat_id=chat_id, message_id=message_id)
+        )
+
+
+# Borrados restaurados al arrancar: en lugar de un job del JobQueue por mensaje (con miles de
+# pendientes, crearlos era casi todo el tiempo de post_init) van a un heap propio y un único
+# timer crea el job de cada borrado cuando vence.
+_restored_deletes: List[Tuple[int, int, int]] = []
+_restored_timer_at: Optional[int] = None
+
+
+def _restore_delete(app, chat_id: int, message_id: int, delete_at: int, thread_id: Optional[int]) -> None:
+    if message_id in PENDING_DELETES.get(chat_id, ()):
+        # Programado en esta ejecución (la restauración corre con el polling ya en marcha)
+        return
+    if getattr(app, "job_queue", None) is None:
+        delay = max(0.0, delete_at - CLOCK.time())
+        _schedule_delete_with_persistence(app, chat_id, message_id, delay, thread_id, persist_record=False)
+        return
+    _index_pending(chat_id, message_id, delete_at, thread_id)
+    heapq.heappush(_restored_deletes, (delete_at, chat_id, message_id))
+
+
+def _arm_restored_deletes(app) -> None:
+    global _restored_timer_at
+    if not _restored_deletes or getattr(app, "job_queue", None) is None:
+        return
+    due = _restored_deletes[0][0]
+    if _restored_timer_at is not None and _restored_timer_at <= due:
+        return
+    _restored_timer_at = due
+    app.job_queue.run_once(restored_deletes_job, when=max(0.0, due - CLOCK.time()), name="restored_deletes")
+
+
+async def restored_deletes_job(context: ContextTypes.DEFAULT_TYPE):
+    """Pasa al JobQueue los borrados restaurados que ya vencieron y rearma el timer."""
+    global _restored_timer_at
+    _restored_timer_at = None
+    now = CLOCK.time()
+    while _restored_deletes and _restored_deletes[0][0] <= now:
+        delete_at, chat_id, message_id = heapq.heappop(_restored_deletes)
+        entry = PENDING_DELETES.get(chat_id, {}).get(message_id)
+        if entry is None or entry[0] != delete_at:
+            continue
+        context.job_queue.run_once(
+            delete_welcome_job,
+            when=0,
+            data={"chat_id": chat_id, "message_id": message_id, "thread_id": entry[1], "persist": True},
+            name=f"del_persist_{chat_id}_{message_id}",
+        )
+    _arm_restored_deletes(context.application)
+
+
+def restore_pending_deletes(app) -> int:
+    """Reprograma los borrados pendientes de los archivos por chat (sólo chats propios en modo
+    shard) sin volver a escribirlos, y compacta los archivos con líneas muertas."""
+    restored = 0
+    for p in DATA_DIR.glob("pending_deletes_*.jsonl"):
+        try:
+            chat_id = int(p.stem.split("_")[-1])
+        except Exception:
+            continue
+        if not owns_chat(chat_id):
+            continue
+        records = _load_pending_deletes(chat_id)
+        _pending_loaded.add(chat_id)
+        if not records:
+            _compact_pending_deletes(chat_id)
+            continue
+        log_persist.info("Reprogramando %d borrados pendientes", len(records), extra=_kv(chat_id=chat_id))
+        for rec in records:
+            try:
+                _restore_delete(app, chat_id, int(rec.get("message_id")), int(rec.get("delete_at")), rec.get("thread_id"))
+                restored += 1
+            except Exception:
+                continue
+        if _pending_garbage.get(chat_id):
+            _compact_pending_deletes(chat_id)
+    _arm_restored_deletes(app)
+    return restored
+
+
+# Caché de is_admin: (chat_id, user_id) -> (es_admin, expira_en monotonic)
+ADMIN_CACHE_SECONDS: int = _env_int("ADMIN_CACHE_SECONDS", 60, 0)
+_admin_cache: Dict[Tuple[int, int], Tuple[bool, float]] = {}
 
 
 async def is_admin(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int) -> bool:
@@ -385,41 +1664,96 @@ async def is_admin(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: in
       - owner/creator
       - administrator
     Intenta primero get_chat_member (estado individual) y luego get_chat_administrators (lista).
+    Sólo se cachea (ADMIN_CACHE_SECONDS por (chat_id, user_id)) lo que respondió la API: si
+    fallan ambas llamadas se deniega sin cachear y la siguiente petición vuelve a preguntar.
     """
-    print(f"[DEBUG] Verificando admin: user_id={user_id}, chat_id={chat_id}")
-    print(f"[DEBUG] SUPER_ADMIN_IDS: {SUPER_ADMIN_IDS}")
-    
     if user_id in SUPER_ADMIN_IDS:
-        print(f"[DEBUG] Usuario {user_id} es super admin")
         return True
-    
+
+    key = (chat_id, user_id)
+    now = time.monotonic()
+    cached = _admin_cache.get(key)
+    if cached is not None and cached[1] > now:
+        M_ADMIN_CACHE.inc(result="hit")
+        return cached[0]
+    M_ADMIN_CACHE.inc(result="miss")
+
+    result = await _is_admin_uncached(context, chat_id, user_id)
+    if result is None:
+        log_admin.warning("No se pudo comprobar si es admin; se deniega sin cachear", extra=_kv(chat_id=chat_id, user_id=user_id))
+        return False
+    if ADMIN_CACHE_SECONDS > 0:
+        if len(_admin_cache) >= 10000:
+            for k in [k for k, (_, exp) in _admin_cache.items() if exp <= now]:
+                del _admin_cache[k]
+        _admin_cache[key] = (result, now + ADMIN_CACHE_SECONDS)
+    return result
+
+
+def forget_admin(chat_id: int, user_id: Optional[int] = None) -> None:
+    """Olvida el is_admin cacheado de un usuario o, sin `user_id`, de todo el chat."""
+    if user_id is not None:
+        _admin_cache.pop((chat_id, user_id), None)
+        return
+    for k in [k for k in _admin_cache if k[0] == chat_id]:
+        del _admin_cache[k]
+
+
+async def _is_admin_uncached(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int) -> Optional[bool]:
+    """True/False según la API; None si no respondió ninguna de las dos llamadas."""
+    debug = log_admin.isEnabledFor(logging.DEBUG)
+    answered = False
     # Método 1: get_chat_member
     try:
         member = await context.bot.get_chat_member(chat_id, user_id)
         status = getattr(member, "status", "")
-        print(f"[DEBUG] Status del usuario {user_id}: '{status}'")
+        if debug:
+            log_admin.debug("Status del usuario: %s", status, extra=_kv(chat_id=chat_id, user_id=user_id))
         # Telegram usa 'creator' para el dueño del grupo
         if status in ("creator", "administrator"):
-            print(f"[DEBUG] Usuario {user_id} es admin/creator por get_chat_member")
             return True
+        answered = True
     except Exception as e:
-        print(f"[DEBUG] Error en get_chat_member: {e}")
-    
+        log_admin.debug("Error en get_chat_member: %s", e, extra=_kv(chat_id=chat_id, user_id=user_id))
+
     # Método 2: get_chat_administrators (fallback)
     try:
         admins = await context.bot.get_chat_administrators(chat_id)
-        print(f"[DEBUG] Lista de admins obtenida: {len(admins)} admins")
         for admin in admins:
             if admin.user.id == user_id:
-                print(f"[DEBUG] Usuario {user_id} encontrado en lista de admins con status: {admin.status}")
+                if debug:
+                    log_admin.debug(
+                        "Usuario en lista de admins (%s)", admin.status, extra=_kv(chat_id=chat_id, user_id=user_id)
+                    )
                 return True
+        answered = True
     except Exception as e:
-        print(f"[DEBUG] Error en get_chat_administrators: {e}")
-    
-    print(f"[DEBUG] Usuario {user_id} NO es admin")
+        log_admin.debug("Error en get_chat_administrators: %s", e, extra=_kv(chat_id=chat_id, user_id=user_id))
+
+    if not answered:
+        return None
+    if debug:
+        log_admin.debug("Usuario NO es admin", extra=_kv(chat_id=chat_id, user_id=user_id))
     return False
 
 
+def _is_permission_error(e: BaseException) -> bool:
+    if isinstance(e, Forbidden):
+        return True
+    text = str(e).lower()
+    return isinstance(e, BadRequest) and ("rights" in text or "admin" in text or "permission" in text)
+
+
+async def on_handler_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Registra el error de un handler. Si es de permisos, el estado de admin del chat ha
+    cambiado: se olvida su is_admin cacheado para no seguir decidiendo con él."""
+    err = context.error
+    if err is not None and _is_permission_error(err) and isinstance(update, Update) and update.effective_chat:
+        forget_admin(update.effective_chat.id)
+        log_admin.info("Error de permisos: caché de admins del chat descartada", extra=_kv(chat_id=update.effective_chat.id))
+    log.error("Error no controlado en un handler: %s", err, exc_info=err)
+
+
 def _thread_kwargs() -> dict:
     return {"message_thread_id": WELCOME_TOPIC_ID} if WELCOME_TOPIC_ID is not None else {}
 
@@ -436,13 +1770,17 @@ async def send_welcome(
     kb = InlineKeyboardMarkup(
         [[InlineKeyboardButton("🌐 Ir a QvaClick", url="https://qvaclick.com")]]
     )
-    sent = await context.bot.send_message(
-        chat_id=chat_id,
-        text=texto,
-        parse_mode=ParseMode.HTML,
-        disable_web_page_preview=True,
-        reply_markup=kb,
-        **_thread_kwargs(),
+    sent = await call_api(
+        "sendMessage",
+        lambda: context.bot.send_message(
+            chat_id=chat_id,
+            text=texto,
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True,
+            reply_markup=kb,
+            **_thread_kwargs(),
+        ),
+        idempotent=False,
     )
     _record_bot_message(context, sent)
 
@@ -457,6 +1795,234 @@ async def send_welcome(
             getattr(sent, "message_thread_id", None),
         )
 
+# === Resiliencia de llamadas a la Bot API ===
+# call_api() clasifica cada error (reintentable, permanente o limitado por tasa), reintenta
+# con backoff exponencial con jitter hasta un plazo y alimenta un circuit breaker común.
+# Con el circuito abierto (Telegram degradado) el tráfico no crítico (limpiezas, progreso,
+# comprobaciones de admins) espera a que se cierre; el crítico (bienvenidas y sus borrados)
+# sigue intentándolo.
+API_RETRY_DEADLINE: float = _env_float("API_RETRY_DEADLINE", 30.0, 0.0)
+CIRCUIT_FAILURES: int = _env_int("CIRCUIT_FAILURES", 5, 1)
+CIRCUIT_COOLDOWN: float = _env_float("CIRCUIT_COOLDOWN", 30.0, 1.0)
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 8.0
+
+M_API_RETRIES = METRICS.counter("qvc_api_retries_total", "Reintentos de llamadas a la Bot API", ("op", "kind"))
+M_API_GIVEUPS = METRICS.counter("qvc_api_giveups_total", "Llamadas abandonadas tras clasificar el error", ("op", "kind"))
+M_CIRCUIT_TRIPS = METRICS.counter("qvc_circuit_trips_total", "Aperturas del circuit breaker de la Bot API")
+
+
+class CircuitOpenError(Exception):
+    """El circuito sigue abierto al vencer el plazo de una llamada no crítica."""
+
+
+def _retry_after_seconds(e: RetryAfter) -> float:
+    value = e.retry_after
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+def classify_api_error(e: BaseException, idempotent: bool = True) -> str:
+    """'rate_limited' | 'retryable' | 'permanent'."""
+    if isinstance(e, RetryAfter):
+        return "rate_limited"
+    if isinstance(e, BadRequest):
+        return "permanent"
+    if isinstance(e, TimedOut):
+        # Un timeout de lectura puede haber llegado a Telegram: en envíos reintentar duplicaría el
+        # mensaje. La espera de pool propia nunca llegó a salir.
+        return "retryable" if idempotent or str(e).startswith("Pool timeout") else "permanent"
+    if isinstance(e, NetworkError):
+        return "retryable"
+    return "permanent"
+
+
+def backoff_delay(attempt: int) -> float:
+    # Backoff exponencial con jitter completo
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, failures: int, cooldown: float):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = self.CLOSED
+        # Llamada de prueba en curso en semiabierto: sólo una pasa hasta que se sepa el resultado
+        self._probe: Optional[object] = None
+
+    @property
+    def state(self) -> int:
+        if self._state == self.OPEN and CLOCK.monotonic() - self.opened_at >= self.cooldown:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def record_success(self) -> None:
+        if self._state != self.CLOSED:
+            log.info("Circuit breaker cerrado: la Bot API responde de nuevo")
+        self.failures = 0
+        self._state = self.CLOSED
+        self._probe = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self._state == self.CLOSED and self.failures >= self.threshold):
+            self._state = self.OPEN
+            self._probe = None
+            self.opened_at = CLOCK.monotonic()
+            M_CIRCUIT_TRIPS.inc()
+            log.warning("Circuit breaker abierto tras %d fallos de red seguidos", self.failures)
+
+    async def wait_closed(self, deadline: float) -> Optional[object]:
+        """Espera (hasta `deadline`, en tiempo monotónico) a que el circuito deje pasar tráfico.
+        En semiabierto deja pasar una sola llamada de prueba y devuelve su testigo, que el
+        llamante entrega a end_probe al terminar; las demás esperan a su resultado."""
+        while True:
+            state = self.state
+            if state == self.CLOSED:
+                return None
+            if state == self.HALF_OPEN and self._probe is None:
+                self._probe = object()
+                return self._probe
+            remaining = deadline - CLOCK.monotonic()
+            if remaining <= 0:
+                raise CircuitOpenError("Bot API degradada (circuito abierto)")
+            if state == self.OPEN:
+                await asyncio.sleep(min(remaining, self.opened_at + self.cooldown - CLOCK.monotonic() + 0.01))
+            else:
+                await asyncio.sleep(min(remaining, 0.1))
+
+    def end_probe(self, probe: Optional[object]) -> None:
+        """Libera la prueba si terminó sin veredicto (error permanente, 429, cancelación)."""
+        if probe is not None and self._probe is probe:
+            self._probe = None
+
+
+API_CIRCUIT = CircuitBreaker(CIRCUIT_FAILURES, CIRCUIT_COOLDOWN)
+METRICS.gauge("qvc_circuit_state", "Estado del circuit breaker (0=cerrado, 1=semiabierto, 2=abierto)", lambda: API_CIRCUIT.state)
+
+
+async def call_api(
+    op: str,
+    fn,
+    *,
+    critical: bool = True,
+    idempotent: bool = True,
+    deadline: Optional[float] = None,
+):
+    """Ejecuta `await fn()` con reintentos clasificados. Propaga el último error si es permanente
+    o si se agota el plazo (API_RETRY_DEADLINE segundos por defecto)."""
+    end = CLOCK.monotonic() + (API_RETRY_DEADLINE if deadline is None else deadline)
+    attempt = 0
+    while True:
+        probe = None if critical else await API_CIRCUIT.wait_closed(end)
+        try:
+            result = await fn()
+        except Exception as e:
+            kind = classify_api_error(e, idempotent)
+            if kind == "retryable":
+                API_CIRCUIT.record_failure()
+            if kind == "permanent":
+                M_API_GIVEUPS.inc(op=op, kind=kind)
+                raise
+            delay = _retry_after_seconds(e) if kind == "rate_limited" else backoff_delay(attempt)
+            if CLOCK.monotonic() + delay > end:
+                M_API_GIVEUPS.inc(op=op, kind=kind)
+                raise
+            M_API_RETRIES.inc(op=op, kind=kind)
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        finally:
+            API_CIRCUIT.end_probe(probe)
+        API_CIRCUIT.record_success()
+        return result
+
+
+# === Borrados con concurrencia adaptativa (AIMD) ===
+# Todos los borrados (limpiezas, bienvenidas temporizadas, mensajes de unión) pasan por
+# DELETE_EXECUTOR. El número de borrados simultáneos crece de forma aditiva con cada éxito,
+# se reduce a la mitad con cada 429 (y se pausa el retry_after indicado), y nunca supera
+# DELETE_TARGET_RATE × latencia observada: la concurrencia justa para esa tasa (ley de Little).
+DELETE_TARGET_RATE: float = _env_float("DELETE_TARGET_RATE", 30.0, 1.0)
+DELETE_MAX_CONCURRENCY: int = _env_int("DELETE_MAX_CONCURRENCY", 16, 1)
+
+
+class DeleteExecutor:
+    def __init__(self, target_rate: float, max_limit: int, start: float = 2.0):
+        self.target_rate = target_rate
+        self.max_limit = max_limit
+        self.limit = min(float(max_limit), start)
+        self.in_flight = 0
+        self.latency_ewma: Optional[float] = None
+        self._paused_until = 0.0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _cap(self) -> float:
+        if self.latency_ewma is None:
+            return float(self.max_limit)
+        return float(max(1, min(self.max_limit, math.ceil(self.target_rate * self.latency_ewma))))
+
+    async def _acquire(self) -> None:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            while True:
+                pause = self._paused_until - CLOCK.monotonic()
+                if pause > 0:
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                await self._cond.wait()
+
+    async def _release(self) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def _on_success(self, latency: float) -> None:
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        self.limit = min(self._cap(), self.limit + 1.0 / self.limit)
+
+    def _on_retry_after(self, seconds: float) -> None:
+        self.limit = max(1.0, self.limit / 2)
+        self._paused_until = max(self._paused_until, CLOCK.monotonic() + seconds)
+        log_clean.info("429 al borrar: concurrencia %.1f, pausa %.0fs", self.limit, seconds)
+
+    async def _attempt(self, bot, chat_id: int, message_id: int) -> None:
+        await self._acquire()
+        start = CLOCK.monotonic()
+        try:
+            await bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except RetryAfter as e:
+            self._on_retry_after(_retry_after_seconds(e))
+            raise
+        else:
+            self._on_success(CLOCK.monotonic() - start)
+        finally:
+            await self._release()
+
+    async def delete(self, bot, chat_id: int, message_id: int, critical: bool = True) -> None:
+        """Borra un mensaje vía call_api; propaga el error si es permanente o se agota el plazo."""
+        await call_api("deleteMessage", lambda: self._attempt(bot, chat_id, message_id), critical=critical)
+
+
+DELETE_EXECUTOR = DeleteExecutor(DELETE_TARGET_RATE, DELETE_MAX_CONCURRENCY)
+METRICS.gauge("qvc_delete_concurrency_limit", "Límite actual de borrados simultáneos (AIMD)", lambda: DELETE_EXECUTOR.limit)
+METRICS.gauge("qvc_deletes_in_flight", "Borrados en curso", lambda: DELETE_EXECUTOR.in_flight)
+
+
+# Espera antes de reintentar un borrado programado que falló por la red
+DELETE_RETRY_LATER_SECONDS = 60
+
+
 async def delete_welcome_job(context: ContextTypes.DEFAULT_TYPE):
     data = context.job.data if hasattr(context, "job") and context.job else {}
     chat_id = data.get("chat_id")
@@ -465,15 +2031,22 @@ async def delete_welcome_job(context: ContextTypes.DEFAULT_TYPE):
     if not chat_id or not message_id:
         return
     try:
-        print(f"[DEBUG] Ejecutando borrado (job_queue) para msg {message_id} en chat {chat_id}")
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-        print(f"[DEBUG] Borrado OK (job_queue) para msg {message_id} en chat {chat_id}")
+        await DELETE_EXECUTOR.delete(context.bot, chat_id, message_id)
+        log_persist.debug("Borrado OK (job_queue)", extra=_kv(chat_id=chat_id, message_id=message_id))
     except Exception as e:
+        if classify_api_error(e) != "permanent" and getattr(context, "job_queue", None):
+            # Fallo transitorio que agotó el plazo: se reintenta más tarde (el registro persistido se conserva)
+            log_persist.warning(
+                "Borrado aplazado %ds: %s", DELETE_RETRY_LATER_SECONDS, e, extra=_kv(chat_id=chat_id, message_id=message_id)
+            )
+            context.job_queue.run_once(
+                delete_welcome_job, when=DELETE_RETRY_LATER_SECONDS, data=data, name=context.job.name
+            )
+            return
         # Puede fallar si ya fue borrado manualmente o faltan permisos
-        print(f"[DEBUG] Error borrando bienvenida {chat_id}/{message_id}: {e}")
-    finally:
-        if data.get("persist"):
-            _remove_pending_delete(chat_id, message_id)
+        log_persist.info("Error borrando bienvenida: %s", e, extra=_kv(chat_id=chat_id, message_id=message_id))
+    if data.get("persist"):
+        _remove_pending_delete(chat_id, message_id)
 
 
 async def send_registration_prompt(
@@ -491,13 +2064,17 @@ async def send_registration_prompt(
             [InlineKeyboardButton("🏢 Soy Empleador", url="https://www.qvaclick.com/register/?qvc_role=employer")],
         ]
     )
-    sent = await context.bot.send_message(
-        chat_id=chat_id,
-        text=texto,
-        parse_mode=ParseMode.HTML,
-        disable_web_page_preview=True,
-        reply_markup=kb,
-        **_thread_kwargs(),
+    sent = await call_api(
+        "sendMessage",
+        lambda: context.bot.send_message(
+            chat_id=chat_id,
+            text=texto,
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True,
+            reply_markup=kb,
+            **_thread_kwargs(),
+        ),
+        idempotent=False,
     )
     _record_bot_message(context, sent)
     # Auto-borrado con la misma política del chat
@@ -505,7 +2082,9 @@ async def send_registration_prompt(
     if seconds > 0:
         try:
             if getattr(context, "job_queue", None):
-                print(f"[DEBUG] Programando borrado (job_queue) en {seconds}s para REG msg {sent.message_id} en chat {chat_id}")
+                log_persist.debug(
+                    "Programando borrado de REG en %ss", seconds, extra=_kv(chat_id=chat_id, message_id=sent.message_id)
+                )
                 context.job_queue.run_once(
                     delete_welcome_job,
                     when=seconds,
@@ -520,20 +2099,17 @@ async def send_registration_prompt(
                 async def _del_later(bot, cid, mid, delay):
                     try:
                         await asyncio.sleep(delay)
-                        print(f"[DEBUG] Ejecutando borrado (fallback) para REG msg {mid} en chat {cid}")
                         await bot.delete_message(chat_id=cid, message_id=mid)
-                        print(f"[DEBUG] Borrado OK (fallback) para REG msg {mid} en chat {cid}")
+                        log_persist.debug("Borrado OK (fallback REG)", extra=_kv(chat_id=cid, message_id=mid))
                     except Exception as e:
-                        print(f"[DEBUG] Error borrando (fallback REG) {cid}/{mid}: {e}")
+                        log_persist.info("Error borrando (fallback REG): %s", e, extra=_kv(chat_id=cid, message_id=mid))
 
                 if getattr(context, "application", None) and hasattr(context.application, "create_task"):
-                    print(f"[DEBUG] Programando borrado (asyncio) en {seconds}s para REG msg {sent.message_id} en chat {chat_id}")
                     context.application.create_task(_del_later(context.bot, chat_id, sent.message_id, seconds))
                 else:
-                    print(f"[DEBUG] Programando borrado (asyncio.create_task) en {seconds}s para REG msg {sent.message_id} en chat {chat_id}")
                     asyncio.create_task(_del_later(context.bot, chat_id, sent.message_id, seconds))
         except Exception as e:
-            print(f"[DEBUG] No se pudo programar borrado de REG: {e}")
+            log_persist.warning("No se pudo programar borrado de REG: %s", e, extra=_kv(chat_id=chat_id))
 
 
 async def send_combined_welcome(
@@ -560,13 +2136,17 @@ async def send_combined_welcome(
         ]
     )
 
-    sent = await context.bot.send_message(
-        chat_id=chat_id,
-        text=texto,
-        parse_mode=ParseMode.HTML,
-        disable_web_page_preview=True,
-        reply_markup=kb,
-        **_thread_kwargs(),
+    sent = await call_api(
+        "sendMessage",
+        lambda: context.bot.send_message(
+            chat_id=chat_id,
+            text=texto,
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True,
+            reply_markup=kb,
+            **_thread_kwargs(),
+        ),
+        idempotent=False,
     )
     _record_bot_message(context, sent)
 
@@ -581,7 +2161,142 @@ async def send_combined_welcome(
         )
 
 
-# === Comandos ===
+# === Grabación de updates (opt-in) para replay de rendimiento ===
+# RECORD_UPDATES_DIR activa un handler en el grupo -2 que encola cada Update; un hilo
+# lo anonimiza, lo serializa y lo escribe en segmentos .jsonl.gz rotativos.
+RECORD_UPDATES_DIR = os.environ.get("RECORD_UPDATES_DIR", "").strip()
+RECORD_SEGMENT_MB: int = _env_int("RECORD_SEGMENT_MB", 16, 1)
+RECORD_MAX_SEGMENTS: int = _env_int("RECORD_MAX_SEGMENTS", 20, 1)
+
+# Claves numéricas que se conservan (no identifican personas)
+_ANON_KEEP_INT_KEYS = {"message_id", "message_thread_id", "update_id", "date", "edit_date", "offset", "length"}
+_ANON_TEXT_KEYS = {"text", "caption", "question", "explanation"}
+_ANON_PII_KEYS = {
+    "first_name", "last_name", "username", "title", "phone_number", "bio", "description",
+    "invite_link", "email", "vcard", "name", "address", "custom_title", "author_signature",
+    "file_name", "performer", "chat_instance",
+}
+# Coordenadas de ubicaciones y locales: se redondean a 0,1° (~11 km)
+_ANON_COORD_KEYS = {"latitude", "longitude"}
+
+
+def _mask_text(text: str) -> str:
+    # Conserva el comando inicial y sus argumentos numéricos (enrutado de handlers) y la forma del texto
+    if text.startswith("/"):
+        return " ".join(t if i == 0 or t.isdigit() else "x" * len(t) for i, t in enumerate(text.split(" ")))
+    return "".join(c if c.isspace() else "x" for c in text)
+
+
+def anonymize_update(data, salt: bytes, key: str = ""):
+    """Copia anonimizada de un update serializado: IDs de usuario/chat con hash estable, textos
+    enmascarados y coordenadas redondeadas."""
+    if isinstance(data, dict):
+        return {k: anonymize_update(v, salt, k) for k, v in data.items()}
+    if isinstance(data, list):
+        return [anonymize_update(v, salt, key) for v in data]
+    if isinstance(data, bool) or data is None:
+        return data
+    if isinstance(data, int):
+        if key in _ANON_KEEP_INT_KEYS or not (key == "id" or key.endswith("_id")):
+            return data
+        digest = int.from_bytes(hashlib.blake2b(str(data).encode(), key=salt, digest_size=8).digest(), "big")
+        if data <= -1000000000000:
+            return -(1000000000000 + digest % 10**12)  # mantiene la forma -100xxxxxxxxxx
+        return (-1 if data < 0 else 1) * (1 + digest % 10**9)
+    if isinstance(data, float):
+        return round(data, 1) if key in _ANON_COORD_KEYS else data
+    if isinstance(data, str):
+        if key in _ANON_TEXT_KEYS:
+            return _mask_text(data)
+        # Cualquier *_id de texto (file_id, file_unique_id, foursquare_id, …) con hash
+        if key in _ANON_PII_KEYS or key.endswith("_id") or key == "url":
+            return "anon-" + hashlib.blake2b(data.encode(), key=salt, digest_size=4).hexdigest()
+    return data
+
+
+class UpdateRecorder:
+    """Escritor en segundo plano de updates anonimizados en segmentos gzip rotativos."""
+
+    def __init__(self, directory: Path, segment_bytes: int, max_segments: int):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        # Sal aleatoria por proceso: los IDs son coherentes dentro de una grabación pero no reversibles
+        self._salt = os.urandom(16)
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+        self._written = 0
+        self.recorded = 0
+
+    def start(self) -> None:
+        if self._thread is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="qvc-update-recorder", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def record(self, update: Update) -> None:
+        self._queue.put((time.time(), update))
+
+    def _open_segment(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        import gzip  # sólo con RECORD_UPDATES_DIR
+
+        name = time.strftime("updates-%Y%m%d-%H%M%S", time.gmtime()) + f"-{os.getpid()}.jsonl.gz"
+        self._file = gzip.open(self.directory / name, "wt", encoding="utf-8")
+        self._written = 0
+        segments = sorted(self.directory.glob("updates-*.jsonl.gz"))
+        for old in segments[: max(0, len(segments) - self.max_segments)]:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            ts, update = item
+            try:
+                if self._file is None or self._written >= self.segment_bytes:
+                    self._open_segment()
+                line = json.dumps(
+                    {"ts": round(ts, 3), "update": anonymize_update(update.to_dict(), self._salt)},
+                    ensure_ascii=False,
+                )
+                self._file.write(line + "\n")
+                self._written += len(line) + 1
+                self.recorded += 1
+                if self._queue.empty():
+                    self._file.flush()
+            except Exception as e:
+                log.warning("No se pudo grabar update: %s", e)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+UPDATE_RECORDER: Optional[UpdateRecorder] = (
+    UpdateRecorder(Path(RECORD_UPDATES_DIR), RECORD_SEGMENT_MB * 1024 * 1024, RECORD_MAX_SEGMENTS)
+    if RECORD_UPDATES_DIR
+    else None
+)
+
+
+async def record_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if UPDATE_RECORDER is not None:
+        UPDATE_RECORDER.record(update)
+
+
+# === Comandos ===
 
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
@@ -602,7 +2317,8 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "<b>🧹 Auto-borrado de bienvenida:</b>\n"
         "/get_welcome_delete — Ver tiempo de auto-borrado\n"
         "/set_welcome_delete &lt;segundos|off&gt; — Cambiar auto-borrado en este chat\n"
-        "/reset_welcome_delete — Volver al valor global (.env)\n\n"
+        "/reset_welcome_delete — Volver al valor global (.env)\n"
+        "/set_welcome_sticky &lt;on|off&gt; — Un único mensaje de bienvenida que se edita\n\n"
         "<b>📋 Mensajes de registro:</b>\n"
         "/get_registration — Ver texto de registro actual\n"
         "/set_registration — Cambiar mensaje de registro (admins/owner)\n"
@@ -610,7 +2326,9 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/cancelar — Cancelar operación en curso\n\n"
         "<b>🧹 Limpieza del chat:</b>\n"
         "/clean_chat [N] — Borra los últimos N mensajes no fijados (admins)\n"
+        "/clean_cancel — Detiene la limpieza en curso (admins)\n"
         "/set_auto_clean &lt;horas|off&gt; — Programa limpieza automática (admins)\n"
+        "/stats — Estado interno: cachés, borrados pendientes, jobs, latencias (admins)\n"
     )
     sent = await msg.reply_text(help_text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
     _record_bot_message(context, sent)
@@ -638,7 +2356,8 @@ async def cmd_debug_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
         
     # Verificar si es admin
-    is_admin_result = await is_admin(context, chat.id, user.id)
+    # Sin caché: este comando sirve precisamente para diagnosticar permisos
+    is_admin_result = user.id in SUPER_ADMIN_IDS or await _is_admin_uncached(context, chat.id, user.id)
     
     # Información adicional
     info_text = (
@@ -647,9 +2366,9 @@ async def cmd_debug_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Username: @{user.username or 'N/A'}\n"
         f"Chat ID: <code>{chat.id}</code>\n"
         f"Chat Type: {chat.type}\n"
-        f"Es admin: {'✅ SÍ' if is_admin_result else '❌ NO'}\n"
+        f"Es admin: {'⚠️ no se pudo comprobar' if is_admin_result is None else '✅ SÍ' if is_admin_result else '❌ NO'}\n"
         f"En SUPER_ADMIN_IDS: {'✅ SÍ' if user.id in SUPER_ADMIN_IDS else '❌ NO'}\n\n"
-        f"<i>Revisa los logs del bot para más detalles técnicos.</i>"
+        f"<i>Revisa los logs del bot (LOG_LEVELS=qvc.admin=DEBUG) para más detalles técnicos.</i>"
     )
     
     await msg.reply_text(info_text, parse_mode=ParseMode.HTML)
@@ -664,50 +2383,211 @@ async def cmd_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await msg.reply_text(f"chat_id: {chat.id}{', topic_id: ' + str(tid) if tid else ''}")
 
 
+def _welcome_display_name(member) -> str:
+    return " ".join(filter(None, [member.first_name, member.last_name])) or "nuevo miembro"
+
+
+def _record_welcome_latency(handler_start: float, join_date) -> Tuple[float, Optional[float]]:
+    """Registra la latencia unión→bienvenida visible (ms), local y extremo a extremo."""
+    handler_ms = (time.monotonic() - handler_start) * 1000.0
+    e2e_ms: Optional[float] = None
+    try:
+        if join_date is not None:
+            e2e_ms = max(0.0, (time.time() - join_date.timestamp()) * 1000.0)
+    except Exception:
+        e2e_ms = None
+    WELCOME_LATENCIES_MS.append((handler_ms, e2e_ms))
+    return handler_ms, e2e_ms
+
+
+async def _delete_join_message(msg) -> None:
+    # Borra el mensaje "X se unió" (requiere permiso de eliminar)
+    try:
+        await DELETE_EXECUTOR.delete(msg.get_bot(), msg.chat_id, msg.message_id)
+    except Exception as e:
+        log_welcome.info(
+            "No se pudo borrar mensaje de unión: %s", e, extra=_kv(chat_id=msg.chat_id, message_id=msg.message_id)
+        )
+
+
+async def _welcome_member(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    member,
+    handler_start: float,
+    join_date,
+) -> None:
+    nombre = _welcome_display_name(member)
+    async with WELCOME_FANOUT_SEMAPHORE:
+        await send_combined_welcome(context, chat_id, member.id, nombre)
+    handler_ms, e2e_ms = _record_welcome_latency(handler_start, join_date)
+    M_WELCOMES.inc(result="ok")
+    M_WELCOME_LATENCY.observe(handler_ms / 1000.0)
+    if log_welcome.isEnabledFor(logging.DEBUG):
+        log_welcome.debug(
+            "Bienvenida visible",
+            extra=_kv(
+                chat_id=chat_id,
+                user_id=member.id,
+                latency_ms=round(handler_ms, 1),
+                join_latency_ms=None if e2e_ms is None else round(e2e_ms),
+            ),
+        )
+
+
+# --- Bienvenida sticky ---
+# chat_data["sticky"][str(thread_id)] = {"message_id", "posted_at", "recent": [[user_id, nombre], ...]}
+_sticky_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+
+def _sticky_text(chat_id: int, recent: List[List]) -> str:
+    mentions = ", ".join(mention_html(uid, name) for uid, name in recent)
+    return f"{mentions}\n\n{escape(load_welcome_text(chat_id))}\n\n{load_registration_text(chat_id)}"
+
+
+async def send_sticky_welcome(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    members: List[Tuple[int, str]],
+    join_message_id: int,
+) -> str:
+    """Añade los nuevos miembros al mensaje sticky del chat/topic editándolo; lo vuelve a
+    publicar (y borra el anterior) si quedó muy arriba, es antiguo o ya no existe.
+    Devuelve "edited" o "posted"."""
+    thread_key = str(WELCOME_TOPIC_ID)
+    async with _sticky_locks[chat_id]:
+        sticky = context.application.chat_data[chat_id].setdefault("sticky", {})
+        state = sticky.get(thread_key) or {"message_id": None, "posted_at": 0, "recent": []}
+        recent = [[uid, name] for uid, name in members[::-1]]
+        recent += [r for r in state["recent"] if r[0] not in {uid for uid, _ in members}]
+        state["recent"] = recent[:STICKY_MAX_MENTIONS]
+        text = _sticky_text(chat_id, state["recent"])
+        kb = InlineKeyboardMarkup(
+            [
+                [InlineKeyboardButton("🌐 Ir a QvaClick", url="https://qvaclick.com")],
+                [InlineKeyboardButton("👩‍💻 Soy Freelancer", url="https://www.qvaclick.com/register/?qvc_role=freelancer")],
+                [InlineKeyboardButton("🏢 Soy Empleador", url="https://www.qvaclick.com/register/?qvc_role=employer")],
+            ]
+        )
+        old_id = state["message_id"]
+        fresh = (
+            old_id is not None
+            and join_message_id - old_id <= STICKY_REPOST_AFTER_MESSAGES
+            and time.time() - state["posted_at"] <= STICKY_MAX_AGE_SECONDS
+        )
+        if fresh:
+            try:
+                await call_api(
+                    "editMessageText",
+                    lambda: context.bot.edit_message_text(
+                        chat_id=chat_id,
+                        message_id=old_id,
+                        text=text,
+                        parse_mode=ParseMode.HTML,
+                        disable_web_page_preview=True,
+                        reply_markup=kb,
+                    ),
+                )
+                sticky[thread_key] = state
+                return "edited"
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    sticky[thread_key] = state
+                    return "edited"
+                # Borrado por un admin o por /clean_chat: se publica de nuevo
+                log_welcome.info("Sticky no editable, se publica de nuevo: %s", e, extra=_kv(chat_id=chat_id))
+                old_id = None
+        sent = await call_api(
+            "sendMessage",
+            lambda: context.bot.send_message(
+                chat_id=chat_id,
+                text=text,
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True,
+                reply_markup=kb,
+                **_thread_kwargs(),
+            ),
+            idempotent=False,
+        )
+        state["message_id"] = sent.message_id
+        state["posted_at"] = int(time.time())
+        sticky[thread_key] = state
+    if old_id is not None:
+        try:
+            await DELETE_EXECUTOR.delete(context.bot, chat_id, old_id)
+        except Exception as e:
+            log_welcome.info("No se pudo borrar el sticky anterior: %s", e, extra=_kv(chat_id=chat_id, message_id=old_id))
+    return "posted"
+
+
+async def _sticky_welcome_members(
+    context: ContextTypes.DEFAULT_TYPE,
+    chat_id: int,
+    humans: list,
+    join_message_id: int,
+    handler_start: float,
+    join_date,
+) -> None:
+    result = await send_sticky_welcome(
+        context, chat_id, [(m.id, _welcome_display_name(m)) for m in humans], join_message_id
+    )
+    handler_ms, e2e_ms = _record_welcome_latency(handler_start, join_date)
+    M_WELCOMES.inc(len(humans), result=f"sticky_{result}")
+    M_WELCOME_LATENCY.observe(handler_ms / 1000.0)
+    if log_welcome.isEnabledFor(logging.DEBUG):
+        log_welcome.debug(
+            "Bienvenida sticky",
+            extra=_kv(chat_id=chat_id, members=len(humans), result=result, latency_ms=round(handler_ms, 1)),
+        )
+
+
 async def bienvenida(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    handler_start = time.monotonic()
     chat = update.effective_chat
     msg = update.effective_message
-    print(f"[DEBUG] bienvenida() llamada - chat: {chat.id if chat else None}, msg: {msg.message_id if msg else None}")
-
     if chat is None or msg is None:
-        print("[DEBUG] chat o msg es None, saliendo")
         return
 
     if ALLOWED_CHAT_IDS and chat.id not in ALLOWED_CHAT_IDS:
-        print(f"[DEBUG] Chat {chat.id} no está en ALLOWED_CHAT_IDS: {ALLOWED_CHAT_IDS}")
+        log_welcome.debug("Chat no permitido", extra=_kv(chat_id=chat.id))
         return
 
-    _cache_message(msg)
-
     new_members = msg.new_chat_members or []
-    print(f"[DEBUG] Nuevos miembros detectados: {len(new_members)}")
-    for i, member in enumerate(new_members):
-        print(
-            f"[DEBUG] Miembro {i+1}: ID={member.id}, username={member.username}, "
-            f"first_name={member.first_name}, is_bot={member.is_bot}"
+    humans = [m for m in new_members if not m.is_bot]
+    M_JOINS.inc(len(humans))
+    if log_welcome.isEnabledFor(logging.DEBUG):
+        log_welcome.debug(
+            "Nuevos miembros",
+            extra=_kv(chat_id=chat.id, message_id=msg.message_id, members=len(new_members), bots=len(new_members) - len(humans)),
         )
 
-    try:
-        # Borra el mensaje "X se unió" (requiere permiso de eliminar)
-        try:
-            await msg.delete()
-            print("[DEBUG] Mensaje de unión borrado exitosamente")
-        except Exception as e:
-            print(f"[DEBUG] No se pudo borrar mensaje de unión: {e}")
-
-        for m in new_members:
-            if m.is_bot:
-                print(f"[DEBUG] Saltando bot: {m.first_name} ({m.id})")
-                continue
-            nombre = " ".join(filter(None, [m.first_name, m.last_name])) or "nuevo miembro"
-            print(f"[DEBUG] Enviando bienvenida a: {nombre} (ID: {m.id})")
-            await send_combined_welcome(context, chat.id, m.id, nombre)
-            print(f"[DEBUG] Bienvenida enviada exitosamente a {nombre}")
-
-    except Exception as e:
-        print(f"[ERROR] Error en bienvenida: {e}")
-        import traceback
-        traceback.print_exc()
+    # El borrado del mensaje de unión y las bienvenidas corren en paralelo;
+    # el semáforo acota el fan-out y un fallo de un miembro no afecta a los demás.
+    join_date = getattr(msg, "date", None)
+    if humans and load_sticky_for_chat(chat.id):
+        # Modo sticky: una sola edición para todos los miembros, sin borrados programados
+        results = await asyncio.gather(
+            _delete_join_message(msg),
+            _sticky_welcome_members(context, chat.id, humans, msg.message_id, handler_start, join_date),
+            return_exceptions=True,
+        )
+        if isinstance(results[1], BaseException):
+            M_WELCOMES.inc(len(humans), result="error")
+            log_welcome.error(
+                "Error en bienvenida sticky: %r", results[1], exc_info=results[1], extra=_kv(chat_id=chat.id)
+            )
+        return
+    results = await asyncio.gather(
+        _delete_join_message(msg),
+        *(_welcome_member(context, chat.id, m, handler_start, join_date) for m in humans),
+        return_exceptions=True,
+    )
+    for m, res in zip(humans, results[1:]):
+        if isinstance(res, BaseException):
+            M_WELCOMES.inc(result="error")
+            log_welcome.error(
+                "Error en bienvenida: %r", res, exc_info=res, extra=_kv(chat_id=chat.id, user_id=m.id)
+            )
 
 
 async def test_welcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -791,8 +2671,7 @@ async def set_welcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Nuevo comportamiento: sistema de espera de mensaje
-    chat_user_key = (chat.id, user.id)
-    waiting_for_message[chat_user_key] = "waiting_for_welcome"
+    _waiting(context)[user.id] = "waiting_for_welcome"
     
     sent = await msg.reply_text(
         "✏️ <b>Configuración de mensaje de bienvenida</b>\n\n"
@@ -868,8 +2747,7 @@ async def set_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Nuevo comportamiento: sistema de espera de mensaje
-    chat_user_key = (chat.id, user.id)
-    waiting_for_message[chat_user_key] = "waiting_for_registration"
+    _waiting(context)[user.id] = "waiting_for_registration"
     
     sent = await msg.reply_text(
         "✏️ <b>Configuración de mensaje de registro</b>\n\n"
@@ -906,6 +2784,43 @@ async def reset_welcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await test_welcome(update, context)
 
 
+async def set_welcome_sticky(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Activa/desactiva la bienvenida sticky en ESTE chat. Uso: /set_welcome_sticky <on|off>."""
+    chat = update.effective_chat
+    msg = update.effective_message
+    user = msg.from_user if msg else None
+    if not chat or not msg or not user:
+        return
+    if ALLOWED_CHAT_IDS and chat.id not in ALLOWED_CHAT_IDS:
+        return
+
+    if chat.type == ChatType.PRIVATE and user.id not in SUPER_ADMIN_IDS:
+        await msg.reply_text("ℹ️ Por favor ejecuta este comando dentro del grupo.")
+        return
+
+    if not await is_admin(context, chat.id, user.id):
+        await msg.reply_text("🚫 Solo administradores/owner pueden cambiar este ajuste.")
+        return
+
+    args = context.args if hasattr(context, "args") else []
+    raw = args[0].strip().lower() if args else ""
+    if raw in ("on", "1", "activar"):
+        enabled = True
+    elif raw in ("off", "0", "desactivar"):
+        enabled = False
+    else:
+        await msg.reply_text("Uso: /set_welcome_sticky <on|off>")
+        return
+
+    save_sticky_for_chat(chat.id, enabled)
+    sent = await msg.reply_text(
+        "✅ Bienvenida sticky activada: se editará un único mensaje con los últimos en unirse."
+        if enabled
+        else "✅ Bienvenida sticky desactivada: cada miembro recibirá su propio mensaje."
+    )
+    _record_bot_message(context, sent)
+
+
 async def reset_welcome_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Elimina el override de auto-borrado y vuelve al valor del .env."""
     chat = update.effective_chat
@@ -955,7 +2870,9 @@ async def cache_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 bool(getattr(msg, "group_chat_created", False)) or \
                 bool(getattr(msg, "supergroup_chat_created", False)) or \
                 bool(getattr(msg, "channel_chat_created", False))
-            MESSAGE_CACHE[chat.id].append((msg.message_id, uid, is_cmd, is_service))
+            chat_message_cache(context.application, chat.id, message_topic(msg)).append(
+                (msg.message_id, uid, is_cmd, is_service)
+            )
             # Asegurar que el auto-clean esté programado si existe configuración
             if chat.id not in SCHEDULED_AUTOCLEAN_CHATS:
                 _schedule_auto_clean_if_configured(context, chat.id)
@@ -963,70 +2880,229 @@ async def cache_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         pass
 
 
-async def auto_clean_job(context: ContextTypes.DEFAULT_TYPE):
-    data = context.job.data if hasattr(context, "job") and context.job else {}
-    chat_id = data.get("chat_id")
-    if not chat_id:
-        return
+async def _run_auto_clean(
+    context: ContextTypes.DEFAULT_TYPE, chat_id: int, hours: int, thread_id: Optional[int] = None
+) -> None:
     try:
-        deleted, skipped_pinned, failed = await _perform_clean(chat_id, context, AUTO_CLEAN_DEFAULT_N)
-        print(f"[DEBUG] Auto-clean chat {chat_id}: del={deleted}, skipped={skipped_pinned}, failed={failed}")
+        async with _auto_clean_slots:
+            # Sin mensajes cacheados (p. ej. tras reiniciar) no hay nada que borrar
+            if thread_id is None:
+                has_messages = cached_message_count(chat_state(context.application, chat_id)) > 0
+            else:
+                has_messages = bool(chat_message_cache(context.application, chat_id, thread_id))
+            if has_messages:
+                deleted, skipped_pinned, failed = await _perform_clean(
+                    chat_id, context, AUTO_CLEAN_DEFAULT_N, thread_id=thread_id
+                )
+                log_clean.info(
+                    "Auto-clean completado",
+                    extra=_kv(chat_id=chat_id, thread_id=thread_id, deleted=deleted, skipped=skipped_pinned, failed=failed),
+                )
+            save_auto_clean_hours(chat_id, hours, int(time.time()), thread_id=thread_id)
     except Exception as e:
-        print(f"[DEBUG] Error en auto-clean de chat {chat_id}: {e}")
+        log_clean.exception("Error en auto-clean: %s", e, extra=_kv(chat_id=chat_id, thread_id=thread_id))
+    finally:
+        AUTO_CLEAN_RUNNING.discard((chat_id, thread_id))
+
+
+class CleanJob:
+    """Limpieza en segundo plano de un chat o un topic: objetivo (ampliable), contadores y cancelación."""
+
+    def __init__(self, chat_id: int, n: int, thread_id: Optional[int] = None):
+        self.chat_id = chat_id
+        self.thread_id = thread_id
+        self.n = n
+        self.deleted = 0
+        self.skipped_pinned = 0
+        self.failed = 0
+        self.cancelled = asyncio.Event()
+        self.progress_message_id: Optional[int] = None
+        # Comandos /clean_chat ya borrados por el handler (se cachean después y no deben contarse)
+        self.command_ids: Set[int] = set()
+        self.started_at = time.monotonic()
+
+    def progress_text(self, final: bool = False) -> str:
+        if not final:
+            return (
+                f"🧹 Limpiando… {self.deleted}/{self.n}. Skipped fijados: {self.skipped_pinned}. "
+                f"Fallidos: {self.failed}. Usa /clean_cancel para detener."
+            )
+        counts = f"Eliminados: {self.deleted}. Skipped fijados: {self.skipped_pinned}. Fallidos: {self.failed}."
+        if self.cancelled.is_set():
+            return f"⏹️ Limpieza cancelada. {counts}"
+        return f"🧹 Limpieza completada. {counts}"
+
 
+# Limpiezas en curso por chat o topic (una a la vez en cada uno)
+CLEAN_JOBS: Dict[CleanTarget, CleanJob] = {}
+# Segundos mínimos entre ediciones del mensaje de progreso
+CLEAN_PROGRESS_INTERVAL = 2.0
+
+
+async def _perform_clean(
+    chat_id: int,
+    context: ContextTypes.DEFAULT_TYPE,
+    n: int,
+    job: Optional[CleanJob] = None,
+    thread_id: Optional[int] = None,
+) -> Tuple[int, int, int]:
+    """Borra hasta n mensajes cacheados del chat o, con `thread_id`, sólo de ese topic (se lee
+    únicamente su caché). Con `job`, el objetivo se lee de job.n (puede crecer), los contadores
+    se publican en el job y job.cancelled detiene el bucle.
 
-async def _perform_clean(chat_id: int, context: ContextTypes.DEFAULT_TYPE, n: int) -> Tuple[int, int, int]:
+    Se procesa por tandas de tantos candidatos como borrados falten; cada tanda comprueba
+    permisos y borra en paralelo a través de DELETE_EXECUTOR."""
     # Obtener mensaje fijado actual
     pinned_id = None
     try:
-        c = await context.bot.get_chat(chat_id)
+        c = await call_api("getChat", lambda: context.bot.get_chat(chat_id), critical=False)
         if getattr(c, "pinned_message", None):
             pinned_id = c.pinned_message.message_id
     except Exception:
         pinned_id = None
 
-    deleted = 0
-    skipped_pinned = 0
-    failed = 0
+    counts = {"deleted": 0, "skipped_pinned": 0, "failed": 0}
+    # uid -> tarea que resuelve si es admin (una sola consulta por usuario y limpieza)
+    protected: Dict[int, asyncio.Task] = {}
 
-    items = list(MESSAGE_CACHE.get(chat_id, []))
-    bot_id = context.bot.id if getattr(context, "bot", None) else None
-    for rec in reversed(items):
-        # Compatibilidad: registros antiguos pueden no tener is_service
-        if len(rec) == 3:
-            mid, uid, is_cmd = rec  # type: ignore
-            is_service = False
-        else:
-            mid, uid, is_cmd, is_service = rec  # type: ignore
-        if deleted >= n:
-            break
-        if pinned_id and mid == pinned_id:
-            skipped_pinned += 1
-            continue
-        # Determinar si el mensaje es del propio bot (siempre se puede borrar)
-        is_bot_message = (bot_id is not None and uid == bot_id)
-        # Saltar admins/superadmins salvo comandos o mensajes del bot
-        if uid is not None and not is_cmd and not is_bot_message and not is_service:
-            try:
-                if uid in SUPER_ADMIN_IDS:
-                    continue
-                member = await context.bot.get_chat_member(chat_id, uid)
-                status = getattr(member, "status", "")
-                if status in ("creator", "administrator"):
-                    continue
-            except Exception:
-                pass
+    async def _is_protected(uid: int) -> Optional[bool]:
+        # None si no se pudo comprobar (circuito abierto, plazo agotado…)
+        try:
+            member = await call_api("getChatMember", lambda: context.bot.get_chat_member(chat_id, uid), critical=False)
+            return getattr(member, "status", "") in ("creator", "administrator")
+        except Exception as e:
+            log_clean.debug("No se pudo comprobar si es admin: %s", e, extra=_kv(chat_id=chat_id, user_id=uid))
+            return None
+
+    async def _clean_one(mid: int, uid: Optional[int], check_admin: bool) -> None:
+        if check_admin:
+            if uid not in protected:
+                protected[uid] = asyncio.ensure_future(_is_protected(uid))
+            is_protected = await protected[uid]
+            if is_protected is None:
+                # Sin verificar no se borra: podría ser de un admin
+                counts["failed"] += 1
+                if job is not None:
+                    job.failed = counts["failed"]
+                return
+            if is_protected:
+                return
+        if job is not None and job.cancelled.is_set():
+            return
         try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=mid)
-            deleted += 1
+            await DELETE_EXECUTOR.delete(context.bot, chat_id, mid, critical=False)
+            counts["deleted"] += 1
         except Exception:
-            failed += 1
-            continue
-    return deleted, skipped_pinned, failed
+            counts["failed"] += 1
+        if job is not None:
+            job.deleted, job.failed = counts["deleted"], counts["failed"]
+
+    items = cached_messages(context.application, chat_id, thread_id)
+    bot_id = context.bot.id if getattr(context, "bot", None) else None
+    pending = reversed(items)
+    while True:
+        if job is not None:
+            if job.cancelled.is_set():
+                break
+            n = job.n
+        wanted = n - counts["deleted"]
+        if wanted <= 0:
+            break
+        batch = []
+        for rec in pending:
+            # Compatibilidad: registros antiguos pueden no tener is_service
+            if len(rec) == 3:
+                mid, uid, is_cmd = rec  # type: ignore
+                is_service = False
+            else:
+                mid, uid, is_cmd, is_service = rec  # type: ignore
+            if job is not None and mid in job.command_ids:
+                continue
+            if pinned_id and mid == pinned_id:
+                counts["skipped_pinned"] += 1
+                continue
+            # Determinar si el mensaje es del propio bot (siempre se puede borrar)
+            is_bot_message = (bot_id is not None and uid == bot_id)
+            # Saltar admins/superadmins salvo comandos o mensajes del bot
+            check_admin = uid is not None and not is_cmd and not is_bot_message and not is_service
+            if check_admin and uid in SUPER_ADMIN_IDS:
+                continue
+            batch.append(_clean_one(mid, uid, check_admin))
+            if len(batch) >= wanted:
+                break
+        if not batch:
+            break
+        await asyncio.gather(*batch)
+        if job is not None:
+            job.skipped_pinned = counts["skipped_pinned"]
+    if job is not None:
+        job.deleted, job.skipped_pinned, job.failed = counts["deleted"], counts["skipped_pinned"], counts["failed"]
+    return counts["deleted"], counts["skipped_pinned"], counts["failed"]
+
+
+async def _edit_clean_progress(context: ContextTypes.DEFAULT_TYPE, job: CleanJob, final: bool = False) -> None:
+    if job.progress_message_id is None:
+        return
+    try:
+        await call_api(
+            "editMessageText",
+            lambda: context.bot.edit_message_text(
+                chat_id=job.chat_id, message_id=job.progress_message_id, text=job.progress_text(final)
+            ),
+            critical=False,
+            deadline=10.0,
+        )
+    except Exception as e:
+        # "message is not modified" y similares no deben interrumpir la limpieza
+        log_clean.debug("No se pudo editar el progreso: %s", e, extra=_kv(chat_id=job.chat_id))
+
+
+async def _run_clean_job(context: ContextTypes.DEFAULT_TYPE, job: CleanJob) -> None:
+    """Ejecuta la limpieza fuera del handler, editando un único mensaje de progreso."""
+
+    async def _ticker():
+        last = None
+        while True:
+            await asyncio.sleep(CLEAN_PROGRESS_INTERVAL)
+            state = (job.deleted, job.skipped_pinned, job.failed, job.n)
+            if state != last:
+                last = state
+                await _edit_clean_progress(context, job)
+
+    ticker = asyncio.create_task(_ticker())
+    try:
+        await _perform_clean(job.chat_id, context, job.n, job, job.thread_id)
+    except Exception as e:
+        log_clean.exception("Error en limpieza: %s", e, extra=_kv(chat_id=job.chat_id, thread_id=job.thread_id))
+    finally:
+        ticker.cancel()
+        CLEAN_JOBS.pop((job.chat_id, job.thread_id), None)
+    log_clean.info(
+        "Limpieza %s",
+        "cancelada" if job.cancelled.is_set() else "completada",
+        extra=_kv(
+            chat_id=job.chat_id,
+            thread_id=job.thread_id,
+            deleted=job.deleted,
+            skipped=job.skipped_pinned,
+            failed=job.failed,
+            seconds=round(time.monotonic() - job.started_at, 1),
+        ),
+    )
+    await _edit_clean_progress(context, job, final=True)
+    # Borrar el resumen a los 5s
+    if job.progress_message_id is not None and getattr(context, "job_queue", None):
+        context.job_queue.run_once(
+            delete_welcome_job,
+            when=5,
+            data={"chat_id": job.chat_id, "message_id": job.progress_message_id},
+            name=f"del_clean_summary_{job.chat_id}_{job.progress_message_id}",
+        )
 
 
 async def clean_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Elimina los últimos N mensajes no fijados en este chat. Uso: /clean_chat [N] (por defecto 200)."""
+    """Elimina los últimos N mensajes no fijados en este chat o, dentro de un topic de foro, sólo
+    en ese topic. Uso: /clean_chat [N] (por defecto 200)."""
     chat = update.effective_chat
     msg = update.effective_message
     user = msg.from_user if msg else None
@@ -1053,45 +3129,74 @@ async def clean_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await msg.reply_text("❌ Valor inválido. Usa un entero entre 1 y 1000. Ej: /clean_chat 200")
             return
 
-    deleted, skipped_pinned, failed = await _perform_clean(chat.id, context, n)
+    # Una sola limpieza por chat o topic: una petición repetida amplía el objetivo de la que está en curso.
+    # Las que se solaparían (todo el chat y sus topics, o un auto-clean del mismo destino) no corren a
+    # la vez. Todo se decide y se registra antes del primer await.
+    topic = message_topic(msg)
+    target = (chat.id, topic)
+    running = CLEAN_JOBS.get(target)
+    if running is None:
+        if _clean_overlaps(target, CLEAN_JOBS):
+            if topic is None:
+                await msg.reply_text("⏳ Hay limpiezas de topics en curso. Espera a que terminen o usa /clean_cancel en cada topic.")
+            else:
+                await msg.reply_text("⏳ Hay una limpieza de todo el chat en curso. Espera a que termine o usa /clean_cancel fuera del topic.")
+            return
+        if _clean_overlaps(target, AUTO_CLEAN_RUNNING):
+            await msg.reply_text("⏳ Hay un auto-clean en curso en este chat. Vuelve a intentarlo cuando termine.")
+            return
+        job = CleanJob(chat.id, n, topic)
+        job.command_ids.add(msg.message_id)
+        CLEAN_JOBS[target] = job
+    else:
+        running.n = max(running.n, n)
+        running.command_ids.add(msg.message_id)
+        log_clean.info("Limpieza ya en curso; objetivo %d", running.n, extra=_kv(chat_id=chat.id, thread_id=topic))
 
     # Intentar borrar el mensaje que invoca el comando
     try:
         await context.bot.delete_message(chat_id=chat.id, message_id=msg.message_id)
     except Exception:
         pass
+    if running is not None:
+        return
 
-    # Enviar resumen y borrarlo a los 5s
-    thread_kwargs = {"message_thread_id": getattr(msg, "message_thread_id", None)} if getattr(msg, "message_thread_id", None) else {}
-    summary = await context.bot.send_message(
-        chat_id=chat.id,
-        text=(
-            f"🧹 Limpieza completada. Eliminados: {deleted}. "
-            f"Skipped fijados: {skipped_pinned}. Fallidos: {failed}."
-        ),
-        disable_web_page_preview=True,
-        **thread_kwargs,
-    )
+    thread_id = getattr(msg, "message_thread_id", None)
+    thread_kwargs = {"message_thread_id": thread_id} if thread_id else {}
+    try:
+        progress = await context.bot.send_message(
+            chat_id=chat.id,
+            text=job.progress_text(),
+            disable_web_page_preview=True,
+            **thread_kwargs,
+        )
+        job.progress_message_id = progress.message_id
+    except Exception as e:
+        log_clean.warning("No se pudo enviar el mensaje de progreso: %s", e, extra=_kv(chat_id=chat.id))
+    context.application.create_task(_run_clean_job(context, job), name=f"clean_chat_{chat.id}")
+
+
+async def clean_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Detiene la limpieza en curso de este chat (o de este topic). Uso: /clean_cancel."""
+    chat = update.effective_chat
+    msg = update.effective_message
+    user = msg.from_user if msg else None
+    if not chat or not msg or not user:
+        return
+    if ALLOWED_CHAT_IDS and chat.id not in ALLOWED_CHAT_IDS:
+        return
+
+    if not await is_admin(context, chat.id, user.id):
+        await msg.reply_text("🚫 Solo administradores/owner pueden cancelar la limpieza.")
+        return
 
+    job = CLEAN_JOBS.get((chat.id, message_topic(msg)))
+    if job is None:
+        await msg.reply_text("ℹ️ No hay ninguna limpieza en curso en este chat.")
+        return
+    job.cancelled.set()
     try:
-        if getattr(context, "job_queue", None):
-            context.job_queue.run_once(
-                delete_welcome_job,
-                when=5,
-                data={"chat_id": chat.id, "message_id": summary.message_id},
-                name=f"del_clean_summary_{chat.id}_{summary.message_id}",
-            )
-        else:
-            async def _del_summary(bot, cid, mid):
-                try:
-                    await asyncio.sleep(5)
-                    await bot.delete_message(chat_id=cid, message_id=mid)
-                except Exception:
-                    pass
-            if getattr(context, "application", None) and hasattr(context.application, "create_task"):
-                context.application.create_task(_del_summary(context.bot, chat.id, summary.message_id))
-            else:
-                asyncio.create_task(_del_summary(context.bot, chat.id, summary.message_id))
+        await context.bot.delete_message(chat_id=chat.id, message_id=msg.message_id)
     except Exception:
         pass
 
@@ -1121,7 +3226,8 @@ async def reset_registration(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 
 async def set_auto_clean(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Programa limpieza automática del chat cada X horas (0=off). Uso: /set_auto_clean <horas|off>."""
+    """Programa limpieza automática del chat (o, dentro de un topic de foro, sólo de ese topic)
+    cada X horas (0=off). Uso: /set_auto_clean <horas|off>."""
     chat = update.effective_chat
     msg = update.effective_message
     user = msg.from_user if msg else None
@@ -1155,11 +3261,13 @@ async def set_auto_clean(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await msg.reply_text("❌ Valor inválido. Usa un entero ≥ 0 u 'off'.")
             return
 
-    save_auto_clean_hours(chat.id, hours)
-    # Reprogramar en JobQueue si corresponde
-    _schedule_auto_clean_if_configured(context, chat.id)
+    topic = message_topic(msg)
+    save_auto_clean_hours(chat.id, hours, thread_id=topic)
+    # Reprogramar en el barrido si corresponde
+    _schedule_auto_clean_if_configured(context, chat.id, topic)
     await msg.reply_text(
-        f"✅ Auto-clean {'desactivado' if hours == 0 else f'programado cada {hours} h'}."
+        f"✅ Auto-clean {'de este topic ' if topic is not None else ''}"
+        f"{'desactivado' if hours == 0 else f'programado cada {hours} h'}."
     )
 
 
@@ -1171,9 +3279,7 @@ async def cmd_cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not chat or not msg or not user:
         return
     
-    chat_user_key = (chat.id, user.id)
-    if chat_user_key in waiting_for_message:
-        del waiting_for_message[chat_user_key]
+    if _waiting(context).pop(user.id, None) is not None:
         sent = await msg.reply_text("❌ Operación cancelada.")
         _record_bot_message(context, sent)
     else:
@@ -1181,6 +3287,105 @@ async def cmd_cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         _record_bot_message(context, sent)
 
 
+def _fmt_when(ts: float, now: float) -> str:
+    delta = ts - now
+    rel = f"en {_fmt_duration(delta)}" if delta >= 0 else f"hace {_fmt_duration(-delta)}"
+    return f"{time.strftime('%d/%m %H:%M', time.localtime(ts))} ({rel})"
+
+
+def _fmt_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 120:
+        return f"{seconds} s"
+    if seconds < 7200:
+        return f"{seconds // 60} min"
+    return f"{seconds // 3600} h {seconds % 3600 // 60} min"
+
+
+def _latency_percentiles(samples) -> str:
+    if not samples:
+        return "sin datos"
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(len(ordered) * p))]  # noqa: E731
+    return f"p50 {pick(0.5):.0f} ms · p95 {pick(0.95):.0f} ms · p99 {pick(0.99):.0f} ms ({len(ordered)} llamadas)"
+
+
+def _chat_stats_lines(context: ContextTypes.DEFAULT_TYPE, chat_id: int, now: float) -> List[str]:
+    due = AUTO_CLEAN_DUE.get((chat_id, None))
+    job = CLEAN_JOBS.get((chat_id, None))
+    topics = context.chat_data.get("topic_cache") or {}
+    topic_cleans = AUTO_CLEAN_TOPIC_COUNT.get(chat_id, 0)
+    return [
+        "<b>Este chat</b>",
+        f"• Mensajes en la caché de limpieza: {cached_message_count(context.chat_data)}"
+        + (f" ({len(topics)} topics)" if topics else ""),
+        f"• Flujos /set_* en espera: {len(context.chat_data.get('waiting') or ())}",
+        f"• Borrados programados pendientes: {len(PENDING_DELETES.get(chat_id) or ())}",
+        f"• Próximo auto-clean: {_fmt_when(due, now) if due else 'desactivado'}"
+        + (f"; {topic_cleans} topics con auto-clean propio" if topic_cleans else ""),
+        f"• Limpieza en curso: {f'{job.deleted}/{job.n} borrados' if job else 'no'}",
+    ]
+
+
+def _global_stats_lines(now: float) -> List[str]:
+    oldest = oldest_pending_delete()
+    if oldest is None:
+        overdue = "ninguno"
+    elif oldest[0] <= now:
+        overdue = f"atrasado {_fmt_duration(now - oldest[0])} (chat {oldest[1]}, mensaje {oldest[2]})"
+    else:
+        overdue = f"ninguno atrasado; el próximo {_fmt_when(oldest[0], now)}"
+    hits, misses = M_ADMIN_CACHE.value(result="hit"), M_ADMIN_CACHE.value(result="miss")
+    checks = hits + misses
+    ratio = f"{100.0 * hits / checks:.1f} % de aciertos ({checks:.0f} consultas)" if checks else "sin consultas"
+    next_clean = min(
+        (due for due, cid, tid in AUTO_CLEAN_QUEUE[:1] if AUTO_CLEAN_DUE.get((cid, tid or None)) == due), default=None
+    )
+    lag = HEALTH.lag_ms()
+    return [
+        "<b>Global</b>",
+        f"• Chats con estado cargado: {len(APPLICATION.chat_data) if APPLICATION else 0}",
+        f"• Borrados pendientes: {_pending_count}; más antiguo: {overdue}",
+        f"• Jobs programados: {_scheduled_jobs_count()}",
+        f"• Auto-clean: {len(AUTO_CLEAN_DUE)} chats/topics, {len(AUTO_CLEAN_RUNNING)} en curso"
+        + (f", próximo {_fmt_when(next_clean, now)}" if next_clean else ""),
+        f"• Limpiezas /clean_chat en curso: {len(CLEAN_JOBS)}",
+        f"• Caché de is_admin: {len(_admin_cache)} entradas, {ratio}",
+        f"• Latencia Bot API: {_latency_percentiles(API_LATENCIES_MS)}",
+        f"• Ejecutor de borrados: límite {DELETE_EXECUTOR.limit:.1f}, en curso {DELETE_EXECUTOR.in_flight}",
+        f"• Lag del event loop: p99 {lag['p99'] if lag['p99'] is not None else '-'} ms",
+    ]
+
+
+async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Estado interno del bot: del chat para sus admins; también global para superadmins.
+    Sólo lee contadores e índices en memoria (nunca recorre los archivos)."""
+    chat = update.effective_chat
+    msg = update.effective_message
+    user = msg.from_user if msg else None
+    if not chat or not msg or not user:
+        return
+    if ALLOWED_CHAT_IDS and chat.id not in ALLOWED_CHAT_IDS and user.id not in SUPER_ADMIN_IDS:
+        return
+
+    superadmin = user.id in SUPER_ADMIN_IDS
+    if chat.type == ChatType.PRIVATE and not superadmin:
+        await msg.reply_text("ℹ️ Por favor ejecuta este comando dentro del grupo.")
+        return
+    if not superadmin and not await is_admin(context, chat.id, user.id):
+        await msg.reply_text("🚫 Solo administradores/owner pueden ver las estadísticas.")
+        return
+
+    now = time.time()
+    lines = ["📊 <b>Estadísticas del bot</b>", ""]
+    if chat.type != ChatType.PRIVATE:
+        lines += _chat_stats_lines(context, chat.id, now) + [""]
+    if superadmin:
+        lines += _global_stats_lines(now)
+    sent = await msg.reply_text("\n".join(lines).rstrip(), parse_mode=ParseMode.HTML)
+    _record_bot_message(context, sent)
+
+
 async def handle_waiting_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Procesa mensajes cuando el usuario está esperando enviar contenido."""
     chat = update.effective_chat
@@ -1189,19 +3394,19 @@ async def handle_waiting_messages(update: Update, context: ContextTypes.DEFAULT_
     if not chat or not msg or not user:
         return
     
-    chat_user_key = (chat.id, user.id)
+    waiting = _waiting(context)
     
     # Verificar si el usuario está esperando enviar algo
-    if chat_user_key not in waiting_for_message:
+    if user.id not in waiting:
         return  # No hacer nada, dejar que otros handlers procesen el mensaje
     
     # Obtener el tipo de espera
-    waiting_type = waiting_for_message[chat_user_key]
+    waiting_type = waiting[user.id]
     
     if waiting_type == "waiting_for_welcome":
         # Verificar permisos nuevamente
         if not await is_admin(context, chat.id, user.id):
-            del waiting_for_message[chat_user_key]
+            del waiting[user.id]
             sent = await msg.reply_text("🚫 Solo administradores/owner pueden cambiar la bienvenida.")
             _record_bot_message(context, sent)
             return
@@ -1217,7 +3422,7 @@ async def handle_waiting_messages(update: Update, context: ContextTypes.DEFAULT_
         save_welcome_text(chat.id, new_text.strip())
         
         # Limpiar el estado de espera
-        del waiting_for_message[chat_user_key]
+        del waiting[user.id]
         
         # Confirmar y mostrar vista previa
         sent = await msg.reply_text("✅ ¡Mensaje de bienvenida actualizado correctamente!")
@@ -1227,7 +3432,7 @@ async def handle_waiting_messages(update: Update, context: ContextTypes.DEFAULT_
     elif waiting_type == "waiting_for_registration":
         # Verificar permisos nuevamente
         if not await is_admin(context, chat.id, user.id):
-            del waiting_for_message[chat_user_key]
+            del waiting[user.id]
             sent = await msg.reply_text("🚫 Solo administradores/owner pueden cambiar el mensaje de registro.")
             _record_bot_message(context, sent)
             return
@@ -1243,7 +3448,7 @@ async def handle_waiting_messages(update: Update, context: ContextTypes.DEFAULT_
         save_registration_text(chat.id, new_text.strip())
         
         # Limpiar el estado de espera
-        del waiting_for_message[chat_user_key]
+        del waiting[user.id]
         
         # Confirmar y mostrar vista previa
         sent = await msg.reply_text("✅ ¡Mensaje de registro actualizado correctamente!")
@@ -1251,68 +3456,1521 @@ async def handle_waiting_messages(update: Update, context: ContextTypes.DEFAULT_
         await test_welcome(update, context)
 
 
-# === Arranque ===
+# === Recarga de configuración en caliente (SIGHUP) ===
+# `kill -HUP` (o `./bot-manager.sh reload`) vuelve a leer .env y sustituye la configuración
+# recargable sin parar el polling ni vaciar cachés. La sustitución ocurre en un único callback
+# del event loop, así que ningún handler ve una mezcla de valores viejos y nuevos.
+HOT_RELOAD_KEYS = ("ALLOWED_CHAT_IDS", "SUPER_ADMIN_IDS", "WELCOME_TOPIC_ID", "WELCOME_DELETE_SECONDS")
+
+
+def _read_env_file() -> Dict[str, str]:
+    """Valores efectivos tras releer .env: el entorno del proceso sigue ganando a .env, también
+    para las variables que .env no define (p. ej. Environment= del unit de systemd)."""
+    values = {k: (v or "") for k, v in dotenv_values(ENV_PATH).items()}
+    for key in _ENV_FROM_PROCESS:
+        if key in os.environ:
+            values[key] = os.environ[key]
+    return values
+
+
+def _describe_change(name: str, old, new) -> str:
+    if isinstance(old, set):
+        added, removed = sorted(new - old), sorted(old - new)
+        parts = [f"+{added}" if added else "", f"-{removed}" if removed else ""]
+        return f"{name} " + " ".join(p for p in parts if p)
+    return f"{name} {old!r} → {new!r}"
+
+
+def apply_config(values: Dict[str, str], app: Optional[Application] = None) -> List[str]:
+    """Sustituye la configuración recargable por la de `values` (claves de .env) y
+    devuelve la lista de cambios aplicados."""
+    global ALLOWED_CHAT_IDS, SUPER_ADMIN_IDS, WELCOME_TOPIC_ID, WELCOME_DELETE_SECONDS
+    new = {
+        "ALLOWED_CHAT_IDS": parse_ids(values.get("ALLOWED_CHAT_IDS", "").strip()),
+        "SUPER_ADMIN_IDS": parse_ids(values.get("SUPER_ADMIN_IDS", "").strip()),
+        "WELCOME_TOPIC_ID": parse_topic_id(values.get("WELCOME_TOPIC_ID", "").strip()),
+        "WELCOME_DELETE_SECONDS": parse_delete_seconds(values.get("WELCOME_DELETE_SECONDS", "").strip()),
+    }
+    old = {
+        "ALLOWED_CHAT_IDS": ALLOWED_CHAT_IDS,
+        "SUPER_ADMIN_IDS": SUPER_ADMIN_IDS,
+        "WELCOME_TOPIC_ID": WELCOME_TOPIC_ID,
+        "WELCOME_DELETE_SECONDS": WELCOME_DELETE_SECONDS,
+    }
+    changes = [_describe_change(k, old[k], new[k]) for k in HOT_RELOAD_KEYS if old[k] != new[k]]
+    ALLOWED_CHAT_IDS, SUPER_ADMIN_IDS = new["ALLOWED_CHAT_IDS"], new["SUPER_ADMIN_IDS"]
+    WELCOME_TOPIC_ID, WELCOME_DELETE_SECONDS = new["WELCOME_TOPIC_ID"], new["WELCOME_DELETE_SECONDS"]
+    if old["ALLOWED_CHAT_IDS"] != ALLOWED_CHAT_IDS:
+        # Auto-clean: fuera los chats que dejan de estar permitidos
+        for chat_id, thread_id in [t for t in AUTO_CLEAN_DUE if not chat_allowed(t[0])]:
+            _cancel_auto_clean_jobs(app, chat_id, thread_id)
+    if app is not None:
+        # Dentro los que entran y los configurados desde otro proceso (/bulk_set en modo shard)
+        restore_auto_clean_schedule(app)
+    return changes
+
+
+def reload_config(app: Optional[Application] = None) -> List[str]:
+    """Relee .env y aplica ALLOWED_CHAT_IDS, SUPER_ADMIN_IDS, WELCOME_TOPIC_ID y
+    WELCOME_DELETE_SECONDS. Devuelve la lista de cambios aplicados."""
+    try:
+        values = _read_env_file()
+    except Exception as e:
+        log.error("Recarga de configuración fallida (%s): se mantiene la actual", e)
+        return []
+    changes = apply_config(values, app)
+    restart_only = sorted(
+        k for k, v in values.items()
+        if k not in HOT_RELOAD_KEYS and k not in _ENV_FROM_PROCESS and os.environ.get(k, "") != v
+    )
+    if changes:
+        log.info("Configuración recargada: %s", "; ".join(changes))
+    else:
+        log.info("Configuración recargada sin cambios")
+    if restart_only:
+        log.warning("Cambios en .env que requieren reiniciar: %s", ", ".join(restart_only))
+    return changes
+
+
+# === Difusión y ajustes en bloque (superadmins, en privado) ===
+# /broadcast envía un anuncio y /bulk_set aplica un ajuste por chat a un conjunto de chats
+# (todos los permitidos o una lista). Hay un solo trabajo a la vez: BULK_CONCURRENCY tareas
+# sacan chats de una cola, los envíos se espacian a BULK_RATE mensajes/s (además del límite
+# global y por chat de la capa HTTP) y cada chat terminado se anota en bulk_job.jsonl. Si el
+# proceso se reinicia a mitad, post_init reanuda el trabajo con los chats que faltan.
+BULK_CONCURRENCY: int = _env_int("BULK_CONCURRENCY", 4, 1)
+BULK_RATE: float = _env_float("BULK_RATE", 20.0, 0.1)
+# Pasadas sobre los chats con errores transitorios (red, 429, circuito abierto)
+BULK_MAX_PASSES = 3
+BULK_PROGRESS_INTERVAL = 5.0
+BULK_SETTINGS = ("welcome", "welcome_delete", "auto_clean", "sticky")
+
+M_BULK_CHATS = METRICS.counter("qvc_bulk_chats_total", "Chats procesados por /broadcast y /bulk_set", ("kind", "result"))
+
+
+def bulk_job_path() -> Path:
+    return DATA_DIR / "bulk_job.jsonl"
+
+
+def parse_bulk_setting(name: str, raw: str):
+    """Valida el valor de un ajuste de /bulk_set. None = volver al valor por defecto.
+    Lanza ValueError con el motivo en español."""
+    raw = raw.strip()
+    low = raw.lower()
+    if name == "welcome":
+        if not raw:
+            raise ValueError("falta el texto de bienvenida (o 'reset')")
+        return None if low == "reset" else raw
+    if name in ("welcome_delete", "auto_clean"):
+        if low == "reset" and name == "welcome_delete":
+            return None
+        if low in ("off", "desactivar"):
+            return 0
+        try:
+            value = int(raw)
+        except ValueError:
+            value = -1
+        if value < 0:
+            raise ValueError("usa un entero ≥ 0 u 'off'")
+        return value
+    if name == "sticky":
+        if low in ("on", "1", "activar"):
+            return True
+        if low in ("off", "0", "desactivar"):
+            return False
+        raise ValueError("usa on u off")
+    raise ValueError(f"ajuste desconocido; usa {', '.join(BULK_SETTINGS)}")
 
-COMMANDS: List[BotCommand] = [
-    BotCommand("help", "Ver ayuda y lista de comandos"),
-    BotCommand("whoami", "Ver tu user_id"),
-    BotCommand("debug_admin", "Debug de permisos de admin"),
-    BotCommand("id", "Mostrar chat_id y (si aplica) topic_id"),
-    BotCommand("test_welcome", "Probar mensaje único combinado"),
-    BotCommand("get_welcome", "Ver texto de bienvenida actual"),
-    BotCommand("set_welcome", "Cambiar bienvenida (admins/owner)"),
-    BotCommand("reset_welcome", "Restaurar bienvenida por defecto (admins/owner)"),
-    BotCommand("get_registration", "Ver texto de registro actual"),
-    BotCommand("set_registration", "Cambiar mensaje de registro (admins/owner)"),
-    BotCommand("reset_registration", "Restaurar mensaje de registro por defecto (admins/owner)"),
-    BotCommand("cancelar", "Cancelar operación en curso"),
-    BotCommand("get_welcome_delete", "Ver el tiempo de auto-borrado actual"),
-    BotCommand("set_welcome_delete", "Cambiar auto-borrado de bienvenida (admins/owner)"),
-    BotCommand("reset_welcome_delete", "Volver al auto-borrado global (.env)"),
-    BotCommand("clean_chat", "Eliminar últimos N mensajes no fijados (admins)"),
-    BotCommand("set_auto_clean", "Programar limpieza automática por horas (admins)"),
-]
 
-async def post_init(app: Application):
-    # Publica la lista para que Telegram muestre los comandos al escribir '/'
+def apply_bulk_setting(app: Application, chat_id: int, setting: str, value) -> None:
+    """Mismo efecto que /set_welcome, /set_welcome_delete, /set_auto_clean o /set_welcome_sticky en el chat."""
+    if setting == "welcome":
+        if value is None:
+            reset_welcome_text(chat_id)
+        else:
+            save_welcome_text(chat_id, value)
+    elif setting == "welcome_delete":
+        if value is None:
+            reset_delete_seconds_for_chat(chat_id)
+        else:
+            save_delete_seconds_for_chat(chat_id, value)
+    elif setting == "auto_clean":
+        save_auto_clean_hours(chat_id, value)
+        # En modo shard el worker dueño lo programa al recibir SIGHUP (bot-manager.sh reload)
+        if owns_chat(chat_id):
+            _schedule_auto_clean_if_configured(app, chat_id)
+    elif setting == "sticky":
+        save_sticky_for_chat(chat_id, value)
+
+
+def bulk_target_chats(app: Application, spec: str) -> List[int]:
+    """'all' = ALLOWED_CHAT_IDS o, si está vacío, los grupos con estado guardado; si no, lista de IDs."""
+    if spec.lower() in ("all", "todos"):
+        if ALLOWED_CHAT_IDS:
+            return sorted(ALLOWED_CHAT_IDS)
+        if isinstance(app.persistence, ChatStatePersistence):
+            return app.persistence.known_group_ids()
+        return []
+    return sorted(c for c in parse_ids(spec) if chat_allowed(c))
+
+
+class BulkJob:
+    """Trabajo de /broadcast o /bulk_set: chats objetivo, resultado por chat y cancelación."""
+
+    def __init__(self, kind: str, payload: dict, targets: List[int], requested_by: int, shard: Optional[int] = None):
+        self.kind = kind
+        self.payload = payload
+        self.targets = targets
+        self.requested_by = requested_by
+        self.shard = shard
+        self.done: Set[int] = set()
+        self.failed: Dict[int, str] = {}
+        self.cancelled = asyncio.Event()
+        self.progress_message_id: Optional[int] = None
+        self.started_at = time.monotonic()
+
+    def header(self) -> dict:
+        return {
+            "kind": self.kind,
+            "payload": self.payload,
+            "targets": self.targets,
+            "requested_by": self.requested_by,
+            "shard": self.shard,
+            "created_at": int(time.time()),
+        }
+
+    def remaining(self) -> List[int]:
+        return [c for c in self.targets if c not in self.done and c not in self.failed]
+
+    def describe(self) -> str:
+        if self.kind == "broadcast":
+            return "Difusión"
+        return f"Ajuste {self.payload['setting']}"
+
+    def progress_text(self, final: bool = False) -> str:
+        counts = f"{len(self.done)}/{len(self.targets)} hechos, {len(self.failed)} fallidos"
+        if not final:
+            return f"📣 {self.describe()}: {counts}. Usa /bulk_cancel para detener."
+        if self.cancelled.is_set():
+            return f"⏹️ {self.describe()} cancelada: {counts}."
+        lines = [f"✅ {self.describe()} terminada: {counts}."]
+        for chat_id, error in list(self.failed.items())[:20]:
+            lines.append(f"• {chat_id}: {error}")
+        if len(self.failed) > 20:
+            lines.append(f"… y {len(self.failed) - 20} más")
+        return "\n".join(lines)
+
+
+BULK_JOB: Optional[BulkJob] = None
+_bulk_limiter: Optional[ApiRateLimiter] = None
+
+
+def _journal_bulk(record: dict, header: bool = False) -> None:
+    # Una línea por chat terminado; al reanudar, una última línea truncada se ignora
+    with bulk_job_path().open("w" if header else "a", encoding="utf-8") as f:
+        f.write(json_dumps(record) + "\n")
+
+
+def load_bulk_job() -> Optional[BulkJob]:
+    """Trabajo interrumpido por un reinicio (None si no hay o el archivo es ilegible)."""
+    p = bulk_job_path()
+    if not p.exists():
+        return None
     try:
-        await app.bot.set_my_commands(COMMANDS)
+        lines = p.read_text(encoding="utf-8").splitlines()
+        head = json_loads(lines[0])
+        job = BulkJob(head["kind"], head["payload"], [int(c) for c in head["targets"]], int(head["requested_by"]), head.get("shard"))
     except Exception as e:
-        print("No se pudo publicar setMyCommands:", e)
-    # Reprogramar borrados pendientes por chat (si existen archivos)
+        log.warning("Trabajo en bloque ilegible, se descarta: %s", e)
+        p.unlink(missing_ok=True)
+        return None
+    for line in lines[1:]:
+        try:
+            rec = json_loads(line)
+            chat_id = int(rec["chat_id"])
+        except Exception:
+            continue
+        if rec.get("result") == "ok":
+            job.done.add(chat_id)
+        else:
+            job.failed[chat_id] = str(rec.get("error", ""))
+    return job
+
+
+async def _bulk_one(app: Application, job: BulkJob, chat_id: int) -> None:
+    global _bulk_limiter
+    if job.kind == "broadcast":
+        if _bulk_limiter is None:
+            _bulk_limiter = ApiRateLimiter(BULK_RATE)
+        await _bulk_limiter.acquire("sendMessage", chat_id)
+        sent = await call_api(
+            "sendMessage",
+            lambda: app.bot.send_message(chat_id=chat_id, text=job.payload["text"], disable_web_page_preview=True),
+            critical=False,
+            idempotent=False,
+        )
+        # Sólo el proceso dueño del chat guarda su caché (/clean_chat podrá borrar el anuncio)
+        if owns_chat(chat_id):
+            chat_message_cache(app, chat_id).append((sent.message_id, app.bot.id, False, False))
+            app.mark_data_for_update_persistence(chat_ids=chat_id)
+    else:
+        apply_bulk_setting(app, chat_id, job.payload["setting"], job.payload["value"])
+
+
+async def _edit_bulk_progress(app: Application, job: BulkJob, final: bool = False) -> None:
     try:
-        base = Path(__file__).parent
-        for p in base.glob("pending_deletes_*.jsonl"):
+        if job.progress_message_id is None or final:
+            # El resumen final va en un mensaje nuevo para que llegue la notificación
+            sent = await call_api(
+                "sendMessage",
+                lambda: app.bot.send_message(chat_id=job.requested_by, text=job.progress_text(final)),
+                critical=False,
+            )
+            if not final:
+                job.progress_message_id = sent.message_id
+            return
+        await call_api(
+            "editMessageText",
+            lambda: app.bot.edit_message_text(
+                chat_id=job.requested_by, message_id=job.progress_message_id, text=job.progress_text()
+            ),
+            critical=False,
+            deadline=10.0,
+        )
+    except Exception as e:
+        log.debug("No se pudo publicar el progreso del trabajo en bloque: %s", e)
+
+
+async def run_bulk_job(app: Application, job: BulkJob) -> None:
+    """Procesa los chats que faltan con BULK_CONCURRENCY tareas; los errores transitorios se
+    reintentan en hasta BULK_MAX_PASSES pasadas, los permanentes se anotan como fallidos."""
+    global BULK_JOB
+    BULK_JOB = job
+
+    async def _ticker():
+        last = None
+        while True:
+            await asyncio.sleep(BULK_PROGRESS_INTERVAL)
+            state = (len(job.done), len(job.failed))
+            if state != last:
+                last = state
+                await _edit_bulk_progress(app, job)
+
+    async def _worker(queue: List[int]) -> None:
+        while queue and not job.cancelled.is_set():
+            chat_id = queue.pop()
             try:
-                chat_id = int(p.stem.split("_")[-1])
-            except Exception:
-                continue
-            records = _load_pending_deletes(chat_id)
-            now = int(time.time())
-            if not records:
-                continue
-            print(f"[DEBUG] [persist] Reprogramando {len(records)} borrados pendientes para chat {chat_id}")
-            for rec in records:
-                try:
-                    mid = int(rec.get("message_id"))
-                    delete_at = int(rec.get("delete_at"))
-                    thread_id = rec.get("thread_id")
-                    delay = max(0, delete_at - now)
-                    _schedule_delete_with_persistence(app, chat_id, mid, delay, thread_id)
-                except Exception:
+                await _bulk_one(app, job, chat_id)
+            except Exception as e:
+                if isinstance(e, CircuitOpenError) or classify_api_error(e, idempotent=False) != "permanent":
+                    # Queda pendiente para la siguiente pasada
                     continue
+                job.failed[chat_id] = str(e)[:200]
+                M_BULK_CHATS.inc(kind=job.kind, result="failed")
+                _journal_bulk({"chat_id": chat_id, "result": "failed", "error": job.failed[chat_id]})
+                continue
+            job.done.add(chat_id)
+            M_BULK_CHATS.inc(kind=job.kind, result="ok")
+            _journal_bulk({"chat_id": chat_id, "result": "ok"})
+
+    await _edit_bulk_progress(app, job)
+    ticker = asyncio.create_task(_ticker())
+    try:
+        for attempt in range(BULK_MAX_PASSES):
+            queue = job.remaining()[::-1]
+            if not queue or job.cancelled.is_set():
+                break
+            if attempt:
+                await asyncio.sleep(backoff_delay(attempt) + CIRCUIT_COOLDOWN)
+            await asyncio.gather(*(_worker(queue) for _ in range(min(BULK_CONCURRENCY, len(queue)))))
+        if not job.cancelled.is_set():
+            for chat_id in job.remaining():
+                job.failed[chat_id] = "errores transitorios en todas las pasadas"
+                M_BULK_CHATS.inc(kind=job.kind, result="failed")
+        bulk_job_path().unlink(missing_ok=True)
     except Exception as e:
-        print(f"[DEBUG] [persist] Error reprogramando pendientes: {e}")
+        # El diario queda en disco: se reanuda en el próximo arranque (o /bulk_cancel lo descarta)
+        log.exception("Error en el trabajo en bloque: %s", e)
+    finally:
+        ticker.cancel()
+        BULK_JOB = None
+    log.info(
+        "Trabajo en bloque %s",
+        "cancelado" if job.cancelled.is_set() else "terminado",
+        extra=_kv(
+            kind=job.kind,
+            done=len(job.done),
+            failed=len(job.failed),
+            seconds=round(time.monotonic() - job.started_at, 1),
+        ),
+    )
+    await _edit_bulk_progress(app, job, final=True)
 
 
-def main():
-    if not BOT_TOKEN:
-        raise SystemExit("Falta BOT_TOKEN en .env")
+def orphaned_bulk_job() -> Optional[BulkJob]:
+    """Trabajo de este proceso que quedó en disco tras un error, sin tarea que lo ejecute."""
+    if BULK_JOB is not None:
+        return None
+    job = load_bulk_job()
+    if job is None or job.shard != (SHARD[0] if SHARD else None):
+        return None
+    return job
 
-    app = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
 
-    # Comandos
-    app.add_handler(CommandHandler("help", cmd_help))
+def resume_bulk_job(app: Application) -> bool:
+    """Reanuda el trabajo en bloque interrumpido, si era de este proceso."""
+    job = load_bulk_job()
+    if job is None or job.shard != (SHARD[0] if SHARD else None):
+        return False
+    log.info("Reanudando trabajo en bloque: %d de %d chats pendientes", len(job.remaining()), len(job.targets))
+    app.create_task(run_bulk_job(app, job), name="bulk_job")
+    return True
+
+
+async def _start_bulk_job(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, payload: dict, spec: str) -> None:
+    msg = update.effective_message
+    if BULK_JOB is not None or bulk_job_path().exists():
+        if orphaned_bulk_job() is not None:
+            await msg.reply_text("⚠️ Hay un trabajo en bloque interrumpido por un error. Usa /bulk_status o /bulk_cancel.")
+            return
+        await msg.reply_text("⏳ Ya hay un trabajo en bloque en curso. Usa /bulk_status o /bulk_cancel.")
+        return
+    targets = bulk_target_chats(context.application, spec)
+    if not targets:
+        await msg.reply_text("❌ Ningún chat permitido coincide con el destino.")
+        return
+    job = BulkJob(kind, payload, targets, update.effective_user.id, SHARD[0] if SHARD else None)
+    try:
+        _journal_bulk(job.header(), header=True)
+    except Exception as e:
+        await msg.reply_text(f"❌ No se pudo guardar el trabajo: {e}")
+        return
+    log.info("Trabajo en bloque iniciado", extra=_kv(kind=kind, chats=len(targets), user_id=job.requested_by))
+    context.application.create_task(run_bulk_job(context.application, job), name="bulk_job")
+
+
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Envía un anuncio a varios chats. Uso: /broadcast <all|id,id,…> <texto> (superadmins, en privado)."""
+    if not _superadmin_private(update):
+        return
+    msg = update.effective_message
+    parts = (msg.text or "").split(None, 2)
+    if len(parts) < 3 or not parts[2].strip():
+        await msg.reply_text("Uso: /broadcast <all|id,id,…> <texto>. El texto puede tener varias líneas.")
+        return
+    await _start_bulk_job(update, context, "broadcast", {"text": parts[2].strip()}, parts[1])
+
+
+async def bulk_set(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Aplica un ajuste por chat a varios chats. Uso: /bulk_set <all|id,id,…> <ajuste> <valor> (superadmins, en privado)."""
+    if not _superadmin_private(update):
+        return
+    msg = update.effective_message
+    parts = (msg.text or "").split(None, 3)
+    if len(parts) < 4:
+        await msg.reply_text(
+            "Uso: /bulk_set <all|id,id,…> <ajuste> <valor>\n"
+            "• welcome <texto|reset>\n"
+            "• welcome_delete <segundos|off|reset>\n"
+            "• auto_clean <horas|off>\n"
+            "• sticky <on|off>"
+        )
+        return
+    setting = parts[2].lower()
+    try:
+        value = parse_bulk_setting(setting, parts[3])
+    except ValueError as e:
+        await msg.reply_text(f"❌ Valor inválido: {e}.")
+        return
+    await _start_bulk_job(update, context, "bulk_set", {"setting": setting, "value": value}, parts[1])
+
+
+async def bulk_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Progreso del trabajo en bloque en curso. Uso: /bulk_status."""
+    if not _superadmin_private(update):
+        return
+    if BULK_JOB is None:
+        orphan = orphaned_bulk_job()
+        if orphan is not None:
+            await update.effective_message.reply_text(
+                f"⚠️ {orphan.describe()} interrumpida por un error: {len(orphan.done)}/{len(orphan.targets)} hechos, "
+                f"{len(orphan.failed)} fallidos. Se reanudará al reiniciar; /bulk_cancel la descarta."
+            )
+            return
+        await update.effective_message.reply_text("ℹ️ No hay ningún trabajo en bloque en este proceso.")
+        return
+    await update.effective_message.reply_text(BULK_JOB.progress_text())
+
+
+async def bulk_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Detiene el trabajo en bloque en curso, o descarta el que quedó interrumpido por un error;
+    los chats ya hechos no se deshacen. Uso: /bulk_cancel."""
+    if not _superadmin_private(update):
+        return
+    if BULK_JOB is None:
+        if orphaned_bulk_job() is not None:
+            bulk_job_path().unlink(missing_ok=True)
+            log.info("Trabajo en bloque interrumpido descartado", extra=_kv(user_id=update.effective_user.id))
+            await update.effective_message.reply_text("🗑️ Trabajo en bloque interrumpido descartado.")
+            return
+        await update.effective_message.reply_text("ℹ️ No hay ningún trabajo en bloque en este proceso.")
+        return
+    BULK_JOB.cancelled.set()
+    await update.effective_message.reply_text("⏹️ Deteniendo el trabajo en bloque…")
+
+
+# === Perfilado bajo demanda (superadmins, en privado) ===
+# /prof_cpu muestrea la pila del hilo del event loop desde un hilo auxiliar durante N segundos;
+# /prof_mem activa tracemalloc y, en llamadas posteriores, envía la diferencia con la captura
+# anterior. Sin un perfil en curso no hay hilo de muestreo ni trazado de memoria: coste cero.
+PROF_CPU_INTERVAL = 0.005
+PROF_CPU_MAX_SECONDS = 120
+PROF_MEM_FRAMES = 10
+PROF_TOP = 30
+_prof_cpu_running = False
+_prof_mem_baseline: Optional["tracemalloc.Snapshot"] = None
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+def _sample_stacks(thread_id: int, seconds: float) -> Tuple[Dict[Tuple[str, ...], int], int]:
+    """Muestrea la pila de `thread_id` cada PROF_CPU_INTERVAL. Devuelve (pilas -> muestras, total)."""
+    stacks: Dict[Tuple[str, ...], int] = defaultdict(int)
+    total = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = sys._current_frames().get(thread_id)
+        stack: List[str] = []
+        while frame is not None:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        if stack:
+            stacks[tuple(reversed(stack))] += 1
+            total += 1
+        time.sleep(PROF_CPU_INTERVAL)
+    return stacks, total
+
+
+def _cpu_report(stacks: Dict[Tuple[str, ...], int], total: int, seconds: float) -> Tuple[str, str]:
+    """(informe legible, pilas en formato "folded" para flamegraph.pl / speedscope)."""
+    own: Dict[str, int] = defaultdict(int)
+    cumulative: Dict[str, int] = defaultdict(int)
+    idle = 0
+    for stack, count in stacks.items():
+        own[stack[-1]] += count
+        for label in set(stack):
+            cumulative[label] += count
+        if stack[-1].startswith("select (selectors.py"):
+            idle += count
+    pct = (lambda n: 100.0 * n / total) if total else (lambda n: 0.0)
+    lines = [
+        f"Perfil de CPU: {seconds:g} s, {total} muestras cada {PROF_CPU_INTERVAL * 1000:g} ms (hilo del event loop)",
+        f"Inactivo (esperando en select): {pct(idle):.1f} %",
+        "",
+        "Top por tiempo propio:",
+        "  %propio  %total  función",
+    ]
+    for label, count in sorted(own.items(), key=lambda kv: -kv[1])[:PROF_TOP]:
+        lines.append(f"  {pct(count):7.1f}  {pct(cumulative[label]):6.1f}  {label}")
+    lines += ["", "Top por tiempo acumulado:", "  %total  función"]
+    for label, count in sorted(cumulative.items(), key=lambda kv: -kv[1])[:PROF_TOP]:
+        lines.append(f"  {pct(count):6.1f}  {label}")
+    folded = "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(stacks.items(), key=lambda kv: -kv[1]))
+    return "\n".join(lines) + "\n", folded
+
+
+def _bot_state_summary() -> List[str]:
+    return [
+        "Estado del bot:",
+        f"  chats con chat_data cargado: {len(APPLICATION.chat_data) if APPLICATION else 0}",
+        f"  mensajes en la caché de limpieza: {_cached_messages_total()}",
+        f"  jobs en el JobQueue: {_scheduled_jobs_count()}",
+        f"  borrados pendientes (índice): {_pending_count}",
+        f"  entradas en la caché de is_admin: {len(_admin_cache)}",
+    ]
+
+
+def _mem_report(previous: "tracemalloc.Snapshot", current: "tracemalloc.Snapshot", state: List[str]) -> str:
+    """Corre en un hilo: `state` (_bot_state_summary) se calcula antes en el loop, que es el
+    único que toca los dicts del bot."""
+    import tracemalloc
+
+    ignore = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    )
+    previous, current = previous.filter_traces(ignore), current.filter_traces(ignore)
+    traced, peak = tracemalloc.get_traced_memory()
+    lines = [
+        f"Memoria trazada: {traced / 1e6:.1f} MB (pico {peak / 1e6:.1f} MB); diferencia con la captura anterior",
+        "",
+        *state,
+        "",
+        "Top por archivo:",
+    ]
+    lines += [f"  {stat}" for stat in current.compare_to(previous, "filename")[:15]]
+    lines += ["", "Top por línea:"]
+    by_line = current.compare_to(previous, "lineno")
+    lines += [f"  {stat}" for stat in by_line[:PROF_TOP]]
+    lines += ["", "Trazas de los 3 mayores crecimientos:"]
+    for stat in current.compare_to(previous, "traceback")[:3]:
+        lines.append(f"  {stat.size_diff / 1024:+.1f} KiB en {stat.count_diff:+d} bloques:")
+        lines += [f"    {line}" for line in stat.traceback.format()]
+    return "\n".join(lines) + "\n"
+
+
+def _superadmin_private(update: Update) -> bool:
+    chat = update.effective_chat
+    user = update.effective_user
+    return bool(chat and user and chat.type == ChatType.PRIVATE and user.id in SUPER_ADMIN_IDS)
+
+
+async def _send_report(context: ContextTypes.DEFAULT_TYPE, chat_id: int, filename: str, text: str, caption: str = "") -> None:
+    await context.bot.send_document(
+        chat_id=chat_id, document=io.BytesIO(text.encode("utf-8")), filename=filename, caption=caption or None
+    )
+
+
+async def _run_prof_cpu(context: ContextTypes.DEFAULT_TYPE, chat_id: int, seconds: float) -> None:
+    global _prof_cpu_running
+    try:
+        stacks, total = await asyncio.to_thread(_sample_stacks, threading.get_ident(), seconds)
+        report, folded = _cpu_report(stacks, total, seconds)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        await _send_report(context, chat_id, f"prof_cpu_{stamp}.txt", report, f"🔬 CPU {seconds:g} s")
+        await _send_report(context, chat_id, f"prof_cpu_{stamp}.folded", folded)
+    except Exception as e:
+        log.exception("Error en /prof_cpu: %s", e)
+        await context.bot.send_message(chat_id=chat_id, text=f"❌ Error en el perfil: {e}")
+    finally:
+        _prof_cpu_running = False
+
+
+async def prof_cpu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Perfil de CPU por muestreo del proceso en marcha. Uso: /prof_cpu [segundos] (superadmins, en privado)."""
+    global _prof_cpu_running
+    if not _superadmin_private(update):
+        return
+    msg = update.effective_message
+    seconds = 10.0
+    if context.args:
+        try:
+            seconds = max(1.0, min(float(PROF_CPU_MAX_SECONDS), float(context.args[0])))
+        except ValueError:
+            await msg.reply_text(f"❌ Valor inválido. Usa segundos entre 1 y {PROF_CPU_MAX_SECONDS}. Ej: /prof_cpu 10")
+            return
+    if _prof_cpu_running:
+        await msg.reply_text("⏳ Ya hay un perfil de CPU en curso.")
+        return
+    _prof_cpu_running = True
+    await msg.reply_text(f"🔬 Muestreando CPU durante {seconds:g} s…")
+    # En segundo plano: el handler no debe ocupar el procesamiento de updates mientras se mide
+    context.application.create_task(_run_prof_cpu(context, msg.chat_id, seconds), name="prof_cpu")
+
+
+async def prof_mem(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Diferencia de memoria con tracemalloc. Uso: /prof_mem (inicia o compara) | /prof_mem stop."""
+    global _prof_mem_baseline
+    import tracemalloc
+
+    if not _superadmin_private(update):
+        return
+    msg = update.effective_message
+    if context.args and context.args[0].lower() == "stop":
+        _prof_mem_baseline = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        await msg.reply_text("🧹 Trazado de memoria detenido.")
+        return
+    if not tracemalloc.is_tracing() or _prof_mem_baseline is None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROF_MEM_FRAMES)
+        _prof_mem_baseline = tracemalloc.take_snapshot()
+        await msg.reply_text(
+            "🧠 Trazado de memoria activado (ralentiza el proceso). Repite /prof_mem más tarde para ver el "
+            "crecimiento, y /prof_mem stop para desactivarlo."
+        )
+        return
+    current = await asyncio.to_thread(tracemalloc.take_snapshot)
+    report = await asyncio.to_thread(_mem_report, _prof_mem_baseline, current, _bot_state_summary())
+    _prof_mem_baseline = current
+    await _send_report(context, msg.chat_id, f"prof_mem_{time.strftime('%Y%m%d-%H%M%S')}.txt", report, "🧠 Memoria")
+
+
+# === Snapshot binario del estado (migración entre hosts y arranque en caliente) ===
+# Un snapshot reúne en un solo flujo los ajustes por chat (welcome_*.md, registration_*.md,
+# welcome_delete_*, welcome_sticky_* y auto_clean_* con su última ejecución, de la que sale
+# la fase del barrido), los borrados pendientes y el chat_data de SQLite (cachés de limpieza
+# por chat y por topic). Formato, con enteros big-endian:
+#   cabecera   SNAPSHOT_MAGIC, versión (u8), creado_en (u64)
+#   registro   tipo (u8), chat_id (i64), longitud (u32), datos
+#   cierre     tipo SNAP_END con el número de registros (u64) y el CRC32 de todo lo anterior (u32)
+# Se escribe y se lee por partes, así que sirve un pipe (--export-snapshot - | ssh …
+# --import-snapshot -), pero no se aplica nada hasta validar el cierre: un flujo truncado o
+# corrupto no deja el estado a medias.
+SNAPSHOT_MAGIC = b"QVCSNAP"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_MAX_RECORD = 64 * 2**20
+_SNAP_HEADER = struct.Struct(">7sBQ")
+_SNAP_RECORD = struct.Struct(">BqI")
+_SNAP_END = struct.Struct(">QI")
+_SNAP_U32 = struct.Struct(">I")
+# thread_id (0 = todo el chat), horas, última ejecución
+_SNAP_AUTO_CLEAN = struct.Struct(">qIq")
+# Por borrado pendiente: message_id, thread_id (0 = sin topic), delete_at
+_SNAP_PENDING = struct.Struct(">qqq")
+
+SNAP_WELCOME = 1
+SNAP_REGISTRATION = 2
+SNAP_DELETE_SECONDS = 3
+SNAP_STICKY = 4
+SNAP_AUTO_CLEAN = 5
+SNAP_PENDING = 6
+SNAP_CHAT_DATA = 7
+SNAP_END = 255
+SNAP_KIND_NAMES = {
+    SNAP_WELCOME: "welcome",
+    SNAP_REGISTRATION: "registration",
+    SNAP_DELETE_SECONDS: "welcome_delete",
+    SNAP_STICKY: "welcome_sticky",
+    SNAP_AUTO_CLEAN: "auto_clean",
+    SNAP_PENDING: "pending_deletes",
+    SNAP_CHAT_DATA: "chat_data",
+}
+
+# Arranque en caliente: al apagarse (un solo proceso) se guarda warm_start.snap con el índice
+# de borrados pendientes y los auto-cleans programados; el siguiente arranque lo consume en
+# lugar de recorrer y parsear todos los archivos por chat.
+SNAPSHOT_WARM_START = os.environ.get("SNAPSHOT_WARM_START", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+class SnapshotError(Exception):
+    """Snapshot ilegible: formato o versión desconocidos, truncado o checksum incorrecto."""
+
+
+class SnapshotWriter:
+    """Escribe un snapshot por partes en un flujo binario (archivo, pipe o stdout)."""
+
+    def __init__(self, out, created_at: Optional[int] = None):
+        self.out = out
+        self.counts: Dict[int, int] = defaultdict(int)
+        self._records = 0
+        self._crc = 0
+        self._write(_SNAP_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, int(created_at or time.time())))
+
+    def _write(self, data: bytes) -> None:
+        self._crc = zlib.crc32(data, self._crc)
+        self.out.write(data)
+
+    def add(self, kind: int, chat_id: int, payload: bytes = b"") -> None:
+        self._write(_SNAP_RECORD.pack(kind, chat_id, len(payload)) + payload)
+        self._records += 1
+        self.counts[kind] += 1
+
+    def close(self) -> None:
+        self.out.write(_SNAP_RECORD.pack(SNAP_END, 0, _SNAP_END.size) + _SNAP_END.pack(self._records, self._crc))
+        self.out.flush()
+
+
+def _read_exact(stream, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise SnapshotError("snapshot truncado")
+    return data
+
+
+def read_snapshot(stream) -> Tuple[int, List[Tuple[int, int, bytes]]]:
+    """(creado_en, [(tipo, chat_id, datos)]) de un snapshot completo y validado."""
+    head = _read_exact(stream, _SNAP_HEADER.size)
+    magic, version, created_at = _SNAP_HEADER.unpack(head)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError("no es un snapshot del bot")
+    if version > SNAPSHOT_VERSION:
+        raise SnapshotError(f"versión {version} no soportada (máx. {SNAPSHOT_VERSION})")
+    crc = zlib.crc32(head)
+    records: List[Tuple[int, int, bytes]] = []
+    while True:
+        raw = _read_exact(stream, _SNAP_RECORD.size)
+        kind, chat_id, length = _SNAP_RECORD.unpack(raw)
+        if length > SNAPSHOT_MAX_RECORD:
+            raise SnapshotError(f"registro de {length} bytes: snapshot corrupto")
+        payload = _read_exact(stream, length)
+        if kind == SNAP_END:
+            if length != _SNAP_END.size or _SNAP_END.unpack(payload) != (len(records), crc):
+                raise SnapshotError("checksum o número de registros incorrecto")
+            return created_at, records
+        crc = zlib.crc32(payload, zlib.crc32(raw, crc))
+        records.append((kind, chat_id, payload))
+
+
+def _snapshot_chat_ids(pattern: str, prefix: str) -> List[int]:
+    ids: List[int] = []
+    for p in DATA_DIR.glob(pattern):
+        try:
+            ids.append(int(p.stem[len(prefix):]))
+        except ValueError:
+            continue
+    return sorted(ids)
+
+
+def _auto_clean_targets() -> List[CleanTarget]:
+    targets: List[CleanTarget] = []
+    for p in DATA_DIR.glob("auto_clean_*.txt"):
+        try:
+            ids = [int(x) for x in p.stem[len("auto_clean_"):].split("_")]
+        except ValueError:
+            continue
+        targets.append((ids[0], ids[1] if len(ids) > 1 else None))
+    return sorted(targets, key=lambda t: (t[0], t[1] or 0))
+
+
+def _snapshot_auto_clean(writer: SnapshotWriter, targets: List[CleanTarget]) -> None:
+    for chat_id, thread_id in targets:
+        hours = load_auto_clean_hours(chat_id, thread_id)
+        if hours:
+            last_run = load_auto_clean_last_run(chat_id, thread_id)
+            writer.add(SNAP_AUTO_CLEAN, chat_id, _SNAP_AUTO_CLEAN.pack(thread_id or 0, hours, last_run))
+
+
+def _snapshot_pending(writer: SnapshotWriter, chat_id: int, pending: Dict[int, Tuple[int, Optional[int]]]) -> None:
+    if pending:
+        writer.add(
+            SNAP_PENDING,
+            chat_id,
+            b"".join(_SNAP_PENDING.pack(mid, thread_id or 0, delete_at) for mid, (delete_at, thread_id) in pending.items()),
+        )
+
+
+def export_snapshot(out) -> Dict[str, int]:
+    """Vuelca a `out` todo el estado de DATA_DIR y de la base de chat_data (leída en solo
+    lectura, así que sirve con el bot en marcha). Devuelve los registros escritos por tipo."""
+    writer = SnapshotWriter(out)
+    for chat_id in _snapshot_chat_ids("welcome_*.md", "welcome_"):
+        writer.add(SNAP_WELCOME, chat_id, welcome_path_for_chat(chat_id).read_bytes())
+    for chat_id in _snapshot_chat_ids("registration_*.md", "registration_"):
+        writer.add(SNAP_REGISTRATION, chat_id, registration_path_for_chat(chat_id).read_bytes())
+    for chat_id in _snapshot_chat_ids("welcome_delete_*.txt", "welcome_delete_"):
+        writer.add(SNAP_DELETE_SECONDS, chat_id, _SNAP_U32.pack(load_delete_seconds_for_chat(chat_id)))
+    for chat_id in _snapshot_chat_ids("welcome_sticky_*.txt", "welcome_sticky_"):
+        if load_sticky_for_chat(chat_id):
+            writer.add(SNAP_STICKY, chat_id)
+    _snapshot_auto_clean(writer, _auto_clean_targets())
+    for chat_id in _snapshot_chat_ids("pending_deletes_*.jsonl", "pending_deletes_"):
+        pending = {}
+        for rec in _load_pending_deletes(chat_id):
+            try:
+                pending[int(rec["message_id"])] = (int(rec["delete_at"]), rec.get("thread_id"))
+            except Exception:
+                continue
+        _snapshot_pending(writer, chat_id, pending)
+    db_path = state_db_path()
+    if db_path.exists():
+        db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            for chat_id, blob in db.execute(f"SELECT chat_id, data FROM {STATE_TABLE} ORDER BY chat_id"):
+                writer.add(SNAP_CHAT_DATA, chat_id, bytes(blob))
+        except sqlite3.OperationalError as e:
+            log_persist.warning("Base de chat_data sin exportar: %s", e)
+        finally:
+            db.close()
+    writer.close()
+    return {SNAP_KIND_NAMES[k]: n for k, n in sorted(writer.counts.items())}
+
+
+def import_snapshot(stream) -> Dict[str, int]:
+    """Valida el snapshot completo y lo escribe en DATA_DIR y en la base de chat_data. Sustituye
+    los ajustes, pendientes y chat_data de los chats incluidos; el resto no se toca. Con el bot parado."""
+    _, records = read_snapshot(stream)
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    counts: Dict[str, int] = defaultdict(int)
+    rows: List[Tuple[int, bytes]] = []
+    for kind, chat_id, payload in records:
+        if kind == SNAP_WELCOME:
+            welcome_path_for_chat(chat_id).write_bytes(payload)
+        elif kind == SNAP_REGISTRATION:
+            registration_path_for_chat(chat_id).write_bytes(payload)
+        elif kind == SNAP_DELETE_SECONDS:
+            save_delete_seconds_for_chat(chat_id, _SNAP_U32.unpack(payload)[0])
+        elif kind == SNAP_STICKY:
+            save_sticky_for_chat(chat_id, True)
+        elif kind == SNAP_AUTO_CLEAN:
+            thread_id, hours, last_run = _SNAP_AUTO_CLEAN.unpack(payload)
+            save_auto_clean_hours(chat_id, hours, last_run, thread_id=thread_id or None)
+        elif kind == SNAP_PENDING:
+            _write_pending_file(
+                chat_id, {mid: (delete_at, t or None) for mid, t, delete_at in _SNAP_PENDING.iter_unpack(payload)}
+            )
+        elif kind == SNAP_CHAT_DATA:
+            rows.append((chat_id, payload))
+        else:
+            continue
+        counts[SNAP_KIND_NAMES[kind]] += 1
+    if rows:
+        store = ChatStatePersistence(state_db_path())
+        try:
+            store.write_rows(rows)
+        finally:
+            store.close()
+    # El snapshot de arranque en caliente ya no refleja los archivos
+    warm_snapshot_path().unlink(missing_ok=True)
+    return dict(counts)
+
+
+def warm_snapshot_path() -> Path:
+    return DATA_DIR / "warm_start.snap"
+
+
+def write_warm_snapshot() -> Dict[str, int]:
+    """Guarda el índice de borrados pendientes y los auto-cleans programados para el próximo arranque."""
+    # Archivos sin líneas muertas: tras el arranque en caliente _pending_garbage parte de cero
+    for chat_id in [cid for cid, garbage in _pending_garbage.items() if garbage]:
+        _compact_pending_deletes(chat_id)
+    path = warm_snapshot_path()
+    tmp = path.with_suffix(".tmp")
+    with tmp.open("wb") as f:
+        writer = SnapshotWriter(f)
+        _snapshot_auto_clean(writer, sorted(AUTO_CLEAN_DUE, key=lambda t: (t[0], t[1] or 0)))
+        for chat_id, pending in PENDING_DELETES.items():
+            _snapshot_pending(writer, chat_id, pending)
+        writer.close()
+    os.replace(tmp, path)
+    return {SNAP_KIND_NAMES[k]: n for k, n in sorted(writer.counts.items())}
+
+
+def warm_start(app: Application) -> Optional[Tuple[int, int]]:
+    """Reconstruye el barrido de auto-clean y los borrados pendientes desde warm_start.snap, que
+    se consume (un arranque tras una caída vuelve a los archivos). Devuelve (auto-cleans,
+    borrados) o None si no hay snapshot válido y hay que restaurar desde los archivos; también
+    si algún archivo de pendientes o de auto-clean es posterior al snapshot (editado en frío)."""
+    path = warm_snapshot_path()
+    if not SNAPSHOT_WARM_START or SHARD is not None or not path.exists():
+        return None
+    pending_chats: List[int] = []
+    try:
+        snap_mtime = path.stat().st_mtime
+        for p in [*DATA_DIR.glob("pending_deletes_*.jsonl"), *DATA_DIR.glob("auto_clean_*.txt")]:
+            if p.stat().st_mtime > snap_mtime:
+                raise SnapshotError(f"{p.name} es posterior al snapshot")
+            if p.name.startswith("pending_deletes_"):
+                pending_chats.append(int(p.stem.split("_")[-1]))
+        with path.open("rb") as f:
+            _, records = read_snapshot(f)
+    except (OSError, ValueError, SnapshotError) as e:
+        log_persist.warning("Snapshot de arranque descartado: %s", e)
+        return None
+    finally:
+        path.unlink(missing_ok=True)
+    # Los archivos coinciden con el snapshot: quedan cargados y se pueden compactar
+    _pending_loaded.update(pending_chats)
+    now = time.time()
+    cleans = deletes = 0
+    for kind, chat_id, payload in records:
+        if kind == SNAP_AUTO_CLEAN:
+            thread_id, hours, last_run = _SNAP_AUTO_CLEAN.unpack(payload)
+            target = (chat_id, thread_id or None)
+            if not chat_allowed(chat_id) or target in AUTO_CLEAN_DUE:
+                continue
+            _push_auto_clean(next_auto_clean_at(chat_id, hours, now, last_run, target[1]), target)
+            if target[1] is None:
+                SCHEDULED_AUTOCLEAN_CHATS.add(chat_id)
+            cleans += 1
+        elif kind == SNAP_PENDING:
+            for mid, thread_id, delete_at in _SNAP_PENDING.iter_unpack(payload):
+                _restore_delete(app, chat_id, mid, delete_at, thread_id or None)
+                deletes += 1
+    _arm_restored_deletes(app)
+    return cleans, deletes
+
+
+# === Arranque ===
+
+COMMANDS: List[BotCommand] = [
+    BotCommand("help", "Ver ayuda y lista de comandos"),
+    BotCommand("whoami", "Ver tu user_id"),
+    BotCommand("debug_admin", "Debug de permisos de admin"),
+    BotCommand("id", "Mostrar chat_id y (si aplica) topic_id"),
+    BotCommand("test_welcome", "Probar mensaje único combinado"),
+    BotCommand("get_welcome", "Ver texto de bienvenida actual"),
+    BotCommand("set_welcome", "Cambiar bienvenida (admins/owner)"),
+    BotCommand("reset_welcome", "Restaurar bienvenida por defecto (admins/owner)"),
+    BotCommand("get_registration", "Ver texto de registro actual"),
+    BotCommand("set_registration", "Cambiar mensaje de registro (admins/owner)"),
+    BotCommand("reset_registration", "Restaurar mensaje de registro por defecto (admins/owner)"),
+    BotCommand("cancelar", "Cancelar operación en curso"),
+    BotCommand("get_welcome_delete", "Ver el tiempo de auto-borrado actual"),
+    BotCommand("set_welcome_delete", "Cambiar auto-borrado de bienvenida (admins/owner)"),
+    BotCommand("reset_welcome_delete", "Volver al auto-borrado global (.env)"),
+    BotCommand("set_welcome_sticky", "Bienvenida única editada (on/off)"),
+    BotCommand("clean_chat", "Eliminar últimos N mensajes no fijados (admins)"),
+    BotCommand("clean_cancel", "Detener la limpieza en curso (admins)"),
+    BotCommand("set_auto_clean", "Programar limpieza automática por horas (admins)"),
+    BotCommand("stats", "Ver estado interno del bot (admins)"),
+]
+
+# Aplicación en ejecución (para gauges y tareas fuera de handlers)
+APPLICATION: Optional[Application] = None
+
+
+# Jobs del JobQueue contados por eventos de APScheduler (jobs() recorre y copia todos)
+_job_count: Optional[int] = None
+
+
+def track_job_count(app: Application) -> None:
+    global _job_count
+    if app.job_queue is None:
+        return
+    # APScheduler sólo se usa a través del JobQueue de PTB: sus eventos se importan al registrarse
+    from apscheduler.events import EVENT_ALL_JOBS_REMOVED, EVENT_JOB_ADDED, EVENT_JOB_REMOVED
+
+    # Con el planificador común del modo multi-bot, sólo los eventos del jobstore de este bot
+    alias = getattr(app.job_queue, "alias", None)
+
+    def on_job_event(event) -> None:
+        global _job_count
+        if alias is not None and getattr(event, "jobstore", getattr(event, "alias", None)) != alias:
+            return
+        if event.code == EVENT_JOB_ADDED:
+            _job_count = (_job_count or 0) + 1
+        elif event.code == EVENT_JOB_REMOVED:
+            _job_count = max(0, (_job_count or 0) - 1)
+        elif event.code == EVENT_ALL_JOBS_REMOVED:
+            _job_count = 0
+
+    _job_count = len(app.job_queue.jobs())
+    app.job_queue.scheduler.add_listener(on_job_event, EVENT_JOB_ADDED | EVENT_JOB_REMOVED | EVENT_ALL_JOBS_REMOVED)
+
+
+def _scheduled_jobs_count() -> int:
+    if APPLICATION is None or APPLICATION.job_queue is None:
+        return 0
+    if _job_count is not None:
+        return _job_count
+    return len(APPLICATION.job_queue.jobs())
+
+
+def _chat_data_total(key: str) -> int:
+    if APPLICATION is None:
+        return 0
+    return sum(len(d.get(key) or ()) for d in APPLICATION.chat_data.values())
+
+
+METRICS.gauge("qvc_pending_deletes", "Borrados programados pendientes", lambda: _pending_count)
+
+
+def _cached_messages_total() -> int:
+    if APPLICATION is None:
+        return 0
+    return sum(cached_message_count(d) for d in APPLICATION.chat_data.values())
+
+
+METRICS.gauge("qvc_message_cache_entries", "Mensajes en la caché de limpieza (chats cargados)", _cached_messages_total)
+METRICS.gauge("qvc_scheduled_jobs", "Jobs en el JobQueue", _scheduled_jobs_count)
+METRICS.gauge("qvc_waiting_for_message", "Flujos /set_* esperando mensaje", lambda: _chat_data_total("waiting"))
+METRICS.gauge("qvc_auto_clean_scheduled", "Chats y topics con auto-clean en el barrido", lambda: len(AUTO_CLEAN_DUE))
+METRICS.gauge("qvc_auto_clean_running", "Auto-cleans en curso", lambda: len(AUTO_CLEAN_RUNNING))
+METRICS.gauge("qvc_clean_jobs_running", "Limpiezas /clean_chat en curso", lambda: len(CLEAN_JOBS))
+METRICS.gauge("qvc_admin_cache_entries", "Entradas en la caché de is_admin", lambda: len(_admin_cache))
+
+
+# === Salud del proceso: lag del event loop, /healthz y /readyz ===
+# Una sonda duerme LOOP_LAG_INTERVAL y mide cuánto tarda de más en despertar: es el tiempo
+# que otra corrutina (o I/O síncrono en un handler) retuvo el loop. Además, cada callback del
+# loop que dura más de SLOW_CALLBACK_MS se registra con la corrutina responsable y la línea
+# donde quedó suspendida. /healthz responde 200 mientras la sonda siga viva; /readyz exige
+# además lag, polling y cola de jobs dentro de límites. Bajo systemd (Type=notify +
+# WatchdogSec) la sonda envía WATCHDOG=1 sólo mientras el proceso está listo.
+LOOP_LAG_INTERVAL = 0.1
+LOOP_LAG_WINDOW = 600  # muestras (~60 s)
+SLOW_CALLBACK_MS: float = _env_float("SLOW_CALLBACK_MS", 100.0, 0.0)
+READY_MAX_LAG_MS: float = _env_float("READY_MAX_LAG_MS", 500.0, 1.0)
+READY_MAX_POLL_AGE: float = _env_float("READY_MAX_POLL_AGE", 90.0, 1.0)
+READY_MAX_JOB_DELAY: float = _env_float("READY_MAX_JOB_DELAY", 60.0, 1.0)
+
+M_LOOP_LAG = METRICS.histogram(
+    "qvc_loop_lag_seconds",
+    "Retraso de planificación del event loop",
+    (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+M_SLOW_CALLBACKS = METRICS.counter("qvc_slow_callbacks_total", "Callbacks del event loop más lentos que SLOW_CALLBACK_MS")
+
+
+def sd_notify(state: str) -> None:
+    """Mensaje al gestor de servicios de systemd (no-op fuera de systemd)."""
+    addr = os.environ.get("NOTIFY_SOCKET", "")
+    if not addr:
+        return
+    if addr.startswith("@"):
+        addr = "\0" + addr[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(addr)
+            sock.sendall(state.encode("utf-8"))
+    except OSError as e:
+        log_health.debug("sd_notify falló: %s", e)
+
+
+def _describe_callback(callback) -> Tuple[str, str]:
+    """(corrutina, dónde quedó suspendida) para pasos de Task; (callback, "") para el resto."""
+    task = getattr(callback, "__self__", None)
+    if not isinstance(task, asyncio.Task):
+        return getattr(callback, "__qualname__", None) or repr(callback), ""
+    coro = task.get_coro()
+    name = getattr(coro, "__qualname__", None) or repr(coro)
+    inner = coro
+    while getattr(getattr(inner, "cr_await", None), "cr_frame", None) is not None:
+        inner = inner.cr_await
+    frame = getattr(inner, "cr_frame", None)
+    where = f"{Path(frame.f_code.co_filename).name}:{frame.f_lineno}" if frame is not None else ""
+    return name, where
+
+
+_slow_callback_detector = False
+
+
+def _install_slow_callback_detector() -> None:
+    """Cronometra cada callback del loop de asyncio (Handle._run); coste ~0,1 µs por callback."""
+    global _slow_callback_detector
+    if _slow_callback_detector or SLOW_CALLBACK_MS <= 0:
+        return
+    if not isinstance(asyncio.get_running_loop(), asyncio.BaseEventLoop):
+        # uvloop ejecuta sus callbacks en C, sin pasar por Handle._run: sólo queda la sonda de lag
+        log_health.info("Detector de callbacks lentos no disponible con este event loop")
+        _slow_callback_detector = True
+        return
+    original = asyncio.events.Handle._run
+    threshold = SLOW_CALLBACK_MS / 1000.0
+
+    def _run(handle) -> None:
+        start = time.perf_counter()
+        original(handle)
+        elapsed = time.perf_counter() - start
+        if elapsed >= threshold:
+            M_SLOW_CALLBACKS.inc()
+            name, where = _describe_callback(handle._callback)
+            log_health.warning(
+                "Callback lento: %s bloqueó el loop %.0f ms", name, elapsed * 1000, extra=_kv(where=where or None)
+            )
+
+    asyncio.events.Handle._run = _run
+    _slow_callback_detector = True
+
+
+def _job_backlog() -> dict:
+    """Jobs del JobQueue cuya hora ya pasó y que el planificador aún no ha lanzado."""
+    if APPLICATION is None or APPLICATION.job_queue is None:
+        return {"jobs": 0, "overdue": 0, "max_delay_s": 0.0}
+    now = datetime.now(timezone.utc)
+    # En modo multi-bot, sólo el jobstore de este bot dentro del planificador común
+    jobs = APPLICATION.job_queue.scheduler.get_jobs(jobstore=getattr(APPLICATION.job_queue, "alias", None))
+    overdue, worst = 0, 0.0
+    for job in jobs:  # ordenados por next_run_time
+        if job.next_run_time is None:
+            continue
+        delay = (now - job.next_run_time).total_seconds()
+        if delay <= 1.0:
+            break
+        overdue += 1
+        worst = max(worst, delay)
+    return {"jobs": len(jobs), "overdue": overdue, "max_delay_s": round(worst, 3)}
+
+
+class LoopHealth:
+    def __init__(self):
+        self.lags: Deque[float] = deque(maxlen=LOOP_LAG_WINDOW)
+        self.started_at = time.monotonic()
+        self.last_tick: Optional[float] = None
+        self.last_poll_at: Optional[float] = None  # último getUpdates con respuesta 200
+        self.last_update_at: Optional[float] = None
+        self.polling = False
+        self._watchdog_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        _install_slow_callback_detector()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._probe())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _probe(self) -> None:
+        loop = asyncio.get_running_loop()
+        watchdog_usec = os.environ.get("WATCHDOG_USEC", "")
+        watchdog = int(watchdog_usec) / 2e6 if watchdog_usec.isdigit() and SHARD is None else 0.0
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag = max(0.0, loop.time() - start - LOOP_LAG_INTERVAL)
+            self.lags.append(lag)
+            M_LOOP_LAG.observe(lag)
+            self.last_tick = time.monotonic()
+            if watchdog and self.last_tick - self._watchdog_at >= watchdog:
+                ready, report = self.check(watchdog=True)
+                if ready:
+                    sd_notify("WATCHDOG=1")
+                    self._watchdog_at = self.last_tick
+                else:
+                    log_health.warning("Sin ping al watchdog: %s", "; ".join(report["problems"]))
+
+    def _age(self, ts: Optional[float], now: float) -> Optional[float]:
+        return None if ts is None else round(now - ts, 3)
+
+    def lag_ms(self) -> dict:
+        """Percentiles del lag reciente en ms; sólo la ventana de muestras, sin tocar el scheduler."""
+        lags = sorted(self.lags)
+        return {
+            "p50": round(lags[len(lags) // 2] * 1000, 1) if lags else None,
+            "p99": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 1) if lags else None,
+            "max": round(lags[-1] * 1000, 1) if lags else None,
+            "samples": len(lags),
+        }
+
+    def check(self, watchdog: bool = False) -> Tuple[bool, dict]:
+        """(listo, informe). El informe incluye la lista de problemas que impiden estar listo.
+        Para el watchdog no cuentan el circuit breaker ni la antigüedad del último getUpdates:
+        reiniciar no arregla una caída de Telegram o de la red, sólo la alargaría en bucle."""
+        now = time.monotonic()
+        lag_ms = self.lag_ms()
+        report = {
+            "uptime_s": round(now - self.started_at, 1),
+            "loop_lag_ms": lag_ms,
+            "probe_age_s": self._age(self.last_tick, now),
+        }
+        problems: List[str] = []
+        if not self.alive(now):
+            problems.append("la sonda de lag no se ejecuta")
+        if lag_ms["p99"] is not None and lag_ms["p99"] > READY_MAX_LAG_MS:
+            problems.append(f"lag p99 {lag_ms['p99']:.0f} ms > {READY_MAX_LAG_MS:.0f} ms")
+        if HOSTED_BOTS:
+            # Modo multi-bot: el loop es común; polling, jobs y circuito se comprueban por bot
+            report["bots"] = {}
+            for name, bot in HOSTED_BOTS.items():
+                report["bots"][name], bot_problems = bot.module.HEALTH.bot_status(now, watchdog)
+                problems.extend(f"{name}: {p}" for p in bot_problems)
+        else:
+            bot_report, bot_problems = self.bot_status(now, watchdog)
+            report.update(bot_report)
+            problems.extend(bot_problems)
+        report["problems"] = problems
+        return not problems, report
+
+    def bot_status(self, now: float, watchdog: bool = False) -> Tuple[dict, List[str]]:
+        """Parte del informe propia de una Application (polling, jobs, borrados, circuito)."""
+        backlog = _job_backlog()
+        report = {
+            "last_update_age_s": self._age(self.last_update_at, now),
+            "last_poll_age_s": self._age(self.last_poll_at, now),
+            "scheduler": backlog,
+            "deletes_in_flight": DELETE_EXECUTOR.in_flight,
+            "circuit_state": API_CIRCUIT.state,
+            "startup_s": STARTUP.phases,
+        }
+        problems: List[str] = []
+        if self.polling and not watchdog:
+            poll_age = now - (self.last_poll_at or self.started_at)
+            if poll_age > READY_MAX_POLL_AGE:
+                problems.append(f"sin getUpdates correcto desde hace {poll_age:.0f} s")
+        if backlog["max_delay_s"] > READY_MAX_JOB_DELAY:
+            problems.append(f"{backlog['overdue']} jobs atrasados (máx. {backlog['max_delay_s']:.0f} s)")
+        if not watchdog and API_CIRCUIT.state == CircuitBreaker.OPEN:
+            problems.append("circuit breaker de la Bot API abierto")
+        return report, problems
+
+    def alive(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return self.last_tick is not None and now - self.last_tick < max(5.0, LOOP_LAG_INTERVAL * 20)
+
+
+HEALTH = LoopHealth()
+
+
+def _healthz() -> Tuple[int, str, str]:
+    _, report = HEALTH.check()
+    status = "ok" if HEALTH.alive() else "stalled"
+    body = json.dumps({"status": status, **report}, ensure_ascii=False) + "\n"
+    return (200 if status == "ok" else 503), "application/json", body
+
+
+def _readyz() -> Tuple[int, str, str]:
+    ready, report = HEALTH.check()
+    body = json.dumps({"status": "ready" if ready else "not_ready", **report}, ensure_ascii=False) + "\n"
+    return (200 if ready else 503), "application/json", body
+
+
+HTTP_ROUTES["/healthz"] = _healthz
+HTTP_ROUTES["/readyz"] = _readyz
+
+
+# === Tiempo de arranque: fases, primer update y perfil ===
+# STARTUP anota los segundos desde el inicio del proceso hasta cada fase: imports,
+# initialize (getMe), post_init, polling en marcha, comandos publicados, restauración
+# terminada y primer update procesado. Lo que no hace falta para atender el primer update
+# (setMyCommands, restaurar auto-cleans y borrados pendientes, reanudar /broadcast) corre en
+# segundo plano en deferred_startup() una vez que la Application está en marcha.
+# `main.py --profile-startup` perfila además con cProfile desde main() hasta el primer
+# update y escribe startup_profile_*.txt y .prof en BOT_DATA_DIR.
+def _process_start_time() -> float:
+    """Inicio del proceso (epoch) según /proc; fuera de Linux, el final de los imports."""
+    try:
+        fields = Path("/proc/self/stat").read_text().rsplit(")", 1)[1].split()
+        uptime = float(Path("/proc/uptime").read_text().split()[0])
+        return time.time() - uptime + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except Exception:
+        return _IMPORTED_AT
+
+
+class StartupTimeline:
+    def __init__(self):
+        self.started_at = _process_start_time()
+        self.phases: Dict[str, float] = {"imports": round(_IMPORTED_AT - self.started_at, 3)}
+        self._profiler = None
+
+    def mark(self, phase: str) -> None:
+        if phase not in self.phases:
+            self.phases[phase] = round(time.time() - self.started_at, 3)
+
+    def describe(self) -> str:
+        return ", ".join(f"{name} {t:.2f} s" for name, t in self.phases.items())
+
+    def start_profile(self) -> None:
+        import cProfile
+
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def first_update(self, app: Optional[Application] = None) -> None:
+        """Se llama con cada update hasta el primero: anota la fase y cierra el perfil."""
+        if "first_update" in self.phases:
+            return
+        self.mark("first_update")
+        log.info("Primer update a los %.2f s del inicio del proceso (%s)", self.phases["first_update"], self.describe())
+        if self._profiler is not None:
+            profiler, self._profiler = self._profiler, None
+            profiler.disable()
+            if app is not None and app.running:
+                app.create_task(asyncio.to_thread(self._write_profile, profiler), name="startup_profile")
+            else:
+                self._write_profile(profiler)
+
+    def finish(self) -> None:
+        """Al apagar: cierra el perfil si no llegó ningún update."""
+        if self._profiler is not None:
+            profiler, self._profiler = self._profiler, None
+            profiler.disable()
+            self._write_profile(profiler)
+
+    def _write_profile(self, profiler) -> None:
+        import pstats
+
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        out = io.StringIO()
+        out.write("Perfil de arranque (cProfile desde main() hasta el primer update)\n")
+        out.write(f"Fases, en segundos desde el inicio del proceso: {self.describe()}\n")
+        out.write("Los imports quedan fuera del perfil: `python -X importtime main.py` los desglosa.\n\n")
+        stats = pstats.Stats(profiler, stream=out)
+        stats.sort_stats("cumulative").print_stats(60)
+        stats.sort_stats("tottime").print_stats(30)
+        try:
+            (DATA_DIR / f"startup_profile_{stamp}.txt").write_text(out.getvalue(), encoding="utf-8")
+            stats.dump_stats(str(DATA_DIR / f"startup_profile_{stamp}.prof"))
+            log.info("Perfil de arranque en %s", DATA_DIR / f"startup_profile_{stamp}.txt")
+        except OSError as e:
+            log.warning("No se pudo guardar el perfil de arranque: %s", e)
+
+
+STARTUP = StartupTimeline()
+METRICS.gauge(
+    "qvc_startup_phase_seconds",
+    "Segundos desde el inicio del proceso hasta cada fase del arranque",
+    lambda: {(phase,): t for phase, t in STARTUP.phases.items()},
+    ("phase",),
+)
+METRICS.gauge(
+    "qvc_time_to_first_update_seconds",
+    "Segundos desde el inicio del proceso hasta el primer update procesado",
+    lambda: {(): STARTUP.phases["first_update"]} if "first_update" in STARTUP.phases else {},
+)
+
+
+async def _touch_last_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    HEALTH.last_update_at = time.monotonic()
+    if "first_update" not in STARTUP.phases:
+        STARTUP.first_update(context.application)
+
+
+COMMANDS_HASH_FILE = "bot_commands.sha256"
+
+
+def commands_hash(bot_id: int, commands: List[BotCommand]) -> str:
+    return hashlib.sha256(json_dumps([bot_id, [[c.command, c.description] for c in commands]]).encode("utf-8")).hexdigest()
+
+
+async def publish_commands(bot) -> bool:
+    """setMyCommands sólo si la lista cambió desde la última publicación correcta (hash en
+    BOT_DATA_DIR; bórralo para forzarla). Devuelve True si se publicó."""
+    path = DATA_DIR / COMMANDS_HASH_FILE
+    digest = commands_hash(bot.id, COMMANDS)
+    try:
+        if path.read_text(encoding="utf-8").strip() == digest:
+            log.debug("Lista de comandos sin cambios: no se publica")
+            return False
+    except OSError:
+        pass
+    try:
+        await bot.set_my_commands(COMMANDS)
+    except Exception as e:
+        log.warning("No se pudo publicar setMyCommands: %s", e)
+        return False
+    try:
+        path.write_text(digest + "\n", encoding="utf-8")
+    except OSError as e:
+        log.warning("No se pudo guardar el hash de comandos: %s", e)
+    return True
+
+
+# Trabajo de arranque en segundo plano (ver deferred_startup)
+DEFERRED_STARTUP: Optional[asyncio.Task] = None
+
+
+async def deferred_startup(app: Application) -> None:
+    """Lo que no hace falta para atender el primer update, con la Application ya en marcha
+    (polling iniciado o worker escuchando su socket)."""
+    while not app.running:
+        await asyncio.sleep(0.01)
+    STARTUP.mark("polling")
+    # La restauración va antes del primer await: mientras tanto el polling ya atiende updates y
+    # un borrado completado no debe compactar el archivo de un chat sin cargar
+    # Arranque en caliente desde el snapshot del apagado anterior; si no lo hay, desde los archivos por chat
+    try:
+        warm = warm_start(app)
+    except Exception as e:
+        log_persist.exception("Error en el arranque en caliente: %s", e)
+        warm = None
+    if warm is not None:
+        log_persist.info("Arranque en caliente: %d auto-cleans y %d borrados pendientes desde el snapshot", *warm)
+    else:
+        try:
+            restored = restore_auto_clean_schedule(app)
+            if restored:
+                log_clean.info("Auto-clean restaurado para %d chats", restored)
+        except Exception as e:
+            log_clean.exception("Error restaurando auto-clean: %s", e)
+        # Reprogramar borrados pendientes por chat (si existen archivos)
+        try:
+            restore_pending_deletes(app)
+        except Exception as e:
+            log_persist.exception("Error reprogramando pendientes: %s", e)
+    # Difusión o ajuste en bloque interrumpido por el reinicio
+    try:
+        resume_bulk_job(app)
+    except Exception as e:
+        log.exception("Error reanudando el trabajo en bloque: %s", e)
+    STARTUP.mark("restore")
+    # Publica la lista para que Telegram muestre los comandos al escribir '/' (en modo shard, sólo el worker 0)
+    if SHARD is None or SHARD[0] == 0:
+        await publish_commands(app.bot)
+        STARTUP.mark("commands")
+    log.info("Arranque: %s", STARTUP.describe())
+
+
+async def post_init(app: Application):
+    global APPLICATION, DEFERRED_STARTUP
+    APPLICATION = app
+    STARTUP.mark("initialize")
+    track_job_count(app)
+    # En modo multi-bot la señal, el endpoint HTTP y la sonda del loop son del proceso anfitrión
+    if HOSTED_BOT is None:
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_config, app)
+        except (NotImplementedError, RuntimeError):
+            pass
+        await start_http_server()
+        HEALTH.start()
+    # Barrido único de auto-clean con la fase de cada chat
+    if app.job_queue is not None:
+        app.job_queue.run_repeating(auto_clean_sweep, interval=AUTO_CLEAN_TICK, first=AUTO_CLEAN_TICK, name="auto_clean_sweeper")
+    # setMyCommands y restauraciones, sin retrasar el inicio del polling
+    DEFERRED_STARTUP = asyncio.get_running_loop().create_task(deferred_startup(app), name="deferred_startup")
+    STARTUP.mark("post_init")
+    # Con Type=notify, systemd considera el servicio arrancado a partir de aquí (los workers no notifican)
+    if SHARD is None and HOSTED_BOT is None:
+        sd_notify("READY=1")
+
+
+async def post_shutdown(app: Application):
+    if DEFERRED_STARTUP is not None and not DEFERRED_STARTUP.done():
+        DEFERRED_STARTUP.cancel()
+        try:
+            await DEFERRED_STARTUP
+        except asyncio.CancelledError:
+            pass
+    STARTUP.finish()
+    # Sólo con la restauración completa: un índice a medias perdería borrados en el próximo arranque
+    if SNAPSHOT_WARM_START and SHARD is None and "restore" in STARTUP.phases:
+        try:
+            counts = write_warm_snapshot()
+            log_persist.info("Snapshot de arranque guardado", extra=_kv(**counts))
+        except Exception as e:
+            log_persist.warning("No se pudo guardar el snapshot de arranque: %s", e)
+    await HEALTH.stop()
+    await stop_http_server()
+    if UPDATE_RECORDER is not None:
+        UPDATE_RECORDER.stop()
+
+
+def build_application(
+    token: str,
+    base_url: str = "",
+    polling: bool = True,
+    limiter: Optional[ApiRateLimiter] = None,
+    shared: Optional["HostedResources"] = None,
+) -> Application:
+    """Construye la Application con la capa HTTP instrumentada y los hooks de arranque.
+    Con polling=False no se crea Updater (los updates llegan por update_queue). Con `shared`
+    (modo multi-bot) usa los pools HTTP, la base SQLite y el planificador del anfitrión."""
+    request = make_request("api", pool=shared.api if shared else None)
+    request.limiter = limiter
+    builder = (
+        Application.builder()
+        .token(token)
+        .persistence(
+            ChatStatePersistence(state_db_path(), PERSISTENCE_FLUSH_SECONDS, db=shared.db if shared else None)
+        )
+        .request(request)
+        .get_updates_request(make_request("polling", pool_size=1, pool=shared.polling if shared else None))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if shared is not None:
+        builder = builder.job_queue(HostedJobQueue(shared.scheduler, HOSTED_BOT))
+    if not polling:
+        builder = builder.updater(None)
+    if base_url:
+        log.warning("Usando Bot API alternativa: %s", base_url)
+        builder = builder.base_url(base_url)
+    return builder.build()
+
+
+def register_handlers(app: Application) -> None:
+    # Frescura del último update para /readyz
+    app.add_handler(TypeHandler(Update, _touch_last_update), group=-3)
+
+    # Grabación opcional de updates (antes que cualquier otro handler)
+    if UPDATE_RECORDER is not None:
+        UPDATE_RECORDER.start()
+        app.add_handler(TypeHandler(Update, record_update), group=-2)
+
+    # Comandos
+    app.add_handler(CommandHandler("help", cmd_help))
     app.add_handler(CommandHandler("whoami", cmd_whoami))
     app.add_handler(CommandHandler("debug_admin", cmd_debug_admin))
     app.add_handler(CommandHandler("id", cmd_id))
@@ -1327,8 +4985,17 @@ def main():
     app.add_handler(CommandHandler("get_welcome_delete", get_welcome_delete))
     app.add_handler(CommandHandler("set_welcome_delete", set_welcome_delete))
     app.add_handler(CommandHandler("reset_welcome_delete", reset_welcome_delete))
+    app.add_handler(CommandHandler("set_welcome_sticky", set_welcome_sticky))
     app.add_handler(CommandHandler("clean_chat", clean_chat))
+    app.add_handler(CommandHandler("clean_cancel", clean_cancel))
     app.add_handler(CommandHandler("set_auto_clean", set_auto_clean))
+    app.add_handler(CommandHandler("stats", cmd_stats))
+    app.add_handler(CommandHandler("prof_cpu", prof_cpu))
+    app.add_handler(CommandHandler("prof_mem", prof_mem))
+    app.add_handler(CommandHandler("broadcast", broadcast))
+    app.add_handler(CommandHandler("bulk_set", bulk_set))
+    app.add_handler(CommandHandler("bulk_status", bulk_status))
+    app.add_handler(CommandHandler("bulk_cancel", bulk_cancel))
 
     # Evento: nuevos miembros (prioritario) – registrar antes del catch-all
     app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, bienvenida), group=0)
@@ -1339,8 +5006,676 @@ def main():
     # Cache de mensajes para limpieza (último)
     app.add_handler(MessageHandler(filters.ALL, cache_message), group=2)
 
-    # Long Polling (no requiere puertos abiertos)
-    app.run_polling(close_loop=False)
+    app.add_error_handler(on_handler_error)
+
+
+# === Modo shard: varios procesos de trabajo por chat_id ===
+# Un proceso de entrada (polling o webhook) reparte cada update por hash de chat_id
+# entre N workers vía sockets Unix locales. Cada worker es una Application completa
+# (sin updater) dueña de las cachés, timers y borrados pendientes de sus chats.
+SHARD_WORKERS: int = _env_int("SHARD_WORKERS", 0, 0)
+SHARD_RUN_DIR = Path(os.environ.get("SHARD_RUN_DIR", "").strip() or DATA_DIR / "run")
+# Webhook de entrada opcional (detrás de un proxy TLS); si está vacío se usa long polling
+SHARD_WEBHOOK_URL = os.environ.get("SHARD_WEBHOOK_URL", "").strip()
+SHARD_WEBHOOK_LISTEN = os.environ.get("SHARD_WEBHOOK_LISTEN", "").strip() or "127.0.0.1:8443"
+SHARD_WEBHOOK_SECRET = os.environ.get("SHARD_WEBHOOK_SECRET", "").strip()
+
+# (índice, total) si este proceso es un worker
+SHARD: Optional[Tuple[int, int]] = None
+
+
+def shard_for_chat(chat_id: int, total: int) -> int:
+    return zlib.crc32(str(chat_id).encode("ascii")) % total
+
+
+def owns_chat(chat_id: int) -> bool:
+    """True si este proceso es responsable del chat (siempre en modo de un solo proceso)."""
+    return SHARD is None or shard_for_chat(chat_id, SHARD[1]) == SHARD[0]
+
+
+def shard_socket_path(index: int) -> Path:
+    return SHARD_RUN_DIR / f"shard-{index}.sock"
+
+
+def shard_rate_limiter(shared: bool) -> Optional[ApiRateLimiter]:
+    # En modo shard el límite global es obligatorio: 30 msg/s si no se configuró otro
+    rate = API_RATE_LIMIT or (30.0 if shared else 0.0)
+    if not rate and not API_CHAT_RATE_PER_MIN:
+        return None
+    return ApiRateLimiter(rate, API_CHAT_RATE_PER_MIN, SHARD_RUN_DIR / "ratelimit.bin" if shared else None)
+
+
+def _update_route_key(data: dict) -> int:
+    for top in data.values():
+        if not isinstance(top, dict):
+            continue
+        chat = top.get("chat") or (top.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return int(chat["id"])
+        user = top.get("from")
+        if isinstance(user, dict) and "id" in user:
+            return int(user["id"])
+    return 0
+
+
+async def _serve_shard_socket(app: Application, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                update = Update.de_json(json_loads(line), app.bot)
+            except Exception as e:
+                log.warning("Update inválido recibido por IPC: %s", e)
+                continue
+            await app.update_queue.put(update)
+    except asyncio.CancelledError:
+        # La conexión de la entrada sigue abierta al apagar el worker
+        pass
+    finally:
+        writer.close()
+
+
+async def _run_shard_worker(index: int, total: int) -> None:
+    app = build_application(BOT_TOKEN, BOT_API_BASE_URL, polling=False, limiter=shard_rate_limiter(shared=True))
+    register_handlers(app)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    path = shard_socket_path(index)
+    SHARD_RUN_DIR.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        path.unlink()
+    await app.initialize()
+    await post_init(app)
+    await app.start()
+    server = await asyncio.start_unix_server(lambda r, w: _serve_shard_socket(app, r, w), str(path), limit=2**22)
+    log.info("Worker %d/%d listo en %s", index, total, path)
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        if path.exists():
+            path.unlink()
+        await app.stop()
+        await post_shutdown(app)
+        await app.shutdown()
+
+
+def run_shard_worker(index: int, total: int) -> None:
+    global SHARD, RAW_METRICS_PORT
+    SHARD = (index, total)
+    if RAW_METRICS_PORT.isdigit() and int(RAW_METRICS_PORT) > 0:
+        RAW_METRICS_PORT = str(int(RAW_METRICS_PORT) + 1 + index)
+    asyncio.run(_run_shard_worker(index, total))
+
+
+class ShardLink:
+    """Cola y conexión (con reconexión) hacia el socket de un worker."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.queue: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize=50000)
+        self.task: Optional[asyncio.Task] = None
+
+    async def run(self) -> None:
+        writer: Optional[asyncio.StreamWriter] = None
+        while True:
+            line = await self.queue.get()
+            while True:
+                try:
+                    if writer is None:
+                        _, writer = await asyncio.open_unix_connection(str(shard_socket_path(self.index)))
+                    writer.write(line)
+                    await writer.drain()
+                    break
+                except OSError:
+                    writer = None
+                    await asyncio.sleep(0.5)
+
+    def send(self, data: dict) -> None:
+        try:
+            self.queue.put_nowait(json_dumps(data).encode("utf-8") + b"\n")
+        except asyncio.QueueFull:
+            log.error("Cola del worker %d llena; update descartado", self.index)
+
+
+async def _ingress_webhook(bot, links: List[ShardLink], stop: asyncio.Event) -> None:
+    host, _, port = SHARD_WEBHOOK_LISTEN.rpartition(":")
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        status = 200
+        try:
+            request_line = await reader.readline()
+            headers: Dict[str, str] = {}
+            while True:
+                line = await reader.readline()
+                if not line or line in (b"\r\n", b"\n"):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", "0") or 0))
+            if not request_line.startswith(b"POST"):
+                status = 405
+            elif SHARD_WEBHOOK_SECRET and headers.get("x-telegram-bot-api-secret-token") != SHARD_WEBHOOK_SECRET:
+                status = 403
+            else:
+                data = json_loads(body)
+                links[shard_for_chat(_update_route_key(data), len(links))].send(data)
+                STARTUP.first_update()
+            HEALTH.last_update_at = time.monotonic()
+        except Exception as e:
+            log.warning("Webhook: petición inválida: %s", e)
+            status = 400
+        writer.write(f"HTTP/1.1 {status} X\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode("latin-1"))
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host or "127.0.0.1", int(port))
+    await bot.set_webhook(
+        SHARD_WEBHOOK_URL, allowed_updates=Update.ALL_TYPES, secret_token=SHARD_WEBHOOK_SECRET or None
+    )
+    log.info("Entrada por webhook %s (escuchando en %s)", SHARD_WEBHOOK_URL, SHARD_WEBHOOK_LISTEN)
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+async def _ingress_polling(bot, links: List[ShardLink], stop: asyncio.Event) -> None:
+    await bot.delete_webhook()
+    offset: Optional[int] = None
+    while not stop.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+        except Exception as e:
+            if not isinstance(e, TimedOut):
+                log.warning("getUpdates falló: %s", e)
+                await asyncio.sleep(2)
+            continue
+        for update in updates:
+            data = update.to_dict()
+            links[shard_for_chat(_update_route_key(data), len(links))].send(data)
+            HEALTH.last_update_at = time.monotonic()
+            STARTUP.first_update()
+            offset = update.update_id + 1
+
+
+async def _run_shard_ingress(total: int, workers: Optional[List[subprocess.Popen]] = None) -> None:
+    bot = ExtBot(
+        BOT_TOKEN,
+        base_url=BOT_API_BASE_URL or "https://api.telegram.org/bot",
+        request=make_request("api", pool_size=8),
+        get_updates_request=make_request("polling", pool_size=1),
+    )
+    links = [ShardLink(i) for i in range(total)]
+    for link in links:
+        link.task = asyncio.create_task(link.run())
+    METRICS.gauge(
+        "qvc_shard_queue_depth",
+        "Updates pendientes de entregar por worker",
+        lambda: {(str(link.index),): link.queue.qsize() for link in links},
+        ("shard",),
+    )
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    def forward_sighup() -> None:
+        # La configuración recargable vive en los workers
+        if not workers:
+            log.warning("SIGHUP en la entrada sin workers propios: envíalo a cada worker (main.py --worker I)")
+        for proc in workers or ():
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGHUP)
+
+    loop.add_signal_handler(signal.SIGHUP, forward_sighup)
+
+    async def supervise() -> None:
+        # Reinicia workers que hayan terminado (sólo si los lanzó este proceso)
+        while workers and not stop.is_set():
+            await asyncio.sleep(5)
+            for i, proc in enumerate(workers):
+                if proc.poll() is not None:
+                    log.error("Worker %d terminó (código %s); reiniciando", i, proc.returncode)
+                    workers[i] = _spawn_shard_worker(i, total)
+
+    await bot.initialize()
+    await start_http_server()
+    HEALTH.polling = not SHARD_WEBHOOK_URL
+    HEALTH.start()
+    supervisor = asyncio.create_task(supervise())
+    ingress = _ingress_webhook if SHARD_WEBHOOK_URL else _ingress_polling
+    task = asyncio.create_task(ingress(bot, links, stop))
+    log.info("Entrada de %d shards iniciada", total)
+    STARTUP.mark("polling")
+    sd_notify("READY=1")
+    try:
+        await stop.wait()
+    finally:
+        for t in (task, supervisor, *(link.task for link in links)):
+            t.cancel()
+        await HEALTH.stop()
+        await stop_http_server()
+        await bot.shutdown()
+
+
+def _spawn_shard_worker(index: int, total: int) -> subprocess.Popen:
+    # Sin las variables leídas de .env: el worker lee .env él mismo y así puede recargarlo con SIGHUP
+    env = {k: v for k, v in os.environ.items() if k in _ENV_FROM_PROCESS}
+    return subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), "--worker", str(index), "--shards", str(total)], env=env
+    )
+
+
+def run_shard_supervisor(total: int) -> None:
+    """Lanza N workers como subprocesos y ejecuta la entrada en este proceso."""
+    workers = [_spawn_shard_worker(i, total) for i in range(total)]
+    try:
+        asyncio.run(_run_shard_ingress(total, workers))
+    finally:
+        for proc in workers:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in workers:
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+# === Modo multi-bot: varios tokens en un proceso ===
+# Con BOTS_FILE (o --bots) el proceso aloja una Application por entrada del archivo, todas en
+# el mismo event loop. Cada bot se ejecuta sobre su propia copia de este módulo (como un worker
+# de shard, pero sin proceso aparte), así que sus ajustes, cachés, timers y archivos por chat
+# quedan aislados: DATA_DIR propio (por defecto BOT_DATA_DIR/bots/<nombre>) y tabla propia en
+# la base SQLite común. Se comparten los pools HTTP, el planificador de APScheduler, la base
+# SQLite, el endpoint /metrics (etiqueta bot="<nombre>") y la sonda del event loop.
+#
+# Formato (JSON): [{"name": "comunidad_a", "BOT_TOKEN": "...", "ALLOWED_CHAT_IDS": "-100…",
+#                   "SUPER_ADMIN_IDS": "...", "WELCOME_TOPIC_ID": "", "WELCOME_DELETE_SECONDS": "",
+#                   "BOT_DATA_DIR": "..."}, ...]
+# Las claves que una entrada no fija se toman de .env. Los valores pueden ser texto, número o lista.
+BOTS_FILE = os.environ.get("BOTS_FILE", "").strip()
+BOT_CONFIG_KEYS = ("BOT_TOKEN", "BOT_DATA_DIR") + HOT_RELOAD_KEYS
+_BOT_NAME_RE = re.compile(r"[A-Za-z0-9_]{1,32}")
+# Métricas del proceso (no de un bot) en /metrics del anfitrión
+PROCESS_METRICS = ("qvc_loop_lag_seconds", "qvc_slow_callbacks_total")
+
+# Nombre del bot si este módulo es una copia alojada por el anfitrión multi-bot
+HOSTED_BOT: Optional[str] = None
+# En el anfitrión: bots en marcha por nombre
+HOSTED_BOTS: Dict[str, "HostedBot"] = {}
+
+
+def _bot_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return ",".join(str(v) for v in value)
+    return str(value).strip()
+
+
+def load_bots_file(path: str) -> List[Tuple[str, Dict[str, str]]]:
+    """Lee y valida el archivo de bots: [(nombre, valores)], con BOT_DATA_DIR ya resuelto.
+    Lanza ValueError si el archivo no es válido."""
+    try:
+        data = json_loads(Path(path).read_bytes())
+    except OSError as e:
+        raise ValueError(f"no se pudo leer {path}: {e}") from None
+    if not isinstance(data, list) or not data:
+        raise ValueError("se esperaba una lista JSON con al menos un bot")
+    entries: List[Tuple[str, Dict[str, str]]] = []
+    seen: Dict[str, Set[str]] = {"name": set(), "BOT_TOKEN": set(), "BOT_DATA_DIR": set()}
+    for i, item in enumerate(data):
+        if not isinstance(item, dict):
+            raise ValueError(f"entrada {i}: se esperaba un objeto")
+        name = _bot_value(item.get("name"))
+        if not _BOT_NAME_RE.fullmatch(name):
+            raise ValueError(f"entrada {i}: 'name' debe tener 1-32 letras, dígitos o _")
+        unknown = sorted(set(item) - {"name", *BOT_CONFIG_KEYS})
+        if unknown:
+            raise ValueError(f"bot {name}: claves desconocidas {unknown}")
+        values = {k: _bot_value(v) for k, v in item.items() if k != "name"}
+        if not values.get("BOT_TOKEN"):
+            raise ValueError(f"bot {name}: falta BOT_TOKEN")
+        values["BOT_DATA_DIR"] = str(Path(values.get("BOT_DATA_DIR") or DATA_DIR / "bots" / name).resolve())
+        for key, value in (("name", name), ("BOT_TOKEN", values["BOT_TOKEN"]), ("BOT_DATA_DIR", values["BOT_DATA_DIR"])):
+            if value in seen[key]:
+                raise ValueError(f"bot {name}: {key} repetido")
+            seen[key].add(value)
+        entries.append((name, values))
+    return entries
+
+
+def configure_hosted_bot(name: str, values: Dict[str, str], state_db: Path) -> None:
+    """Convierte este módulo en el de un bot alojado: token, DATA_DIR, tabla de chat_data,
+    configuración recargable, grabación y loggers propios."""
+    global HOSTED_BOT, BOT_TOKEN, DATA_DIR, BOT_STATE_DB, STATE_TABLE, UPDATE_RECORDER
+    global log, log_welcome, log_admin, log_persist, log_clean, log_health
+    HOSTED_BOT = name
+    BOT_TOKEN = values["BOT_TOKEN"]
+    DATA_DIR = Path(values["BOT_DATA_DIR"])
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    BOT_STATE_DB = str(state_db)
+    STATE_TABLE = f"chat_data_{name}"
+    if UPDATE_RECORDER is not None:
+        UPDATE_RECORDER = UpdateRecorder(
+            Path(RECORD_UPDATES_DIR) / name, RECORD_SEGMENT_MB * 1024 * 1024, RECORD_MAX_SEGMENTS
+        )
+    # qvc.<nombre>, qvc.welcome.<nombre>...: LOG_LEVELS por módulo sigue aplicando
+    log, log_welcome, log_admin = log.getChild(name), log_welcome.getChild(name), log_admin.getChild(name)
+    log_persist, log_clean, log_health = log_persist.getChild(name), log_clean.getChild(name), log_health.getChild(name)
+    apply_config(values)
+    HEALTH.polling = True
+
+
+class HostedJobQueue(JobQueue):
+    """JobQueue de un bot alojado sobre el planificador común: sus jobs van a un jobstore y un
+    ejecutor propios (alias = nombre del bot), de modo que jobs() y stop() sólo ven los suyos y
+    parar una Application no para el planificador de las demás."""
+
+    def __init__(self, scheduler, alias: str):
+        # Sin JobQueue.__init__, que crearía un AsyncIOScheduler propio sin usar
+        from apscheduler.executors.asyncio import AsyncIOExecutor
+        from apscheduler.jobstores.memory import MemoryJobStore
+
+        self._application = None
+        self._executor = AsyncIOExecutor()
+        self.scheduler = scheduler
+        self.alias = alias
+        scheduler.add_jobstore(MemoryJobStore(), alias)
+        scheduler.add_executor(self._executor, alias)
+
+    def set_application(self, application: Application) -> None:
+        # Sin scheduler.configure(), que vaciaría el planificador común
+        self._application = weakref.ref(application)
+
+    def _route(self, job_kwargs: Optional[dict]) -> dict:
+        return {**(job_kwargs or {}), "jobstore": self.alias, "executor": self.alias}
+
+    def run_once(self, *args, job_kwargs: Optional[dict] = None, **kwargs):
+        return super().run_once(*args, job_kwargs=self._route(job_kwargs), **kwargs)
+
+    def run_repeating(self, *args, job_kwargs: Optional[dict] = None, **kwargs):
+        return super().run_repeating(*args, job_kwargs=self._route(job_kwargs), **kwargs)
+
+    def run_daily(self, *args, job_kwargs: Optional[dict] = None, **kwargs):
+        return super().run_daily(*args, job_kwargs=self._route(job_kwargs), **kwargs)
+
+    def run_monthly(self, *args, job_kwargs: Optional[dict] = None, **kwargs):
+        return super().run_monthly(*args, job_kwargs=self._route(job_kwargs), **kwargs)
+
+    def run_custom(self, callback, job_kwargs: dict, *args, **kwargs):
+        return super().run_custom(callback, self._route(job_kwargs), *args, **kwargs)
+
+    def jobs(self, pattern=None) -> Tuple[Job, ...]:
+        jobs = tuple(Job.from_aps_job(job) for job in self.scheduler.get_jobs(jobstore=self.alias))
+        if pattern is None:
+            return jobs
+        return tuple(job for job in jobs if job.name and re.search(pattern, job.name))
+
+    async def stop(self, wait: bool = True) -> None:
+        if wait:
+            await asyncio.gather(*self._executor._pending_futures, return_exceptions=True)
+        # Sólo lo de este bot (idempotente); el planificador lo apaga el anfitrión
+        for remove in (self.scheduler.remove_executor, self.scheduler.remove_jobstore):
+            try:
+                remove(self.alias)
+            except KeyError:
+                pass
+
+
+class HostedResources:
+    """Lo que comparten los bots alojados: pools HTTP dueños de las conexiones (api y polling,
+    con una conexión de long polling por bot), la base SQLite y el planificador."""
+
+    def __init__(self, bots: int):
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+        self.api = make_request("api")
+        self.polling = make_request("polling", pool_size=bots)
+        self.db = StateDB(state_db_path())
+        self.scheduler = AsyncIOScheduler(timezone=timezone.utc)
+
+    async def close(self) -> None:
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        await self.api.shutdown()
+        await self.polling.shutdown()
+        self.db.close()
+
+
+class HostedBot:
+    def __init__(self, name: str, values: Dict[str, str], module, app: Application):
+        self.name, self.values, self.module, self.app = name, values, module, app
+        self.initialized = False
+
+
+# Código de main.py (desde __pycache__ si está al día) compilado una sola vez para todas las copias
+_BOT_CODE = None
+
+
+def _load_bot_module(name: str):
+    """Copia independiente de este módulo (globals propios) para un bot alojado."""
+    global _BOT_CODE
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(f"qvc_bot_{name}", Path(__file__).resolve())
+    module = importlib.util.module_from_spec(spec)
+    if _BOT_CODE is None:
+        _BOT_CODE = spec.loader.get_code(spec.name)
+    exec(_BOT_CODE, module.__dict__)
+    return module
+
+
+def _hosted_values(values: Dict[str, str], env: Dict[str, str]) -> Dict[str, str]:
+    # Lo que el bot no fija sale de .env
+    return {**{k: env.get(k, "") for k in HOT_RELOAD_KEYS}, **values}
+
+
+async def _start_hosted_bot(bot: HostedBot) -> bool:
+    try:
+        await bot.app.initialize()
+        await bot.module.post_init(bot.app)
+        bot.initialized = True
+        await bot.app.updater.start_polling()
+        await bot.app.start()
+    except Exception as e:
+        log.error("El bot %s no arrancó: %s", bot.name, e)
+        await _stop_hosted_bot(bot)
+        return False
+    return True
+
+
+async def _stop_hosted_bot(bot: HostedBot) -> None:
+    app = bot.app
+    try:
+        if app.updater is not None and app.updater.running:
+            await app.updater.stop()
+        if app.running:
+            await app.stop()
+        else:
+            # Sin app.stop(): el jobstore del bot sigue en el planificador común
+            await app.job_queue.stop(wait=False)
+        if bot.initialized:
+            await bot.module.post_shutdown(app)
+        await app.shutdown()
+    except Exception as e:
+        log.exception("Error parando el bot %s: %s", bot.name, e)
+
+
+def reload_hosted_bots() -> None:
+    """SIGHUP del anfitrión: relee .env y BOTS_FILE y aplica a cada bot su configuración
+    recargable. Altas, bajas y cambios de token o directorio requieren reiniciar."""
+    try:
+        env = _read_env_file()
+        entries = dict(load_bots_file(BOTS_FILE))
+    except Exception as e:
+        log.error("Recarga de configuración fallida (%s): se mantiene la actual", e)
+        return
+    for name, bot in HOSTED_BOTS.items():
+        values = entries.get(name)
+        if values is None:
+            continue
+        changes = bot.module.apply_config(_hosted_values(values, env), bot.app)
+        if changes:
+            log.info("Bot %s: configuración recargada: %s", name, "; ".join(changes))
+        else:
+            log.info("Bot %s: configuración recargada sin cambios", name)
+        restart_only = [k for k in ("BOT_TOKEN", "BOT_DATA_DIR") if values[k] != bot.values[k]]
+        if restart_only:
+            log.warning("Bot %s: cambios que requieren reiniciar: %s", name, ", ".join(restart_only))
+    added, removed = sorted(set(entries) - set(HOSTED_BOTS)), sorted(set(HOSTED_BOTS) - set(entries))
+    if added or removed:
+        log.warning("Bots añadidos %s o quitados %s en %s: requieren reiniciar", added, removed, BOTS_FILE)
+
+
+async def _run_hosted_bots(entries: List[Tuple[str, Dict[str, str]]]) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    loop.add_signal_handler(signal.SIGHUP, reload_hosted_bots)
+
+    shared = HostedResources(len(entries))
+    env = {k: os.environ.get(k, "") for k in HOT_RELOAD_KEYS}
+    bots: List[HostedBot] = []
+    for name, values in entries:
+        module = _load_bot_module(name)
+        module.configure_hosted_bot(name, _hosted_values(values, env), shared.db.path)
+        app = module.build_application(
+            values["BOT_TOKEN"], BOT_API_BASE_URL, limiter=module.shard_rate_limiter(shared=False), shared=shared
+        )
+        module.register_handlers(app)
+        bots.append(HostedBot(name, values, module, app))
+    STARTUP.mark("initialize")
+    HTTP_ROUTES["/metrics"] = lambda: (
+        200,
+        "text/plain; version=0.0.4; charset=utf-8",
+        METRICS.render_labeled({name: bot.module.METRICS for name, bot in HOSTED_BOTS.items()}, "bot", PROCESS_METRICS),
+    )
+    await start_http_server()
+    HEALTH.start()
+    shared.scheduler.start()
+    try:
+        started = await asyncio.gather(*(_start_hosted_bot(bot) for bot in bots))
+        HOSTED_BOTS.update((bot.name, bot) for bot, ok in zip(bots, started) if ok)
+        if not HOSTED_BOTS:
+            raise SystemExit(f"Ningún bot de {BOTS_FILE} pudo arrancar")
+        STARTUP.mark("polling")
+        log.info("%d/%d bots en marcha: %s", len(HOSTED_BOTS), len(bots), ", ".join(HOSTED_BOTS))
+        sd_notify("READY=1")
+        await stop.wait()
+    finally:
+        await asyncio.gather(*(_stop_hosted_bot(bot) for bot in HOSTED_BOTS.values()))
+        await HEALTH.stop()
+        await stop_http_server()
+        await shared.close()
+        STARTUP.finish()
+
+
+def run_hosted_bots(path: str) -> None:
+    global BOTS_FILE
+    BOTS_FILE = path
+    try:
+        entries = load_bots_file(path)
+    except ValueError as e:
+        raise SystemExit(f"BOTS_FILE inválido: {e}")
+    asyncio.run(_run_hosted_bots(entries))
+
+
+def run_snapshot_command(export_path: Optional[str], import_path: Optional[str]) -> None:
+    """--export-snapshot / --import-snapshot: no necesitan BOT_TOKEN ni red. El resumen va a
+    stderr para que stdout quede libre para el flujo binario."""
+    try:
+        if export_path:
+            if export_path == "-":
+                counts = export_snapshot(sys.stdout.buffer)
+            else:
+                tmp = Path(export_path + ".tmp")
+                with tmp.open("wb") as f:
+                    counts = export_snapshot(f)
+                os.replace(tmp, export_path)
+            action = "exportado"
+        else:
+            if import_path == "-":
+                counts = import_snapshot(sys.stdin.buffer)
+            else:
+                with open(import_path, "rb") as f:
+                    counts = import_snapshot(f)
+            action = "importado"
+    except SnapshotError as e:
+        raise SystemExit(f"Snapshot inválido: {e}")
+    summary = ", ".join(f"{name}={n}" for name, n in counts.items()) or "vacío"
+    print(f"Snapshot {action} ({DATA_DIR}): {summary}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QvaClick Welcome Bot")
+    parser.add_argument("--shards", type=int, default=SHARD_WORKERS, help="número de workers (0/1 = un proceso)")
+    parser.add_argument("--worker", type=int, default=None, help="ejecutar sólo el worker con este índice")
+    parser.add_argument("--ingress", action="store_true", help="ejecutar sólo la entrada (workers lanzados aparte)")
+    parser.add_argument("--export-snapshot", metavar="ARCHIVO", help="exportar todo el estado a un snapshot ('-' = stdout)")
+    parser.add_argument("--import-snapshot", metavar="ARCHIVO", help="importar un snapshot con el bot parado ('-' = stdin)")
+    parser.add_argument(
+        "--profile-startup", action="store_true", help="perfilar el arranque hasta el primer update (startup_profile_*.txt)"
+    )
+    parser.add_argument("--bots", metavar="ARCHIVO", default=BOTS_FILE, help="varios bots en este proceso (JSON, ver BOTS_FILE)")
+    parser.add_argument("--bot", metavar="NOMBRE", help="con --export-snapshot/--import-snapshot: el bot de --bots a usar")
+    args = parser.parse_args()
+
+    if args.export_snapshot or args.import_snapshot:
+        if args.bot:
+            if not args.bots:
+                raise SystemExit("--bot requiere --bots o BOTS_FILE")
+            try:
+                entries = dict(load_bots_file(args.bots))
+            except ValueError as e:
+                raise SystemExit(f"BOTS_FILE inválido: {e}")
+            if args.bot not in entries:
+                raise SystemExit(f"No hay ningún bot '{args.bot}' en {args.bots}")
+            configure_hosted_bot(args.bot, _hosted_values(entries[args.bot], os.environ), state_db_path())
+        return run_snapshot_command(args.export_snapshot, args.import_snapshot)
+
+    if args.bots:
+        if args.shards > 1 or args.worker is not None or args.ingress:
+            raise SystemExit("El modo multi-bot (--bots/BOTS_FILE) no se combina con el modo shard")
+    elif not BOT_TOKEN:
+        raise SystemExit("Falta BOT_TOKEN en .env")
+
+    setup_logging()
+    if args.profile_startup:
+        STARTUP.start_profile()
+    loop_name = install_event_loop_policy()
+    log.info("Runtime: %s", runtime_description(loop_name))
+
+    try:
+        if args.bots:
+            return run_hosted_bots(args.bots)
+        if args.worker is not None:
+            return run_shard_worker(args.worker, max(1, args.shards))
+        if args.ingress:
+            return asyncio.run(_run_shard_ingress(max(1, args.shards)))
+        if args.shards > 1:
+            return run_shard_supervisor(args.shards)
+
+        app = build_application(BOT_TOKEN, BOT_API_BASE_URL, limiter=shard_rate_limiter(shared=False))
+        register_handlers(app)
+
+        # Long Polling (no requiere puertos abiertos)
+        HEALTH.polling = True
+        app.run_polling(close_loop=False)
+    finally:
+        shutdown_logging()
 
 
 if __name__ == "__main__":
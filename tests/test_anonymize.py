@@ -0,0 +1,31 @@
+# tests/test_anonymize.py
+# Grabación de updates: nada identificable sale en claro.
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+SALT = b"0123456789abcdef"
+
+
+def test_location_file_and_poll_fields_are_masked():
+    update = {
+        "update_id": 1,
+        "message": {
+            "message_id": 5,
+            "location": {"latitude": 40.416775, "longitude": -3.703790},
+            "document": {"file_id": "AgAD", "file_unique_id": "AQAD", "file_name": "dni.pdf"},
+            "audio": {"performer": "Ana"},
+            "poll": {"question": "¿Quién?", "explanation": "Yo"},
+        },
+    }
+    out = main.anonymize_update(update, SALT)["message"]
+
+    assert out["message_id"] == 5
+    assert out["location"] == {"latitude": 40.4, "longitude": -3.7}
+    assert all(v.startswith("anon-") for v in out["document"].values())
+    assert out["audio"]["performer"].startswith("anon-")
+    assert out["poll"] == {"question": "xxxxxxx", "explanation": "xx"}
@@ -0,0 +1,46 @@
+# tests/test_auto_clean.py
+# Limpiezas: solapamiento entre destinos.
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+CHAT = -100123
+
+
+def test_clean_overlaps_same_target_and_whole_chat_with_topics():
+    assert main._clean_overlaps((CHAT, None), {(CHAT, None)})
+    assert main._clean_overlaps((CHAT, None), {(CHAT, 7)})
+    assert main._clean_overlaps((CHAT, 7), {(CHAT, None)})
+    assert main._clean_overlaps((CHAT, 7), {(CHAT, 7)})
+    assert not main._clean_overlaps((CHAT, 7), {(CHAT, 8)})
+    assert not main._clean_overlaps((CHAT, None), {(-100999, None)})
+
+
+def test_next_auto_clean_at_keeps_the_chat_phase():
+    hours, interval = 6, 6 * 3600
+    offset = main._auto_clean_phase(CHAT) * interval
+    for now in (1_700_000_000.0, 1_700_000_000.0 + 12345, 1_700_050_000.0):
+        due = main.next_auto_clean_at(CHAT, hours, now)
+        assert now < due <= now + interval
+        assert abs((due - offset) % interval) < 1e-6 or abs((due - offset) % interval - interval) < 1e-6
+    # Otro chat y el topic del mismo chat tienen fases propias
+    assert main._auto_clean_phase(CHAT) != main._auto_clean_phase(CHAT, 7)
+
+
+def test_next_auto_clean_at_spreads_missed_runs_over_the_catchup_window(monkeypatch):
+    monkeypatch.setattr(main, "AUTO_CLEAN_CATCHUP_SECONDS", 600)
+    hours, interval, now = 6, 6 * 3600, 1_700_000_000.0
+    phase = main._auto_clean_phase(CHAT)
+    regular = main.next_auto_clean_at(CHAT, hours, now)
+
+    # Última ejecución hace dos días: recuperación dentro de los próximos 600 s, según la fase
+    due = main.next_auto_clean_at(CHAT, hours, now, last_run=now - 2 * 86400)
+    assert due == min(regular, now + phase * 600)
+    assert now <= due <= now + 600
+
+    # Con la última ejecución en su sitio no hay recuperación
+    assert main.next_auto_clean_at(CHAT, hours, now, last_run=regular - interval) == regular
@@ -0,0 +1,58 @@
+# tests/test_chat_state.py
+# Persistencia de chat_data en SQLite: codificación y carga perezosa por chat.
+
+import sys
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+CHAT = -100123
+
+
+def test_encode_decode_round_trip_restores_deques_and_int_keys():
+    data = {
+        "message_cache": deque([(1, 42, False, False), (2, None, True, False)], maxlen=main.MESSAGE_CACHE_SIZE),
+        "topic_cache": {7: deque([(3, 42, False, True)], maxlen=main.MESSAGE_CACHE_SIZE)},
+        "waiting": {42: "waiting_for_welcome"},
+    }
+
+    decoded = main._decode_chat_data(main._encode_chat_data(data))
+
+    assert decoded == data
+    assert decoded["message_cache"].maxlen == main.MESSAGE_CACHE_SIZE
+    assert decoded["topic_cache"][7].maxlen == main.MESSAGE_CACHE_SIZE
+
+
+def test_load_chat_puts_stored_entries_before_the_ones_in_memory(tmp_path):
+    store = main.ChatStatePersistence(tmp_path / "state.sqlite3")
+    try:
+        stored = {
+            "message_cache": deque([(1, 42, False, False)]),
+            "topic_cache": {7: deque([(2, 42, False, False)])},
+            "waiting": {42: "waiting_for_welcome"},
+        }
+        store.write_rows([(CHAT, main._encode_chat_data(stored))])
+        # Updates llegados antes de la primera carga del chat
+        chat_data = {
+            "message_cache": deque([(10, 43, False, False)]),
+            "topic_cache": {7: deque([(11, 43, False, False)]), 8: deque([(12, 43, False, False)])},
+            "waiting": {43: "waiting_for_registration"},
+        }
+
+        store.load_chat(CHAT, chat_data)
+
+        assert [r[0] for r in chat_data["message_cache"]] == [1, 10]
+        assert [r[0] for r in chat_data["topic_cache"][7]] == [2, 11]
+        assert [r[0] for r in chat_data["topic_cache"][8]] == [12]
+        # Lo que ya estaba en memoria gana a lo guardado
+        assert chat_data["waiting"] == {43: "waiting_for_registration"}
+
+        # Sólo se carga una vez
+        chat_data["message_cache"].clear()
+        store.load_chat(CHAT, chat_data)
+        assert not chat_data["message_cache"]
+    finally:
+        store.close()
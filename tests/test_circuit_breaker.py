@@ -0,0 +1,31 @@
+# tests/test_circuit_breaker.py
+# Semiabierto: una sola llamada de prueba pasa hasta conocer su resultado.
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+def test_half_open_lets_a_single_probe_through():
+    breaker = main.CircuitBreaker(failures=1, cooldown=0)
+    breaker.record_failure()
+    assert breaker.state == breaker.HALF_OPEN
+
+    async def scenario():
+        now = main.CLOCK.monotonic()
+        probe = await breaker.wait_closed(now + 1)
+        assert probe is not None
+        # Con la prueba en curso, el resto espera y agota su plazo
+        with pytest.raises(main.CircuitOpenError):
+            await breaker.wait_closed(now + 0.05)
+        breaker.end_probe(probe)
+        breaker.record_success()
+        assert await breaker.wait_closed(now + 1) is None
+
+    asyncio.run(scenario())
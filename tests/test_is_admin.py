@@ -0,0 +1,44 @@
+# tests/test_is_admin.py
+# Caché de is_admin: sólo se guardan las respuestas de la API.
+
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from telegram.error import NetworkError  # noqa: E402
+
+import main  # noqa: E402
+
+
+class FakeBot:
+    def __init__(self):
+        self.fail = True
+
+    async def get_chat_member(self, chat_id, user_id):
+        if self.fail:
+            raise NetworkError("caída")
+        return SimpleNamespace(status="administrator")
+
+    async def get_chat_administrators(self, chat_id):
+        raise NetworkError("caída")
+
+
+def test_failed_lookup_is_not_cached(monkeypatch):
+    monkeypatch.setattr(main, "_admin_cache", {})
+    monkeypatch.setattr(main, "ADMIN_CACHE_SECONDS", 60)
+    monkeypatch.setattr(main, "SUPER_ADMIN_IDS", set())
+    bot = FakeBot()
+    context = SimpleNamespace(bot=bot)
+
+    assert asyncio.run(main.is_admin(context, -100123, 42)) is False
+    assert (-100123, 42) not in main._admin_cache
+
+    bot.fail = False
+    assert asyncio.run(main.is_admin(context, -100123, 42)) is True
+    assert main._admin_cache[(-100123, 42)][0] is True
+
+    main.forget_admin(-100123)
+    assert not main._admin_cache
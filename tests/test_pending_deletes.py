@@ -0,0 +1,63 @@
+# tests/test_pending_deletes.py
+# Borrados pendientes: nunca se compacta el archivo de un chat sin cargar y el snapshot de
+# arranque en caliente no gana a archivos más nuevos.
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+CHAT = -100123
+
+
+def _use_data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DATA_DIR", tmp_path)
+    main.reset_pending_index()
+
+
+def test_live_delete_before_restore_keeps_unloaded_records(tmp_path, monkeypatch):
+    _use_data_dir(tmp_path, monkeypatch)
+    # Registro de la ejecución anterior, aún sin restaurar
+    main._write_pending_file(CHAT, {10: (2_000_000_000, None)})
+    # Un borrado programado y completado en esta ejecución antes de la restauración
+    main._append_pending_delete(CHAT, {"chat_id": CHAT, "message_id": 11, "delete_at": 1, "thread_id": None})
+    main._remove_pending_delete(CHAT, 11)
+
+    assert main.pending_deletes_path_for_chat(CHAT).exists()
+    assert [r["message_id"] for r in main._load_pending_deletes(CHAT)] == [10]
+    main.reset_pending_index()
+
+
+def test_warm_start_falls_back_when_files_are_newer(tmp_path, monkeypatch):
+    _use_data_dir(tmp_path, monkeypatch)
+    monkeypatch.setattr(main, "SNAPSHOT_WARM_START", True)
+    monkeypatch.setattr(main, "SHARD", None)
+    main._append_pending_delete(CHAT, {"chat_id": CHAT, "message_id": 10, "delete_at": 2_000_000_000})
+    main.write_warm_snapshot()
+    main.reset_pending_index()
+    # Edición en frío posterior al snapshot
+    p = main.pending_deletes_path_for_chat(CHAT)
+    snap_mtime = main.warm_snapshot_path().stat().st_mtime
+    os.utime(p, (snap_mtime + 10, snap_mtime + 10))
+
+    assert main.warm_start(object()) is None
+    assert not main.warm_snapshot_path().exists()
+    assert not main.PENDING_DELETES
+
+
+def test_import_snapshot_discards_warm_snapshot(tmp_path, monkeypatch):
+    _use_data_dir(tmp_path, monkeypatch)
+    main._append_pending_delete(CHAT, {"chat_id": CHAT, "message_id": 10, "delete_at": 2_000_000_000})
+    main.write_warm_snapshot()
+    exported = tmp_path / "export.snap"
+    with exported.open("wb") as f:
+        main.export_snapshot(f)
+    main.reset_pending_index()
+
+    with exported.open("rb") as f:
+        main.import_snapshot(f)
+
+    assert not main.warm_snapshot_path().exists()
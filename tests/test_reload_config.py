@@ -0,0 +1,78 @@
+# tests/test_reload_config.py
+# Recarga en caliente (SIGHUP): el entorno del proceso tiene prioridad sobre .env.
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+def test_reload_keeps_settings_from_process_environment(tmp_path, monkeypatch):
+    # Como con Environment= en el unit de systemd: las variables no están en .env
+    env_file = tmp_path / ".env"
+    env_file.write_text("BOT_TOKEN=123:abc\nWELCOME_DELETE_SECONDS=30\n", encoding="utf-8")
+    monkeypatch.setattr(main, "ENV_PATH", env_file)
+    monkeypatch.setenv("ALLOWED_CHAT_IDS", "-100123")
+    monkeypatch.setenv("SUPER_ADMIN_IDS", "42")
+    monkeypatch.setattr(main, "_ENV_FROM_PROCESS", main._ENV_FROM_PROCESS | {"ALLOWED_CHAT_IDS", "SUPER_ADMIN_IDS"})
+    monkeypatch.setattr(main, "ALLOWED_CHAT_IDS", {-100123})
+    monkeypatch.setattr(main, "SUPER_ADMIN_IDS", {42})
+    monkeypatch.setattr(main, "WELCOME_DELETE_SECONDS", 0)
+
+    changes = main.reload_config()
+
+    assert main.ALLOWED_CHAT_IDS == {-100123}
+    assert main.SUPER_ADMIN_IDS == {42}
+    assert not main.chat_allowed(-100999)
+    # Lo que sí viene de .env se sigue recargando
+    assert main.WELCOME_DELETE_SECONDS == 30
+    assert changes == ["WELCOME_DELETE_SECONDS 0 → 30"]
+
+
+def test_env_file_value_still_loses_to_process_environment(tmp_path, monkeypatch):
+    env_file = tmp_path / ".env"
+    env_file.write_text("ALLOWED_CHAT_IDS=-100555\n", encoding="utf-8")
+    monkeypatch.setattr(main, "ENV_PATH", env_file)
+    monkeypatch.setenv("ALLOWED_CHAT_IDS", "-100123")
+    monkeypatch.setattr(main, "_ENV_FROM_PROCESS", main._ENV_FROM_PROCESS | {"ALLOWED_CHAT_IDS"})
+
+    assert main._read_env_file()["ALLOWED_CHAT_IDS"] == "-100123"
+
+
+def test_hosted_reload_keeps_settings_from_process_environment(tmp_path, monkeypatch):
+    # SIGHUP del anfitrión multi-bot: lo que el bot no fija sale del entorno, no de un .env vacío
+    env_file = tmp_path / ".env"
+    env_file.write_text("WELCOME_DELETE_SECONDS=30\n", encoding="utf-8")
+    bots_file = tmp_path / "bots.json"
+    bots_file.write_text('[{"name": "a", "BOT_TOKEN": "1:a"}]', encoding="utf-8")
+    monkeypatch.setattr(main, "ENV_PATH", env_file)
+    monkeypatch.setattr(main, "BOTS_FILE", str(bots_file))
+    monkeypatch.setenv("ALLOWED_CHAT_IDS", "-100123")
+    monkeypatch.setattr(main, "_ENV_FROM_PROCESS", main._ENV_FROM_PROCESS | {"ALLOWED_CHAT_IDS"})
+
+    applied = []
+
+    class FakeModule:
+        @staticmethod
+        def apply_config(values, app=None):
+            applied.append(values)
+            return []
+
+    values = dict(main.load_bots_file(str(bots_file)))["a"]
+    monkeypatch.setattr(main, "HOSTED_BOTS", {"a": main.HostedBot("a", values, FakeModule, None)})
+
+    main.reload_hosted_bots()
+
+    assert applied[0]["ALLOWED_CHAT_IDS"] == "-100123"
+    assert applied[0]["WELCOME_DELETE_SECONDS"] == "30"
+
+
+def test_invalid_numeric_setting_keeps_only_its_own_default(monkeypatch, caplog):
+    monkeypatch.setenv("HTTP_POOL_SIZE", "abc")
+    monkeypatch.setenv("HTTP_READ_TIMEOUT", "7")
+
+    assert main._env_int("HTTP_POOL_SIZE", 256, 1) == 256
+    assert main._env_float("HTTP_READ_TIMEOUT", 5.0) == 7.0
+    assert "HTTP_POOL_SIZE" in caplog.text
@@ -0,0 +1,37 @@
+# tests/test_shard.py
+# Modo shard: clave de reparto de updates y límite de tasa GCRA.
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+def test_update_route_key_uses_chat_then_sender():
+    assert main._update_route_key({"update_id": 1, "message": {"chat": {"id": -100123}, "from": {"id": 42}}}) == -100123
+    # callback_query: el chat está en el mensaje del botón
+    assert main._update_route_key({"update_id": 2, "callback_query": {"from": {"id": 42}, "message": {"chat": {"id": -100555}}}}) == -100555
+    assert main._update_route_key({"update_id": 3, "my_chat_member": {"chat": {"id": -100777}, "from": {"id": 42}}}) == -100777
+    # Sin chat (inline_query): el usuario
+    assert main._update_route_key({"update_id": 4, "inline_query": {"from": {"id": 42}}}) == 42
+    assert main._update_route_key({"update_id": 5}) == 0
+
+
+def test_shard_for_chat_is_stable_and_in_range():
+    shards = [main.shard_for_chat(-1000000000000 - i, 4) for i in range(100)]
+    assert shards == [main.shard_for_chat(-1000000000000 - i, 4) for i in range(100)]
+    assert set(shards) == {0, 1, 2, 3}
+
+
+def test_gcra_allows_a_burst_then_spaces_requests():
+    interval, burst, now = 0.1, 3, 100.0
+    tat, waits = 0.0, []
+    for _ in range(5):
+        tat, wait = main._gcra(tat, now, interval, burst)
+        waits.append(round(wait, 6))
+    assert waits == [0.0, 0.0, 0.0, 0.1, 0.2]
+    # Pasado el tiempo, vuelve a haber ráfaga
+    tat, wait = main._gcra(tat, now + 10, interval, burst)
+    assert wait == 0.0
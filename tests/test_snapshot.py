@@ -0,0 +1,71 @@
+# tests/test_snapshot.py
+# Snapshots binarios: exportar e importar el estado completo y rechazar los corruptos.
+
+import io
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+CHAT = -100123
+
+
+def _use_data_dir(monkeypatch, path):
+    monkeypatch.setattr(main, "DATA_DIR", path)
+    monkeypatch.setattr(main, "BOT_STATE_DB", "")
+    main.reset_pending_index()
+
+
+def _export(monkeypatch, tmp_path) -> bytes:
+    _use_data_dir(monkeypatch, tmp_path / "src")
+    main.DATA_DIR.mkdir()
+    main.welcome_path_for_chat(CHAT).write_text("Hola", encoding="utf-8")
+    main.save_delete_seconds_for_chat(CHAT, 45)
+    main.save_auto_clean_hours(CHAT, 6, 1_700_000_000)
+    main.save_auto_clean_hours(CHAT, 2, 1_700_000_100, thread_id=7)
+    main._write_pending_file(CHAT, {10: (2_000_000_000, None), 11: (2_000_000_100, 7)})
+    store = main.ChatStatePersistence(main.state_db_path())
+    store.write_rows([(CHAT, main._encode_chat_data({"waiting": {42: "waiting_for_welcome"}}))])
+    store.close()
+    out = io.BytesIO()
+    counts = main.export_snapshot(out)
+    assert counts["pending_deletes"] == 1 and counts["auto_clean"] == 2
+    return out.getvalue()
+
+
+def test_export_import_round_trip(tmp_path, monkeypatch):
+    blob = _export(monkeypatch, tmp_path)
+    _use_data_dir(monkeypatch, tmp_path / "dst")
+
+    main.import_snapshot(io.BytesIO(blob))
+
+    assert main.load_welcome_text(CHAT) == "Hola"
+    assert main.load_delete_seconds_for_chat(CHAT) == 45
+    assert main.load_auto_clean_hours(CHAT) == 6
+    assert main.load_auto_clean_last_run(CHAT) == 1_700_000_000
+    assert main.load_auto_clean_hours(CHAT, 7) == 2
+    pending = {r["message_id"]: (r["delete_at"], r["thread_id"]) for r in main._load_pending_deletes(CHAT)}
+    assert pending == {10: (2_000_000_000, None), 11: (2_000_000_100, 7)}
+    store = main.ChatStatePersistence(main.state_db_path())
+    chat_data = {}
+    store.load_chat(CHAT, chat_data)
+    store.close()
+    assert chat_data == {"waiting": {42: "waiting_for_welcome"}}
+
+
+def test_corrupted_snapshot_is_rejected_without_writing(tmp_path, monkeypatch):
+    blob = bytearray(_export(monkeypatch, tmp_path))
+    # Un byte cambiado en el texto de bienvenida (primer registro tras la cabecera)
+    blob[main._SNAP_HEADER.size + main._SNAP_RECORD.size] ^= 0xFF
+    _use_data_dir(monkeypatch, tmp_path / "dst")
+
+    with pytest.raises(main.SnapshotError, match="checksum"):
+        main.import_snapshot(io.BytesIO(bytes(blob)))
+    assert not main.DATA_DIR.exists()
+
+    with pytest.raises(main.SnapshotError, match="truncado"):
+        main.read_snapshot(io.BytesIO(bytes(blob[:-3])))
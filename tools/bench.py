@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+# tools/bench.py
+# Benchmarks de los handlers reales (bienvenida, cache_message, _perform_clean,
+# restauración de post_init) contra la Bot API falsa de tools/fake_bot_api.py.
+#
+# Uso:
+#   python tools/bench.py                       # suite completa, JSON por stdout
+#   python tools/bench.py --quick -o bench.json # versión corta, a archivo
+#   python tools/bench.py --compare prev.json   # sale con código 1 si hay regresiones
+#
+# Escenarios:
+#   welcome_burst    — throughput y p50/p99 unión→bienvenida a 1/10/100 uniones/s
+#   clean_chat       — llamadas a la API y tiempo por /clean_chat N
+#   topic_clean      — /clean_chat dentro de un topic tranquilo de un foro con el General activo
+#   message_cache    — memoria retenida por mensaje cacheado
+#   startup_restore  — con 10k borrados pendientes: lo que post_init bloquea antes del polling
+#                      y la restauración completa, desde los archivos por chat y desde el
+#                      snapshot de arranque en caliente
+#   json_codec       — µs por operación con json y con orjson (antes/después) en getUpdates,
+#                      IPC de shards, registros de borrados pendientes y chat_data
+#
+# Antes/después del runtime completo (uvloop + orjson):
+#   FAST_RUNTIME=0 python tools/bench.py -o stdlib.json && python tools/bench.py --compare stdlib.json
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "tools"))
+
+import main  # noqa: E402
+from fake_bot_api import FakeBotAPI, start_server  # noqa: E402
+from telegram import Bot, Update  # noqa: E402
+from telegram.ext import CallbackContext  # noqa: E402
+
+SCHEMA_VERSION = 1
+_MENTION_RE = re.compile(r"tg://user\?id=(\d+)")
+CHAT_ID = -1001000000001
+
+
+def _pct(values: List[float], p: float) -> Optional[float]:
+    """Percentil por rango más cercano; None si no hay muestras."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value * 1000.0, 3)
+
+
+def _reset_bot_state() -> None:
+    for state in (
+        main._admin_cache,
+        main.AUTO_CLEAN_DUE,
+        main.AUTO_CLEAN_RUNNING,
+        main.AUTO_CLEAN_TOPIC_COUNT,
+    ):
+        state.clear()
+    main.AUTO_CLEAN_QUEUE.clear()
+    main.reset_pending_index()
+    main._auto_clean_slots = None
+    main.DELETE_EXECUTOR = main.DeleteExecutor(main.DELETE_TARGET_RATE, main.DELETE_MAX_CONCURRENCY)
+    main.SCHEDULED_AUTOCLEAN_CHATS.clear()
+    main.WELCOME_LATENCIES_MS.clear()
+
+
+class BenchEnv:
+    """Application real + Bot API falsa en un puerto efímero + DATA_DIR temporal."""
+
+    def __init__(self, latency_ms: float, jitter_ms: float, admin_ids=()):
+        self.api = FakeBotAPI(latency_ms=latency_ms, jitter_ms=jitter_ms, admin_ids=admin_ids, seed=1)
+        self._tmp = tempfile.TemporaryDirectory(prefix="qvc-bench-")
+        self.data_dir = Path(self._tmp.name)
+        self.server = None
+        self.app = None
+
+    async def __aenter__(self) -> "BenchEnv":
+        self._saved_data_dir = main.DATA_DIR
+        main.DATA_DIR = self.data_dir
+        _reset_bot_state()
+        self.server = await start_server(self.api, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.app = main.build_application("123456:bench", f"http://127.0.0.1:{port}/bot")
+        main.register_handlers(self.app)
+        await self.app.initialize()
+        await self.app.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        try:
+            if self.app.job_queue is not None:
+                self.app.job_queue.scheduler.remove_all_jobs()
+            await self.app.stop()
+            await self.app.shutdown()
+        finally:
+            self.server.close()
+            await self.server.wait_closed()
+            main.DATA_DIR = self._saved_data_dir
+            _reset_bot_state()
+            self._tmp.cleanup()
+
+    def context(self) -> CallbackContext:
+        return CallbackContext(self.app)
+
+    def update(self, data: dict) -> Update:
+        return Update.de_json(dict(data, update_id=0), self.app.bot)
+
+
+# === Escenarios ===
+async def bench_welcome_burst(args, rate: float) -> dict:
+    async with BenchEnv(args.latency_ms, args.jitter_ms) as env:
+        total = max(1, int(rate * args.duration))
+        arrivals: Dict[int, float] = {}
+        visible: Dict[int, float] = {}
+        done = asyncio.Event()
+
+        def on_call(method, params, status, payload):
+            if method == "sendMessage" and status == 200:
+                m = _MENTION_RE.search(str(params.get("text", "")))
+                if m:
+                    visible[int(m.group(1))] = time.perf_counter()
+                    if len(visible) >= total:
+                        done.set()
+
+        env.api.on_call = on_call
+        start = time.perf_counter()
+        for i in range(total):
+            target = start + i / rate
+            delay = target - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            uid = 10_000 + i
+            update = env.update(env.api.make_join_update(CHAT_ID - (i % 5), [uid]))
+            arrivals[uid] = time.perf_counter()
+            await env.app.update_queue.put(update)
+        try:
+            await asyncio.wait_for(done.wait(), timeout=args.duration + 60)
+        except asyncio.TimeoutError:
+            pass
+        latencies = [visible[u] - arrivals[u] for u in visible if u in arrivals]
+        elapsed = (max(visible.values()) - start) if visible else 0.0
+        return {
+            "rate_per_s": rate,
+            "joins": total,
+            "welcomes": len(visible),
+            "throughput_per_s": round(len(visible) / elapsed, 2) if elapsed else None,
+            "p50_ms": _ms(_pct(latencies, 50)),
+            "p99_ms": _ms(_pct(latencies, 99)),
+            "max_ms": _ms(max(latencies) if latencies else None),
+            "api_calls": dict(env.api.calls),
+        }
+
+
+async def bench_clean_chat(args, n: int) -> dict:
+    admin_id = 42
+    async with BenchEnv(args.latency_ms, args.jitter_ms, admin_ids=[admin_id]) as env:
+        ctx = env.context()
+        # Historial mixto: 2N mensajes de 20 usuarios, 10 % comandos y algunos del admin
+        for i in range(2 * n):
+            uid = admin_id if i % 17 == 0 else 1000 + (i % 20)
+            text = "/help" if i % 10 == 0 else f"mensaje {i}"
+            await env.app.update_queue.put(env.update(env.api.make_text_update(CHAT_ID, uid, text)))
+        await env.app.update_queue.join()
+        env.api.calls.clear()
+        start = time.perf_counter()
+        deleted, skipped, failed = await main._perform_clean(CHAT_ID, ctx, n)
+        elapsed = time.perf_counter() - start
+        calls = dict(env.api.calls)
+        return {
+            "n": n,
+            "deleted": deleted,
+            "skipped_pinned": skipped,
+            "failed": failed,
+            "seconds": round(elapsed, 4),
+            "api_calls_total": sum(calls.values()),
+            "api_calls": calls,
+        }
+
+
+async def bench_topic_clean(args) -> dict:
+    """Foro con el hilo General muy activo y un topic tranquilo: /clean_chat dentro del topic."""
+    general, quiet, topic = (200, 20, 77) if args.quick else (1000, 50, 77)
+    async with BenchEnv(args.latency_ms, args.jitter_ms) as env:
+        ctx = env.context()
+        for i in range(general):
+            await env.app.update_queue.put(env.update(env.api.make_text_update(CHAT_ID, 1000 + i % 20, f"general {i}")))
+            if i % (general // quiet) == 0:
+                msg = env.api.make_text_update(CHAT_ID, 2000 + i % 5, f"topic {i}", thread_id=topic)
+                await env.app.update_queue.put(env.update(msg))
+        await env.app.update_queue.join()
+        env.api.calls.clear()
+        general_ids = {m for m, msg in env.api.messages[CHAT_ID].items() if "message_thread_id" not in msg}
+        build = _time_per_op(lambda: main.cached_messages(env.app, CHAT_ID, topic), 200)
+        build_all = _time_per_op(lambda: main.cached_messages(env.app, CHAT_ID), 200)
+        start = time.perf_counter()
+        deleted, skipped, failed = await main._perform_clean(CHAT_ID, ctx, quiet, thread_id=topic)
+        elapsed = time.perf_counter() - start
+        calls = dict(env.api.calls)
+        return {
+            "general_messages": general,
+            "topic_messages": quiet,
+            "deleted": deleted,
+            "failed": failed,
+            "general_deleted": len(general_ids - set(env.api.messages[CHAT_ID])),
+            "candidates_scanned": len(main.cached_messages(env.app, CHAT_ID, topic)),
+            "candidates_whole_chat": len(main.cached_messages(env.app, CHAT_ID)),
+            "candidates_build_us": build,
+            "candidates_build_whole_chat_us": build_all,
+            "seconds": round(elapsed, 4),
+            "api_calls_total": sum(calls.values()),
+            "api_calls": calls,
+        }
+
+
+async def bench_message_cache(args) -> dict:
+    chats, per_chat = (20, 500) if args.quick else (100, 1000)
+    async with BenchEnv(0, 0) as env:
+        ctx = env.context()
+        # Calentar: crea las estructuras por chat y descarta costes fijos
+        for c in range(chats):
+            await main.cache_message(env.update(env.api.make_text_update(CHAT_ID - c, 1, "warmup")), ctx)
+        for c in range(chats):
+            main.chat_message_cache(env.app, CHAT_ID - c).clear()
+        main.SCHEDULED_AUTOCLEAN_CHATS.update(CHAT_ID - c for c in range(chats))
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(per_chat):
+            for c in range(chats):
+                msg = env.api.make_text_update(CHAT_ID - c, 1000 + (i % 50), f"m{i}")
+                env.api.messages[CHAT_ID - c].clear()
+                await main.cache_message(env.update(msg), ctx)
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        entries = sum(len(main.chat_message_cache(env.app, CHAT_ID - c)) for c in range(chats))
+        return {
+            "chats": chats,
+            "entries": entries,
+            "retained_bytes": after - before,
+            "bytes_per_message": round((after - before) / entries, 1) if entries else None,
+        }
+
+
+async def bench_startup_restore(args) -> dict:
+    total = 1_000 if args.quick else 10_000
+    chats = 100
+    async with BenchEnv(args.latency_ms, args.jitter_ms) as env:
+        now = int(time.time())
+        for c in range(chats):
+            chat_id = CHAT_ID - c
+            with main.pending_deletes_path_for_chat(chat_id).open("w", encoding="utf-8") as f:
+                for i in range(total // chats):
+                    rec = {"chat_id": chat_id, "message_id": i + 1, "thread_id": None,
+                           "delete_at": now + 3600 + i, "created_at": now}
+                    f.write(json.dumps(rec) + "\n")
+        bytes_before = sum(p.stat().st_size for p in env.data_dir.glob("pending_deletes_*.jsonl"))
+        start = time.perf_counter()
+        await main.post_init(env.app)
+        blocking = time.perf_counter() - start
+        await main.DEFERRED_STARTUP
+        elapsed = time.perf_counter() - start
+        bytes_after = sum(p.stat().st_size for p in env.data_dir.glob("pending_deletes_*.jsonl"))
+        jobs_cold = len(env.app.job_queue.jobs())
+
+        # Arranque en caliente: snapshot del apagado y post_init desde él con el estado vacío
+        saved_warm = main.SNAPSHOT_WARM_START
+        main.SNAPSHOT_WARM_START = True
+        try:
+            main.write_warm_snapshot()
+            snapshot_bytes = main.warm_snapshot_path().stat().st_size
+            env.app.job_queue.scheduler.remove_all_jobs()
+            _reset_bot_state()
+            start = time.perf_counter()
+            await main.post_init(env.app)
+            await main.DEFERRED_STARTUP
+            warm_elapsed = time.perf_counter() - start
+        finally:
+            main.SNAPSHOT_WARM_START = saved_warm
+        return {
+            "pending": total,
+            "post_init_seconds": round(blocking, 4),
+            "seconds": round(elapsed, 4),
+            "warm_seconds": round(warm_elapsed, 4),
+            "jobs_scheduled": jobs_cold,
+            "warm_jobs_scheduled": len(env.app.job_queue.jobs()),
+            "file_bytes_before": bytes_before,
+            "file_bytes_after": bytes_after,
+            "snapshot_bytes": snapshot_bytes,
+        }
+
+
+def _time_per_op(fn, repeat: int) -> float:
+    """Mejor de 5 rondas, en microsegundos por operación."""
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return round(best / repeat * 1e6, 2)
+
+
+def _codec_workloads(api: FakeBotAPI) -> Dict[str, tuple]:
+    """Cargas representativas: nombre -> (función, repeticiones). Usan main.json_* en cada llamada."""
+    updates = []
+    for i in range(100):
+        chat_id = CHAT_ID - (i % 10)
+        data = (
+            api.make_join_update(chat_id, [5000 + i], thread_id=12)
+            if i % 4 == 0
+            else api.make_text_update(chat_id, 1000 + i, f"mensaje {i} con acentos: ñandú", thread_id=12)
+        )
+        updates.append(dict(data, update_id=i + 1))
+    payload = json.dumps({"ok": True, "result": updates}).encode("utf-8")
+    record = {"chat_id": CHAT_ID, "message_id": 123456, "thread_id": 12, "delete_at": 1_760_000_000}
+    record_line = json.dumps(record)
+    chat_data = {
+        "message_cache": [(i, 12, 1_760_000_000 + i) for i in range(1000)],
+        "waiting": {5000 + i: [1_760_000_000, 12] for i in range(50)},
+        "welcome_text": "Bienvenido/a al grupo 👋",
+    }
+    blob = main._encode_chat_data(chat_data)
+    bot = Bot("123456:bench")
+
+    def decode_updates():
+        for u in main.InstrumentedRequest.parse_json_payload(payload)["result"]:
+            Update.de_json(u, bot)
+
+    return {
+        "getupdates_parse_100": (lambda: main.InstrumentedRequest.parse_json_payload(payload), 200),
+        "getupdates_parse_de_json_100": (decode_updates, 20),
+        "ipc_encode_update": (lambda: main.json_dumps(updates[1]), 5000),
+        "pending_record_encode": (lambda: main.json_dumps(record), 20000),
+        "pending_record_decode": (lambda: main.json_loads(record_line), 20000),
+        "chat_data_encode": (lambda: main._encode_chat_data(chat_data), 200),
+        "chat_data_decode": (lambda: main._decode_chat_data(blob), 200),
+    }
+
+
+async def bench_json_codec(args) -> dict:
+    """Antes/después del codec JSON en las rutas de updates y persistencia (µs por operación)."""
+    api = FakeBotAPI(seed=1)
+    scale = 0.2 if args.quick else 1.0
+    saved = main._orjson
+    results: Dict[str, dict] = {}
+    try:
+        main._orjson = None
+        for name, (fn, repeat) in _codec_workloads(api).items():
+            results[name] = {"json_us": _time_per_op(fn, max(1, int(repeat * scale)))}
+        main._orjson = saved
+        if saved is not None:
+            for name, (fn, repeat) in _codec_workloads(api).items():
+                r = results[name]
+                r["orjson_us"] = _time_per_op(fn, max(1, int(repeat * scale)))
+                r["speedup"] = round(r["json_us"] / r["orjson_us"], 2) if r["orjson_us"] else None
+    finally:
+        main._orjson = saved
+    return {"active": main.JSON_CODEC, "orjson_available": saved is not None, "workloads": results}
+
+
+# === Comparación entre ejecuciones ===
+def _comparable(results: dict) -> Dict[str, Tuple[float, bool]]:
+    """Métricas comparables: nombre -> (valor, mayor_es_mejor)."""
+    out: Dict[str, Tuple[float, bool]] = {}
+    for r in results.get("welcome_burst", []):
+        key = f"welcome_burst[{r['rate_per_s']:g}/s]"
+        for field, higher in (("p50_ms", False), ("p99_ms", False), ("throughput_per_s", True)):
+            if r.get(field) is not None:
+                out[f"{key}.{field}"] = (r[field], higher)
+    for r in results.get("clean_chat", []):
+        out[f"clean_chat[{r['n']}].seconds"] = (r["seconds"], False)
+        out[f"clean_chat[{r['n']}].api_calls_total"] = (r["api_calls_total"], False)
+    tc = results.get("topic_clean") or {}
+    if "seconds" in tc:
+        out["topic_clean.seconds"] = (tc["seconds"], False)
+        out["topic_clean.api_calls_total"] = (tc["api_calls_total"], False)
+    mc = results.get("message_cache") or {}
+    if mc.get("bytes_per_message") is not None:
+        out["message_cache.bytes_per_message"] = (mc["bytes_per_message"], False)
+    sr = results.get("startup_restore") or {}
+    if "seconds" in sr:
+        out["startup_restore.seconds"] = (sr["seconds"], False)
+    if "post_init_seconds" in sr:
+        out["startup_restore.post_init_seconds"] = (sr["post_init_seconds"], False)
+    if "warm_seconds" in sr:
+        out["startup_restore.warm_seconds"] = (sr["warm_seconds"], False)
+    active = (results.get("json_codec") or {}).get("active")
+    for name, r in ((results.get("json_codec") or {}).get("workloads") or {}).items():
+        if r.get(f"{active}_us") is not None:
+            out[f"json_codec.{name}.us"] = (r[f"{active}_us"], False)
+    return out
+
+
+def compare(previous: dict, current: dict, threshold: float) -> List[str]:
+    prev, cur = _comparable(previous.get("results", {})), _comparable(current.get("results", {}))
+    regressions = []
+    for name, (value, higher_better) in cur.items():
+        if name not in prev or not prev[name][0]:
+            continue
+        old = prev[name][0]
+        change = (value - old) / old
+        if (change < -threshold) if higher_better else (change > threshold):
+            regressions.append(f"{name}: {old:g} -> {value:g} ({change:+.0%})")
+    return regressions
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run(args) -> dict:
+    results: dict = {"welcome_burst": [], "clean_chat": []}
+    for rate in args.rates:
+        results["welcome_burst"].append(await bench_welcome_burst(args, rate))
+    for n in args.clean_sizes:
+        results["clean_chat"].append(await bench_clean_chat(args, n))
+    results["topic_clean"] = await bench_topic_clean(args)
+    results["message_cache"] = await bench_message_cache(args)
+    results["startup_restore"] = await bench_startup_restore(args)
+    results["json_codec"] = await bench_json_codec(args)
+    return results
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks del welcome bot")
+    parser.add_argument("--quick", action="store_true", help="duraciones y tamaños reducidos")
+    parser.add_argument("--duration", type=float, default=None, help="segundos por ráfaga de uniones")
+    parser.add_argument("--rates", type=float, nargs="+", default=[1, 10, 100], help="uniones por segundo")
+    parser.add_argument("--clean-sizes", type=int, nargs="+", default=[50, 200, 1000], help="valores de N")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="latencia simulada de la Bot API")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("-o", "--output", help="archivo JSON de salida (por defecto stdout)")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior para detectar regresiones")
+    parser.add_argument("--threshold", type=float, default=0.2, help="tolerancia relativa (0.2 = 20%%)")
+    args = parser.parse_args()
+    if args.duration is None:
+        args.duration = 3.0 if args.quick else 10.0
+    if args.quick and args.clean_sizes == [50, 200, 1000]:
+        args.clean_sizes = [50, 200]
+
+    logging.basicConfig(level=logging.ERROR)
+    loop_name = main.install_event_loop_policy()
+    report = {
+        "schema": SCHEMA_VERSION,
+        "meta": {
+            "git_commit": _git_commit(),
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "runtime": main.runtime_description(loop_name),
+        },
+        "config": {
+            "quick": args.quick,
+            "duration_s": args.duration,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+        },
+        "results": asyncio.run(run(args)),
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), report, args.threshold)
+        for line in regressions:
+            print(f"REGRESIÓN {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# tools/fake_bot_api.py
+# Servidor local que imita la Bot API de Telegram para pruebas de carga offline.
+#
+# Uso:
+#   python tools/fake_bot_api.py --port 8081 --latency-ms 50 --jitter-ms 20 --rate-429 0.01
+#   BOT_API_BASE_URL=http://127.0.0.1:8081/bot BOT_TOKEN=123:fake python main.py
+#
+# Inyectar tráfico (endpoints de control, fuera de /bot<token>/):
+#   curl -X POST 127.0.0.1:8081/_control/join -d '{"chat_id": -100123, "count": 3}'
+#   curl -X POST 127.0.0.1:8081/_control/message -d '{"chat_id": -100123, "user_id": 5, "text": "hola"}'
+#   curl -X POST 127.0.0.1:8081/_control/update -d '{"message": {...}}'
+#   curl -X POST 127.0.0.1:8081/_control/config -d '{"latency_ms": 200, "rate_429": 0.05}'
+#   curl 127.0.0.1:8081/_control/stats
+#
+# Varios bots (modo multi-bot de main.py): --tokens A,B crea una API independiente por token
+# (bot_id 123457, 123458...); el resto de tokens usa la API por defecto. Control de uno concreto:
+#   curl -X POST 127.0.0.1:8081/_control/A/join -d '{"chat_id": -100123}'
+#
+# Implementa: getMe, getUpdates, sendMessage, editMessageText, deleteMessage,
+# deleteMessages, getChatMember, getChatAdministrators, getChat, setMyCommands,
+# getMyCommands, deleteWebhook. Sólo depende de la biblioteca estándar.
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict, deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl
+
+# Parámetros de texto que nunca se decodifican como JSON
+_RAW_STRING_PARAMS = {"text", "caption", "parse_mode", "command", "description", "title"}
+# Métodos a los que nunca se inyectan 429 (plano de control de PTB)
+_NO_FLOOD_METHODS = {"getMe", "getUpdates", "deleteWebhook", "close", "logOut"}
+
+
+class FakeBotAPI:
+    """Estado y lógica de la Bot API falsa; usable también como biblioteca desde benchmarks."""
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        rate_429: float = 0.0,
+        retry_after: int = 1,
+        admin_ids: Iterable[int] = (),
+        bot_id: int = 123456,
+        bot_username: str = "qvc_fake_bot",
+        seed: Optional[int] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.admin_ids: Set[int] = set(admin_ids)
+        self.all_admins = False  # todos los usuarios son administradores (replay de grabaciones)
+        self.bot_id = bot_id
+        self.bot_username = bot_username
+        self.rng = random.Random(seed)
+
+        # IDs de mensaje secuenciales por chat y mensajes "vivos"
+        self._next_message_id: Dict[int, int] = defaultdict(lambda: 1)
+        self.messages: Dict[int, Dict[int, dict]] = defaultdict(dict)
+        self.pinned: Dict[int, int] = {}
+        self.commands: List[dict] = []
+
+        self._updates: Deque[dict] = deque()
+        self._next_update_id = 1
+        self._updates_cond: Optional[asyncio.Condition] = None
+
+        self.calls: Counter = Counter()
+        self.flooded: Counter = Counter()
+        self.started_at = time.time()
+        # Gancho opcional on_call(method, params, status, payload) tras cada llamada (benchmarks)
+        self.on_call: Optional[Callable[[str, dict, int, dict], None]] = None
+
+    # --- Helpers de objetos Telegram ---
+    def _user(self, user_id: int, is_bot: bool = False) -> dict:
+        if user_id == self.bot_id:
+            return {"id": self.bot_id, "is_bot": True, "first_name": "QvaClick", "username": self.bot_username}
+        return {"id": user_id, "is_bot": is_bot, "first_name": f"user{user_id}"}
+
+    @staticmethod
+    def _chat(chat_id: int) -> dict:
+        if chat_id > 0:
+            return {"id": chat_id, "type": "private", "first_name": f"user{chat_id}"}
+        return {"id": chat_id, "type": "supergroup", "title": f"chat{chat_id}"}
+
+    def _new_message(self, chat_id: int, from_id: int, thread_id: Optional[int] = None, **fields) -> dict:
+        mid = self._next_message_id[chat_id]
+        self._next_message_id[chat_id] = mid + 1
+        msg = {
+            "message_id": mid,
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": self._user(from_id),
+        }
+        if thread_id is not None:
+            msg["message_thread_id"] = thread_id
+            msg["is_topic_message"] = True
+        msg.update(fields)
+        self.messages[chat_id][mid] = msg
+        return msg
+
+    def _member(self, chat_id: int, user_id: int) -> dict:
+        user = self._user(user_id)
+        if user_id == self.bot_id or user_id in self.admin_ids or self.all_admins:
+            return {
+                "status": "administrator",
+                "user": user,
+                "can_be_edited": False,
+                "is_anonymous": False,
+                "can_manage_chat": True,
+                "can_delete_messages": True,
+                "can_manage_video_chats": True,
+                "can_restrict_members": True,
+                "can_promote_members": False,
+                "can_change_info": True,
+                "can_invite_users": True,
+                "can_post_stories": False,
+                "can_edit_stories": False,
+                "can_delete_stories": False,
+                "can_pin_messages": True,
+            }
+        return {"status": "member", "user": user}
+
+    # --- Inyección de tráfico ---
+    def _cond(self) -> asyncio.Condition:
+        if self._updates_cond is None:
+            self._updates_cond = asyncio.Condition()
+        return self._updates_cond
+
+    async def inject_update(self, update: dict) -> dict:
+        update = dict(update)
+        update["update_id"] = self._next_update_id
+        self._next_update_id += 1
+        self._updates.append(update)
+        cond = self._cond()
+        async with cond:
+            cond.notify_all()
+        return update
+
+    def make_join_update(self, chat_id: int, user_ids: Iterable[int], thread_id: Optional[int] = None) -> dict:
+        members = [self._user(uid) for uid in user_ids]
+        first = members[0]["id"] if members else self.bot_id
+        msg = self._new_message(chat_id, first, thread_id, new_chat_members=members)
+        return {"message": msg}
+
+    def make_text_update(self, chat_id: int, user_id: int, text: str, thread_id: Optional[int] = None) -> dict:
+        fields: dict = {"text": text}
+        if text.startswith("/"):
+            command = text.split()[0]
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        msg = self._new_message(chat_id, user_id, thread_id, **fields)
+        return {"message": msg}
+
+    # --- Bot API ---
+    @staticmethod
+    def _ok(result) -> Tuple[int, dict]:
+        return 200, {"ok": True, "result": result}
+
+    @staticmethod
+    def _error(code: int, description: str) -> Tuple[int, dict]:
+        return code, {"ok": False, "error_code": code, "description": description}
+
+    async def handle(self, method: str, params: dict) -> Tuple[int, dict]:
+        self.calls[method] += 1
+        if method != "getUpdates" and (self.latency_ms or self.jitter_ms):
+            delay = self.latency_ms + self.rng.uniform(0, self.jitter_ms)
+            await asyncio.sleep(delay / 1000.0)
+        if method not in _NO_FLOOD_METHODS and self.rate_429 and self.rng.random() < self.rate_429:
+            self.flooded[method] += 1
+            code, payload = self._error(429, f"Too Many Requests: retry after {self.retry_after}")
+            payload["parameters"] = {"retry_after": self.retry_after}
+            return code, payload
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return self._error(404, "Not Found")
+        try:
+            status, payload = await handler(params)
+        except (KeyError, TypeError, ValueError) as e:
+            status, payload = self._error(400, f"Bad Request: {e}")
+        if self.on_call is not None:
+            self.on_call(method, params, status, payload)
+        return status, payload
+
+    async def api_getMe(self, params: dict):
+        user = self._user(self.bot_id)
+        user.update({"can_join_groups": True, "can_read_all_group_messages": True, "supports_inline_queries": False})
+        return self._ok(user)
+
+    async def api_deleteWebhook(self, params: dict):
+        return self._ok(True)
+
+    async def api_getUpdates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates and timeout > 0:
+            cond = self._cond()
+            try:
+                async with cond:
+                    await asyncio.wait_for(cond.wait_for(lambda: bool(self._updates)), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._ok(list(self._updates)[:limit])
+
+    async def api_sendMessage(self, params: dict):
+        chat_id = int(params["chat_id"])
+        thread_id = params.get("message_thread_id")
+        msg = self._new_message(
+            chat_id, self.bot_id, int(thread_id) if thread_id is not None else None, text=str(params["text"])
+        )
+        if params.get("reply_markup"):
+            msg["reply_markup"] = params["reply_markup"]
+        return self._ok(msg)
+
+    async def api_editMessageText(self, params: dict):
+        chat_id = int(params["chat_id"])
+        msg = self.messages.get(chat_id, {}).get(int(params["message_id"]))
+        if msg is None:
+            return self._error(400, "Bad Request: message to edit not found")
+        if msg.get("text") == params["text"]:
+            return self._error(400, "Bad Request: message is not modified")
+        msg["text"] = str(params["text"])
+        msg["edit_date"] = int(time.time())
+        return self._ok(msg)
+
+    async def api_deleteMessage(self, params: dict):
+        chat_id = int(params["chat_id"])
+        if self.messages.get(chat_id, {}).pop(int(params["message_id"]), None) is None:
+            return self._error(400, "Bad Request: message to delete not found")
+        return self._ok(True)
+
+    async def api_deleteMessages(self, params: dict):
+        chat_id = int(params["chat_id"])
+        ids = params["message_ids"]
+        if not isinstance(ids, list) or not 1 <= len(ids) <= 100:
+            return self._error(400, "Bad Request: message_ids must contain 1-100 items")
+        chat_msgs = self.messages.get(chat_id, {})
+        for mid in ids:
+            chat_msgs.pop(int(mid), None)
+        return self._ok(True)
+
+    async def api_getChatMember(self, params: dict):
+        return self._ok(self._member(int(params["chat_id"]), int(params["user_id"])))
+
+    async def api_getChatAdministrators(self, params: dict):
+        chat_id = int(params["chat_id"])
+        return self._ok([self._member(chat_id, uid) for uid in [self.bot_id, *sorted(self.admin_ids)]])
+
+    async def api_getChat(self, params: dict):
+        chat_id = int(params["chat_id"])
+        chat = self._chat(chat_id)
+        chat.update(
+            {
+                "accent_color_id": 0,
+                "max_reaction_count": 11,
+                "accepted_gift_types": {
+                    "unlimited_gifts": False,
+                    "limited_gifts": False,
+                    "unique_gifts": False,
+                    "premium_subscription": False,
+                },
+            }
+        )
+        pinned = self.messages.get(chat_id, {}).get(self.pinned.get(chat_id, 0))
+        if pinned is not None:
+            chat["pinned_message"] = pinned
+        return self._ok(chat)
+
+    async def api_setMyCommands(self, params: dict):
+        self.commands = list(params.get("commands") or [])
+        return self._ok(True)
+
+    async def api_getMyCommands(self, params: dict):
+        return self._ok(self.commands)
+
+    # --- Control ---
+    async def control(self, action: str, body: dict) -> Tuple[int, dict]:
+        if action == "stats":
+            return 200, {
+                "uptime_s": round(time.time() - self.started_at, 1),
+                "calls": dict(self.calls),
+                "flooded": dict(self.flooded),
+                "pending_updates": len(self._updates),
+                "live_messages": {str(c): len(m) for c, m in self.messages.items()},
+            }
+        if action == "config":
+            for key in ("latency_ms", "jitter_ms", "rate_429", "retry_after"):
+                if key in body:
+                    setattr(self, key, type(getattr(self, key))(body[key]))
+            if "admin_ids" in body:
+                self.admin_ids = {int(x) for x in body["admin_ids"]}
+            return 200, {"ok": True}
+        if action == "update":
+            return 200, await self.inject_update(body)
+        if action == "join":
+            chat_id = int(body["chat_id"])
+            user_ids = body.get("user_ids") or [
+                self.rng.randint(10**8, 10**9) for _ in range(int(body.get("count", 1)))
+            ]
+            return 200, await self.inject_update(self.make_join_update(chat_id, user_ids, body.get("thread_id")))
+        if action == "message":
+            update = self.make_text_update(
+                int(body["chat_id"]), int(body.get("user_id", 1)), str(body.get("text", "")), body.get("thread_id")
+            )
+            return 200, await self.inject_update(update)
+        if action == "pin":
+            self.pinned[int(body["chat_id"])] = int(body["message_id"])
+            return 200, {"ok": True}
+        return 404, {"ok": False, "description": "unknown control action"}
+
+
+# === Servidor HTTP mínimo (keep-alive) ===
+def _parse_params(body: bytes, content_type: str) -> dict:
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        data = json.loads(body)
+        return data if isinstance(data, dict) else {}
+    params: dict = {}
+    for key, value in parse_qsl(body.decode("utf-8"), keep_blank_values=True):
+        if key in _RAW_STRING_PARAMS:
+            params[key] = value
+            continue
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+async def _serve_connection(
+    api: FakeBotAPI,
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    bots: Optional[Dict[str, FakeBotAPI]] = None,
+) -> None:
+    bots = bots or {}
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers: Dict[str, str] = {}
+            while True:
+                line = await reader.readline()
+                if not line or line in (b"\r\n", b"\n"):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", "0") or 0)
+            body = await reader.readexactly(length) if length else b""
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?", 1)[0] if len(parts) >= 2 else "/"
+            segments = [s for s in path.split("/") if s]
+            try:
+                if segments[:1] == ["_control"] and len(segments) == 2:
+                    # El plano de control siempre recibe JSON (curl -d envía otro content-type)
+                    status, payload = await api.control(segments[1], json.loads(body) if body.strip() else {})
+                elif segments[:1] == ["_control"] and len(segments) == 3 and segments[1] in bots:
+                    status, payload = await bots[segments[1]].control(
+                        segments[2], json.loads(body) if body.strip() else {}
+                    )
+                elif len(segments) == 2 and segments[0].startswith("bot"):
+                    params = _parse_params(body, headers.get("content-type", ""))
+                    target = bots.get(segments[0][3:], api)
+                    status, payload = await target.handle(segments[1], params)
+                else:
+                    status, payload = 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+            except Exception as e:
+                status, payload = 500, {"ok": False, "error_code": 500, "description": repr(e)}
+            data = json.dumps(payload).encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status} X\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode(
+                    "latin-1"
+                )
+                + data
+            )
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(
+    api: FakeBotAPI, host: str = "127.0.0.1", port: int = 8081, bots: Optional[Dict[str, FakeBotAPI]] = None
+) -> asyncio.AbstractServer:
+    """`bots`: API propia por token; los demás tokens usan `api`."""
+    return await asyncio.start_server(lambda r, w: _serve_connection(api, r, w, bots), host, port)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bot API falsa para pruebas de carga offline")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latencia fija por llamada")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="latencia aleatoria adicional (uniforme)")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="probabilidad de responder 429 (0..1)")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after de las respuestas 429")
+    parser.add_argument("--admin-ids", default="", help="IDs de usuario que serán administradores (coma)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--tokens", default="", help="tokens con API propia, uno por bot (coma)")
+    args = parser.parse_args()
+
+    def make_api(index: int = 0) -> FakeBotAPI:
+        return FakeBotAPI(
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            rate_429=args.rate_429,
+            retry_after=args.retry_after,
+            admin_ids=[int(x) for x in args.admin_ids.replace(" ", ",").split(",") if x.strip()],
+            seed=args.seed,
+            bot_id=123456 + index,
+            bot_username=f"qvc_fake_bot{index or ''}",
+        )
+
+    api = make_api()
+    tokens = [t.strip() for t in args.tokens.split(",") if t.strip()]
+    bots = {token: make_api(i) for i, token in enumerate(tokens, 1)}
+
+    async def _run():
+        server = await start_server(api, args.host, args.port, bots)
+        print(f"Bot API falsa en http://{args.host}:{args.port}/bot<token>/ (control: /_control/...)")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(_run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
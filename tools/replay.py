@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# tools/replay.py
+# Reproduce una grabación de RECORD_UPDATES_DIR contra la Application real y la
+# Bot API falsa (tools/fake_bot_api.py), e informa tiempos por tipo de update y por handler.
+#
+# Uso:
+#   python tools/replay.py recordings/                  # velocidad real (1x)
+#   python tools/replay.py recordings/ --speed 20       # 20 veces más rápido
+#   python tools/replay.py seg.jsonl.gz --speed 0 -o replay.json   # sin esperas
+
+import argparse
+import asyncio
+import functools
+import gzip
+import json
+import logging
+import sys
+import time
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench import BenchEnv, _git_commit, _ms, _pct  # noqa: E402
+from telegram import Update  # noqa: E402
+
+# Campos de servicio que marcan el tipo de un mensaje
+_SERVICE_FIELDS = (
+    "new_chat_members", "left_chat_member", "pinned_message", "new_chat_title", "new_chat_photo",
+    "delete_chat_photo", "forum_topic_created", "forum_topic_closed", "forum_topic_reopened",
+    "forum_topic_edited", "video_chat_started", "video_chat_ended", "message_auto_delete_timer_changed",
+)
+_MEDIA_FIELDS = ("photo", "video", "animation", "document", "sticker", "voice", "audio", "video_note", "poll")
+
+
+def iter_recording(paths: List[Path]) -> Iterator[Tuple[float, dict]]:
+    files: List[Path] = []
+    for p in paths:
+        files.extend(sorted(p.glob("updates-*.jsonl.gz")) if p.is_dir() else [p])
+    for f in files:
+        try:
+            with gzip.open(f, "rt", encoding="utf-8") as fh:
+                for line in fh:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    yield float(rec["ts"]), rec["update"]
+        except (EOFError, OSError, zlib.error):
+            # Segmento en curso o truncado por un reinicio: se usa lo legible
+            continue
+
+
+def update_kind(data: dict) -> str:
+    """Clasifica un update serializado (p. ej. 'message:command', 'message:service:new_chat_members')."""
+    for top in ("message", "edited_message", "channel_post", "callback_query", "chat_member", "my_chat_member"):
+        if top in data:
+            break
+    else:
+        return "other"
+    msg = data[top]
+    if top not in ("message", "edited_message", "channel_post"):
+        return top
+    for field in _SERVICE_FIELDS:
+        if msg.get(field):
+            return f"{top}:service:{field}"
+    raw = msg.get("text") or msg.get("caption") or ""
+    topic = ":topic" if msg.get("is_topic_message") else ""
+    if raw.startswith("/"):
+        return f"{top}:command{topic}"
+    if msg.get("caption") is not None:
+        return f"{top}:caption{topic}"
+    for field in _MEDIA_FIELDS:
+        if field in msg:
+            return f"{top}:{field}{topic}"
+    return f"{top}:text{topic}" if "text" in msg else f"{top}:other{topic}"
+
+
+def _summary(samples: List[float]) -> dict:
+    return {
+        "count": len(samples),
+        "mean_ms": _ms(sum(samples) / len(samples)) if samples else None,
+        "p50_ms": _ms(_pct(samples, 50)),
+        "p99_ms": _ms(_pct(samples, 99)),
+        "max_ms": _ms(max(samples) if samples else None),
+    }
+
+
+def _instrument_handlers(app, timings: Dict[str, Dict[str, List[float]]], current: dict) -> None:
+    """Envuelve el callback de cada handler registrado para medirlo por tipo de update."""
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            original = handler.callback
+            name = getattr(original, "__name__", repr(original))
+
+            @functools.wraps(original)
+            async def timed(update, context, _original=original, _name=name):
+                start = time.perf_counter()
+                try:
+                    return await _original(update, context)
+                finally:
+                    timings[_name][current["kind"]].append(time.perf_counter() - start)
+
+            handler.callback = timed
+
+
+def _seed_fake(api, data: dict) -> None:
+    # Los mensajes grabados "existen" en la API falsa para que los borrados tengan éxito
+    for top in ("message", "edited_message", "channel_post"):
+        msg = data.get(top)
+        if not msg:
+            continue
+        chat_id, mid = msg["chat"]["id"], msg["message_id"]
+        api.messages[chat_id][mid] = msg
+        api._next_message_id[chat_id] = max(api._next_message_id[chat_id], mid + 1)
+
+
+async def replay(args) -> dict:
+    records = list(iter_recording([Path(p) for p in args.paths]))
+    if args.limit:
+        records = records[: args.limit]
+    async with BenchEnv(args.latency_ms, args.jitter_ms) as env:
+        env.api.all_admins = args.admins_all
+        by_type: Dict[str, List[float]] = defaultdict(list)
+        by_handler: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+        current = {"kind": "other"}
+        _instrument_handlers(env.app, by_handler, current)
+
+        start_wall = time.perf_counter()
+        first_ts = records[0][0] if records else 0.0
+        lag: List[float] = []
+        for ts, data in records:
+            if args.speed > 0:
+                target = start_wall + (ts - first_ts) / args.speed
+                delay = target - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    lag.append(-delay)
+            _seed_fake(env.api, data)
+            update = Update.de_json(data, env.app.bot)
+            current["kind"] = update_kind(data)
+            t0 = time.perf_counter()
+            await env.app.process_update(update)
+            by_type[current["kind"]].append(time.perf_counter() - t0)
+        wall = time.perf_counter() - start_wall
+        return {
+            "schema": 1,
+            "meta": {"git_commit": _git_commit(), "timestamp": int(time.time())},
+            "config": {"speed": args.speed, "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms},
+            "updates": len(records),
+            "recorded_span_s": round(records[-1][0] - first_ts, 3) if records else 0.0,
+            "wall_seconds": round(wall, 3),
+            "behind_schedule": _summary(lag),
+            "by_type": {k: _summary(v) for k, v in sorted(by_type.items())},
+            "by_handler": {
+                h: {k: _summary(v) for k, v in sorted(kinds.items())} for h, kinds in sorted(by_handler.items())
+            },
+            "api_calls": dict(env.api.calls),
+        }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Replay de updates grabados contra la Bot API falsa")
+    parser.add_argument("paths", nargs="+", help="segmentos .jsonl.gz o directorios de grabación")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = tiempo real, N = N veces más rápido, 0 = sin esperas")
+    parser.add_argument("--limit", type=int, default=0, help="máximo de updates a reproducir")
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--admins-all", action="store_true", help="la API falsa trata a todos como admins")
+    parser.add_argument("-o", "--output", help="archivo JSON de salida (por defecto stdout)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    text = json.dumps(asyncio.run(replay(args)), indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# tools/simulate.py
+# Simulación determinista, en tiempo virtual, de los borrados programados:
+# _schedule_delete_with_persistence, delete_welcome_job y la restauración de post_init
+# (restore_pending_deletes) contra un bot falso en memoria. El bucle de eventos salta al
+# siguiente timer cuando no hay nada listo, así que horas de TTL se recorren en segundos
+# y dos ejecuciones con la misma semilla dan el mismo resultado.
+#
+# Uso:
+#   python tools/simulate.py                                   # 100k borrados, TTL 3 h, reinicio al pico
+#   python tools/simulate.py --pending 20000 --ttl 600 --downtime 300
+#   python tools/simulate.py --fail-rate 0.01 --rate-429 0.001 --outage-at 5000 --outage-seconds 120 -o sim.json
+#
+# Informa:
+#   scheduler  — timers pendientes, memoria por borrado pendiente y por trabajo de la JobQueue real
+#   drift      — disparo del timer frente al delete_at persistido
+#   lateness   — borrado efectivo frente al delete_at (cola del ejecutor, reintentos, caída)
+#   files      — tamaño de pending_deletes_*.jsonl a lo largo de la simulación y en el reinicio
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import selectors
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "tools"))
+
+import main  # noqa: E402
+from bench import _git_commit, _ms, _pct  # noqa: E402
+from telegram.error import BadRequest, NetworkError, RetryAfter  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+SCHEMA_VERSION = 1
+CHAT_ID = -1001000000001
+EPOCH = 1_700_000_000.0
+
+
+# === Tiempo virtual ===
+class _VirtualSelector(selectors.DefaultSelector):
+    """Selector que, en vez de bloquear hasta el siguiente timer, adelanta el reloj virtual."""
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # Sin timers: sólo puede despertarnos un hilo (p. ej. asyncio.to_thread)
+            return super().select(None)
+        self.now += timeout
+        return []
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        self._virtual = _VirtualSelector()
+        super().__init__(self._virtual)
+
+    def time(self) -> float:
+        return self._virtual.now
+
+
+class VirtualClock(main.Clock):
+    def __init__(self, loop: VirtualTimeLoop, epoch: float = EPOCH):
+        self.loop = loop
+        self.epoch = epoch
+
+    def time(self) -> float:
+        return self.epoch + self.loop.time()
+
+    def monotonic(self) -> float:
+        return self.loop.time()
+
+
+# === Planificador y bot falsos ===
+class SimJob:
+    __slots__ = ("callback", "data", "name", "due", "handle")
+
+    def __init__(self, callback, data, name: str, due: float):
+        self.callback = callback
+        self.data = data
+        self.name = name
+        self.due = due
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+
+class SimContext:
+    def __init__(self, app: "SimApp", job: Optional[SimJob] = None):
+        self.application = app
+        self.bot = app.bot
+        self.job_queue = app.job_queue
+        self.job = job
+
+
+class VirtualJobQueue:
+    """Lo que main usa de telegram.ext.JobQueue (run_once), sobre timers del bucle virtual."""
+
+    def __init__(self, app: "SimApp"):
+        self.app = app
+        self.pending: Set[SimJob] = set()
+        self.tasks: Set[asyncio.Task] = set()
+        self.peak = 0
+        self.fired = 0
+        self.drift: List[float] = []
+        self._first_fire: Set[Tuple[int, int]] = set()
+
+    def run_once(self, callback, when, data=None, name=None, **_kwargs) -> SimJob:
+        loop = asyncio.get_running_loop()
+        job = SimJob(callback, data, name or callback.__name__, loop.time() + float(when))
+        job.handle = loop.call_at(job.due, self._fire, job)
+        self.pending.add(job)
+        self.peak = max(self.peak, len(self.pending))
+        return job
+
+    def _fire(self, job: SimJob) -> None:
+        self.pending.discard(job)
+        self.fired += 1
+        data = job.data or {}
+        key = (data.get("chat_id"), data.get("message_id"))
+        entry = main.PENDING_DELETES.get(key[0], {}).get(key[1])
+        # La deriva se mide en el primer disparo; los reintentos aplazados no cuentan
+        if entry is not None and key not in self._first_fire:
+            self._first_fire.add(key)
+            self.drift.append(main.CLOCK.time() - entry[0])
+        task = asyncio.ensure_future(job.callback(SimContext(self.app, job)))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def crash(self) -> None:
+        """Simula la muerte del proceso: se pierden todos los timers y tareas en curso."""
+        for job in self.pending:
+            job.handle.cancel()
+        for task in self.tasks:
+            task.cancel()
+        self.pending.clear()
+        self.tasks.clear()
+
+
+class SimBot:
+    """deleteMessage con latencia, fallos de red, 429 y una ventana de caída, todo con semilla."""
+
+    def __init__(self, args):
+        self.rng = random.Random(args.seed)
+        self.latency = args.latency_ms / 1000.0
+        self.jitter = args.jitter_ms / 1000.0
+        self.fail_rate = args.fail_rate
+        self.rate_429 = args.rate_429
+        self.outage = (args.outage_at, args.outage_at + args.outage_seconds) if args.outage_seconds else None
+        self.deleted: Dict[Tuple[int, int], float] = {}
+        self.calls: Counter = Counter()
+
+    async def delete_message(self, chat_id: int, message_id: int) -> bool:
+        self.calls["deleteMessage"] += 1
+        await asyncio.sleep(max(0.0, self.rng.gauss(self.latency, self.jitter)))
+        now = asyncio.get_running_loop().time()
+        if self.outage and self.outage[0] <= now < self.outage[1]:
+            self.calls["network_error"] += 1
+            raise NetworkError("simulated outage")
+        r = self.rng.random()
+        if r < self.rate_429:
+            self.calls["retry_after"] += 1
+            raise RetryAfter(1)
+        if r < self.rate_429 + self.fail_rate:
+            self.calls["network_error"] += 1
+            raise NetworkError("simulated network error")
+        key = (chat_id, message_id)
+        if key in self.deleted:
+            self.calls["not_found"] += 1
+            raise BadRequest("Message to delete not found")
+        self.deleted[key] = main.CLOCK.time()
+        return True
+
+
+class SimApp:
+    def __init__(self, bot: SimBot):
+        self.bot = bot
+        self.job_queue = VirtualJobQueue(self)
+
+    def create_task(self, coro):
+        return asyncio.ensure_future(coro)
+
+
+# === Medidas ===
+def _summary(samples: List[float]) -> dict:
+    return {
+        "count": len(samples),
+        "p50_ms": _ms(_pct(samples, 50)),
+        "p99_ms": _ms(_pct(samples, 99)),
+        "max_ms": _ms(max(samples) if samples else None),
+        "min_ms": _ms(min(samples) if samples else None),
+    }
+
+
+def _file_bytes() -> int:
+    return sum(p.stat().st_size for p in main.DATA_DIR.glob("pending_deletes_*.jsonl"))
+
+
+def _pending_total() -> int:
+    return main._pending_count
+
+
+async def jobqueue_bytes_per_job(n: int) -> Optional[float]:
+    """Memoria de n borrados en la JobQueue real de PTB (APScheduler), en tiempo real."""
+    app = Application.builder().token("123456:sim").build()
+    jq = app.job_queue
+    if jq is None:
+        return None
+    await jq.start()
+    try:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(n):
+            jq.run_once(
+                main.delete_welcome_job,
+                when=3600 + i,
+                data={"chat_id": CHAT_ID, "message_id": i + 1, "thread_id": None, "persist": True},
+                name=f"del_persist_{CHAT_ID}_{i + 1}",
+            )
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return round((after - before) / n, 1)
+    finally:
+        jq.scheduler.remove_all_jobs()
+        await jq.stop()
+
+
+# === Simulación ===
+async def simulate(args) -> dict:
+    loop = asyncio.get_running_loop()
+    bot = SimBot(args)
+    app = SimApp(bot)
+    queue = app.job_queue
+    rng = random.Random(args.seed + 1)
+    state = {"down": False}
+    scheduled: Dict[Tuple[int, int], float] = {}
+    samples: List[dict] = []
+    restart: dict = {}
+    mem = {"baseline": 0, "at_peak": 0, "pending_at_peak": 0}
+
+    if args.tracemalloc:
+        tracemalloc.start()
+        mem["baseline"] = tracemalloc.get_traced_memory()[0]
+
+    async def produce() -> None:
+        rate = args.pending / args.arrival_seconds
+        next_mid: Counter = Counter()
+        for _ in range(args.pending):
+            await asyncio.sleep(rng.expovariate(rate))
+            if state["down"]:
+                continue
+            chat_id = CHAT_ID - rng.randrange(args.chats)
+            next_mid[chat_id] += 1
+            mid = next_mid[chat_id]
+            main._schedule_delete_with_persistence(SimContext(app), chat_id, mid, args.ttl)
+            scheduled[(chat_id, mid)] = main.PENDING_DELETES[chat_id][mid][0]
+
+    async def sample() -> None:
+        while True:
+            pending = _pending_total()
+            row = {"t": round(loop.time(), 1), "pending": pending, "timers": len(queue.pending), "file_bytes": _file_bytes()}
+            if args.tracemalloc:
+                current = tracemalloc.get_traced_memory()[0]
+                row["traced_mb"] = round(current / 1e6, 2)
+                if pending > mem["pending_at_peak"]:
+                    mem["at_peak"], mem["pending_at_peak"] = current, pending
+            samples.append(row)
+            await asyncio.sleep(args.sample_every)
+
+    async def crash_and_restore() -> None:
+        await asyncio.sleep(args.restart_at)
+        restart["t"] = round(loop.time(), 1)
+        restart["pending_before"] = _pending_total()
+        restart["file_bytes_before"] = _file_bytes()
+        queue.crash()
+        main.reset_pending_index()
+        main.DELETE_EXECUTOR = main.DeleteExecutor(main.DELETE_TARGET_RATE, main.DELETE_MAX_CONCURRENCY)
+        state["down"] = True
+        await asyncio.sleep(args.downtime)
+        state["down"] = False
+        start = time.perf_counter()
+        restart["restored"] = main.restore_pending_deletes(app)
+        restart["restore_wall_seconds"] = round(time.perf_counter() - start, 4)
+        restart["file_bytes_after"] = _file_bytes()
+
+    wall_start = time.perf_counter()
+    sampler = asyncio.ensure_future(sample())
+    restarter = asyncio.ensure_future(crash_and_restore()) if args.restart_at >= 0 else None
+    await produce()
+    if restarter is not None:
+        await restarter
+    horizon = loop.time() + args.ttl + args.drain_seconds
+    while (queue.pending or queue.tasks) and loop.time() < horizon:
+        await asyncio.sleep(args.sample_every)
+    sampler.cancel()
+    wall = time.perf_counter() - wall_start
+    virtual = loop.time()
+    if args.tracemalloc:
+        tracemalloc.stop()
+
+    lateness = [bot.deleted[k] - at for k, at in scheduled.items() if k in bot.deleted]
+    peak = max(samples, key=lambda r: r["file_bytes"]) if samples else {}
+    return {
+        "virtual_seconds": round(virtual, 1),
+        "wall_seconds": round(wall, 3),
+        "speedup": round(virtual / wall, 1) if wall else None,
+        "scheduled": len(scheduled),
+        "deleted": sum(1 for k in scheduled if k in bot.deleted),
+        "lost": sum(1 for k in scheduled if k not in bot.deleted),
+        "scheduler": {
+            "peak_timers": queue.peak,
+            "timers_fired": queue.fired,
+            "timers_left": len(queue.pending),
+            "bytes_per_pending": (
+                round((mem["at_peak"] - mem["baseline"]) / mem["pending_at_peak"], 1) if mem["pending_at_peak"] else None
+            ),
+        },
+        "drift": _summary(queue.drift),
+        "lateness": _summary(lateness),
+        "files": {
+            "peak_bytes": peak.get("file_bytes", 0),
+            "peak_bytes_per_pending": round(peak["file_bytes"] / peak["pending"], 1) if peak.get("pending") else None,
+            "final_bytes": _file_bytes(),
+            "records_left": _pending_total(),
+        },
+        "restart": restart,
+        "api_calls": dict(bot.calls),
+        "series": samples if args.series else None,
+    }
+
+
+def run(args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="qvc-sim-") as tmp:
+        saved_dir, saved_clock, saved_executor = main.DATA_DIR, main.CLOCK, main.DELETE_EXECUTOR
+        main.DATA_DIR = Path(tmp)
+        random.seed(args.seed)  # backoff_delay usa el módulo random
+        loop = VirtualTimeLoop()
+        asyncio.set_event_loop(loop)
+        main.CLOCK = VirtualClock(loop)
+        main.DELETE_EXECUTOR = main.DeleteExecutor(main.DELETE_TARGET_RATE, main.DELETE_MAX_CONCURRENCY)
+        main.API_CIRCUIT = main.CircuitBreaker(main.CIRCUIT_FAILURES, main.CIRCUIT_COOLDOWN)
+        try:
+            result = loop.run_until_complete(simulate(args))
+        finally:
+            loop.close()
+            asyncio.set_event_loop(None)
+            main.DATA_DIR, main.CLOCK, main.DELETE_EXECUTOR = saved_dir, saved_clock, saved_executor
+            main.reset_pending_index()
+    if args.jobqueue_sample:
+        result["scheduler"]["jobqueue_bytes_per_job"] = asyncio.run(
+            jobqueue_bytes_per_job(min(args.jobqueue_sample, args.pending))
+        )
+    return result
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Simulación en tiempo virtual de los borrados programados")
+    parser.add_argument("--pending", type=int, default=100_000, help="borrados programados en total")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--ttl", type=float, default=3 * 3600, help="segundos hasta el borrado (WELCOME_DELETE_SECONDS)")
+    parser.add_argument("--arrival-seconds", type=float, default=None, help="duración de las llegadas (por defecto, TTL)")
+    parser.add_argument("--restart-at", type=float, default=None, help="segundo virtual del reinicio (-1 = sin reinicio)")
+    parser.add_argument("--downtime", type=float, default=60.0, help="segundos caído durante el reinicio")
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="probabilidad de NetworkError por borrado")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="probabilidad de RetryAfter(1) por borrado")
+    parser.add_argument("--outage-at", type=float, default=0.0, help="inicio de una caída total de la API")
+    parser.add_argument("--outage-seconds", type=float, default=0.0)
+    parser.add_argument("--drain-seconds", type=float, default=3600.0, help="margen tras el último TTL")
+    parser.add_argument("--sample-every", type=float, default=None, help="segundos virtuales entre muestras")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false", help="más rápido, sin memoria")
+    parser.add_argument("--jobqueue-sample", type=int, default=20_000, help="trabajos medidos en la JobQueue real (0 = no)")
+    parser.add_argument("--series", action="store_true", help="incluye las muestras en el JSON")
+    parser.add_argument("-o", "--output", help="archivo JSON de salida (por defecto stdout)")
+    args = parser.parse_args()
+    if args.arrival_seconds is None:
+        args.arrival_seconds = args.ttl
+    if args.restart_at is None:
+        args.restart_at = args.arrival_seconds
+    if args.sample_every is None:
+        args.sample_every = max(1.0, (args.arrival_seconds + args.ttl) / 200)
+
+    logging.basicConfig(level=logging.ERROR)
+    report = {
+        "schema": SCHEMA_VERSION,
+        "meta": {"git_commit": _git_commit(), "timestamp": int(time.time())},
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "series")},
+        "results": run(args),
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main_cli()